@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# Benchmark: Kinesis reader CPU of JSON payloads vs. BSON payloads (PAYLOAD_FORMAT = "rows", "columns"
+# or "bson").
+#
+# Every Kinesis batch of --batch-sizes records (one payload of --records-per-payload telemetry records
+# each) goes through the reader's path from the base64 encoded Kinesis data to the RawBSONDocuments
+# handed to insert_many: base64 decode, unframe, json.loads or column decode, ts/_id conversion and BSON
+# encoding into the InsertBatcher for JSON payloads, slicing into RawBSONDocuments for BSON payloads.
+# The insert itself is left out, it sends the same bytes in every format.
+#
+# The Lambda layers only ship a macOS build of bson's C extension, so in Lambda bson encodes in pure
+# Python. The benchmark blocks the C extensions by default to measure that, --c-extensions allows them.
+# With --uri it also inserts the batches into a scratch collection and compares documents/s end to end.
+#
+# Usage: python3 benchmarks/bench_bson_payloads.py [--batch-sizes 1,10,50,100] [--c-extensions]
+#                                                 [--uri mongodb+srv://... --db benchdb]
+
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+import uuid
+
+if '--c-extensions' not in sys.argv:
+    # Must happen before bson is imported for the first time
+    sys.modules['bson._cbson'] = None
+    sys.modules['pymongo._cmessage'] = None
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'common-layer', 'python'))
+sys.path.insert(0, os.path.join(ROOT, 'kinesis-reader-lambda', 'code'))
+
+import bson  # noqa: E402
+
+from agri_common import framing  # noqa: E402
+from agri_common.bsonbatch import TelemetryBSONEncoder, raw_documents  # noqa: E402
+from agri_common.columnar import decode_columns, encode_columns  # noqa: E402
+from agri_common.encoder import TelemetryEncoder  # noqa: E402
+from agri_common.ids import ID_OBJECTID, to_object_ids  # noqa: E402
+from agri_common.telemetry import FIELDS, generate_batch  # noqa: E402
+from agri_common.timestamps import TS_EPOCH_MS, to_datetimes  # noqa: E402
+from insert_batcher import InsertBatcher  # noqa: E402
+
+REQUEST_ID = str(uuid.uuid4())
+FORMATS = ('rows', 'columns', 'bson')
+
+
+def kinesis_records(payload_format, nr_of_records, records_per_payload):
+    # Kinesis event records as the reader receives them, framed like the IOT Producer frames them
+    json_encoder = TelemetryEncoder()
+    bson_encoder = TelemetryBSONEncoder()
+    records = []
+    for i in range(nr_of_records):
+        batch = generate_batch(records_per_payload, REQUEST_ID, ts_format=TS_EPOCH_MS, id_format=ID_OBJECTID)
+        if payload_format == 'rows':
+            payload = bytes(json_encoder.encode(batch))
+        elif payload_format == 'columns':
+            payload = framing.frame(encode_columns(batch, FIELDS), content_format=framing.FORMAT_JSON_COLUMNS)
+        else:
+            payload = framing.frame(bytes(bson_encoder.encode(batch)), content_format=framing.FORMAT_BSON)
+        records.append({'sequenceNumber': str(i), 'data': base64.b64encode(payload).decode()})
+    return records
+
+
+def read(records, insert):
+    # The reader's per record work, as in kinesis-reader-lambda's lambda_handler
+    with InsertBatcher(insert, concurrency=1) as batcher:
+        for record in records:
+            content_format, body = framing.unframe(base64.b64decode(record['data']))
+            if content_format == framing.FORMAT_BSON:
+                batcher.add_raw(record['sequenceNumber'], raw_documents(body))
+                continue
+            documents = json.loads(body) if content_format == framing.FORMAT_JSON_ROWS else decode_columns(body)
+            to_datetimes(documents)
+            to_object_ids(documents)
+            batcher.add(record['sequenceNumber'], documents)
+        batcher.finish()
+    return batcher
+
+
+def offline(args):
+    print(f"bson C extension {'loaded' if bson.has_c() else 'blocked, pure Python like in Lambda'}, "
+          f"{args.records_per_payload} telemetry records per Kinesis record")
+    print(f"{'format':<8} {'batch':>6} {'payload bytes':>14} {'us/document':>12} {'documents/s':>12}")
+    for batch_size in args.batch_sizes:
+        baseline = None
+        for payload_format in FORMATS:
+            records = kinesis_records(payload_format, batch_size, args.records_per_payload)
+            nr_of_documents = batch_size * args.records_per_payload
+            payload_bytes = sum(len(base64.b64decode(record['data'])) for record in records) / batch_size
+            rounds = max(1, args.documents // nr_of_documents)
+            start = time.process_time()
+            for _ in range(rounds):
+                batcher = read(records, lambda documents: ((), ()))
+            elapsed = (time.process_time() - start) / (rounds * nr_of_documents)
+            if batcher.summary()['documents'] != nr_of_documents:
+                raise SystemExit(f"{payload_format}: {batcher.summary()['documents']} documents instead of {nr_of_documents}")
+            baseline = baseline or elapsed
+            print(f"{payload_format:<8} {batch_size:>6} {payload_bytes:>14,.0f} {elapsed * 1e6:>12.2f} "
+                  f"{1 / elapsed:>12,.0f}   {baseline / elapsed:>5.1f}x")
+
+
+def check(args):
+    # The BSON path stores the same documents as the JSON path
+    batch = generate_batch(args.records_per_payload, REQUEST_ID, ts_format=TS_EPOCH_MS, id_format=ID_OBJECTID)
+    documents = batch.records()
+    to_datetimes(documents)
+    to_object_ids(documents)
+    expected = [bson.encode(document) for document in documents]
+    stored = [bytes(raw.raw) for raw in raw_documents(bytes(TelemetryBSONEncoder().encode(batch)))]
+    if stored != expected:
+        raise SystemExit("BSON payload documents differ from the documents of the JSON path")
+
+
+def online(args):
+    from pymongo import MongoClient
+
+    collection = MongoClient(args.uri)[args.db]['bench_bson_payloads']
+    batch_size = max(args.batch_sizes)
+    try:
+        for payload_format in FORMATS:
+            collection.drop()
+            records = kinesis_records(payload_format, batch_size, args.records_per_payload)
+            start = time.perf_counter()
+            batcher = read(records, lambda documents: collection.insert_many(documents, ordered=False) and ((), ()))
+            elapsed = time.perf_counter() - start
+            print(f"  {payload_format:<8} {batcher.summary()['documents'] / elapsed:>10,.0f} documents/s "
+                  f"({batcher.summary()['round_trips']} round-trips)")
+    finally:
+        if not args.keep:
+            collection.drop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Kinesis reader CPU of JSON vs. BSON payloads')
+    parser.add_argument('--batch-sizes', default='1,10,50,100',
+                        type=lambda value: [int(size) for size in value.split(',')],
+                        help='Kinesis records per reader invocation (KINESIS_READER_BATCH_SIZE)')
+    parser.add_argument('--records-per-payload', type=int, default=200)
+    parser.add_argument('--documents', type=int, default=50000, help='documents read per measurement')
+    parser.add_argument('--c-extensions', action='store_true', help="use bson's C extension if installed")
+    parser.add_argument('--uri', default=os.environ.get('MONGODB_URI'), help='MongoDB to run the insert comparison on')
+    parser.add_argument('--db', default='benchdb')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch collection')
+    args = parser.parse_args()
+
+    check(args)
+    offline(args)
+    if args.uri:
+        print(f"\n{max(args.batch_sizes)} Kinesis records inserted into {args.db}:")
+        online(args)
+    else:
+        print("\nno --uri (or MONGODB_URI) given, skipping the insert comparison")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# Benchmark: compression ratio and CPU cost of the payload codecs on generated telemetry.
+# Payloads are packed to the byte budget the IOT producer uses, compressed with every available
+# codec/level and decompressed again the way the Kinesis reader does.
+#
+# Usage: python3 benchmarks/bench_compression.py [--payload-bytes 131072] [--payloads 20]
+
+import argparse
+import logging
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common-layer', 'python'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'iot-lambda', 'code'))
+
+from agri_common import framing  # noqa: E402
+from agri_common.encoder import TelemetryEncoder  # noqa: E402
+from agri_common.telemetry import generate_batch  # noqa: E402
+from payload_packer import PayloadPacker  # noqa: E402
+
+REQUEST_ID = str(uuid.uuid4())
+
+
+def packed_payloads(payload_bytes, count):
+    encoder = TelemetryEncoder()
+    packer = PayloadPacker(payload_bytes)
+    payloads = []
+    while len(payloads) < count:
+        for record in encoder.encode_records(generate_batch(200, REQUEST_ID)):
+            packed = packer.add(record)
+            if packed:
+                payloads.append(packed[0])
+    return payloads[:count]
+
+
+def cpu_time(function, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        function()
+    return (time.process_time() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Payload compression benchmark')
+    parser.add_argument('--payload-bytes', type=int, default=128 * 1024)
+    parser.add_argument('--payloads', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    # PayloadPacker logs every flush
+    logging.disable(logging.INFO)
+
+    payloads = packed_payloads(args.payload_bytes, args.payloads)
+    raw_bytes = sum(len(payload) for payload in payloads)
+    print(f"{len(payloads)} payloads, {raw_bytes / len(payloads):,.0f} bytes each uncompressed")
+
+    variants = [('zlib', level) for level in (1, 3, 6, 9)]
+    if framing.zstd_available():
+        variants += [('zstd', level) for level in (1, 3, 9)]
+    else:
+        print("zstandard is not installed, skipping zstd")
+
+    print(f"{'codec':<8} {'level':>5} {'ratio':>7} {'bytes/payload':>14} {'compress us':>12} {'decompress us':>14}")
+    for name, level in variants:
+        codec = framing.CODECS[name]
+        framed = [framing.frame(payload, codec, level=level) for payload in payloads]
+        for payload, frame in zip(payloads, framed):
+            assert framing.unframe(frame)[1] == payload
+        compressed_bytes = sum(len(frame) for frame in framed)
+        compress = cpu_time(lambda: [framing.frame(payload, codec, level=level) for payload in payloads], args.repeat)
+        decompress = cpu_time(lambda: [framing.unframe(frame) for frame in framed], args.repeat)
+        print(f"{name:<8} {level:>5} {raw_bytes / compressed_bytes:>7.2f} {compressed_bytes / len(payloads):>14,.0f} "
+              f"{compress / len(payloads) * 1e6:>12,.0f} {decompress / len(payloads) * 1e6:>14,.0f}")
+
+
+if __name__ == '__main__':
+    main()
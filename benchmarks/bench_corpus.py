@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# Benchmark: records/sec of replaying a pre-generated corpus against generating the records, both as
+# encoded JSON payloads (IOT producer) and as dicts (load generator).
+#
+# Usage: python3 benchmarks/bench_corpus.py [--records 200000] [--batch-size 200] [--seconds 3]
+
+import argparse
+import filecmp
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common-layer', 'python'))
+
+from agri_common.corpus import Corpus, CorpusReplay, write_corpus  # noqa: E402
+from agri_common.encoder import TelemetryEncoder  # noqa: E402
+from agri_common.telemetry import generate_batch  # noqa: E402
+
+REQUEST_ID = str(uuid.uuid4())
+
+
+def run(name, produce, batch_size, seconds):
+    records = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        produce(batch_size)
+        records += batch_size
+    elapsed = time.perf_counter() - start
+    rate = records / elapsed
+    print(f"{name:<28} {rate:>12,.0f} records/s")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Corpus replay benchmark')
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'telemetry.bin')
+        start = time.perf_counter()
+        write_corpus(path, args.records, args.seed)
+        print(f"corpus: {args.records:,} records, {os.path.getsize(path) / 2**20:.1f} MiB, "
+              f"built in {time.perf_counter() - start:.1f} s")
+        other = os.path.join(directory, 'again.bin')
+        write_corpus(other, args.records, args.seed)
+        print(f"same seed gives an identical corpus: {filecmp.cmp(path, other, shallow=False)}\n")
+
+        corpus = Corpus(path)
+        replay = CorpusReplay(corpus)
+        encoder = TelemetryEncoder()
+
+        generated = run("generate + encode", lambda n: encoder.encode(generate_batch(n, REQUEST_ID)), args.batch_size, args.seconds)
+        replayed = run("replay + encode", lambda n: encoder.encode(replay.next_batch(n, REQUEST_ID)), args.batch_size, args.seconds)
+        print(f"speedup: {replayed / generated:.1f}x\n")
+        generated = run("generate + records()", lambda n: generate_batch(n, REQUEST_ID).records(), args.batch_size, args.seconds)
+        replayed = run("replay + records()", lambda n: replay.next_batch(n, REQUEST_ID).records(), args.batch_size, args.seconds)
+        print(f"speedup: {replayed / generated:.1f}x")
+        del replay, corpus
+
+
+if __name__ == '__main__':
+    main()
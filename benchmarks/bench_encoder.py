@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# Benchmark: CPU per MQTT batch payload for the schema specialized encoder vs. records() + json.dumps.
+# That both produce the same bytes is checked by tests/test_encoder.py.
+#
+# Usage: python3 benchmarks/bench_encoder.py [--batch-size 200] [--seconds 3]
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common-layer', 'python'))
+
+from agri_common.encoder import TelemetryEncoder  # noqa: E402
+from agri_common.telemetry import generate_batch  # noqa: E402
+
+REQUEST_ID = str(uuid.uuid4())
+
+
+def run(name, encode, batches, seconds):
+    count = 0
+    total_bytes = 0
+    start = time.process_time()
+    end = start + seconds
+    while time.process_time() < end:
+        for batch in batches:
+            total_bytes += len(encode(batch))
+            count += 1
+    elapsed = time.process_time() - start
+    print(f"{name:<28} {elapsed / count * 1e6:>10,.1f} us CPU/batch  {total_bytes / elapsed / 1e6:>8,.1f} MB/s")
+    return elapsed / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Telemetry encoder benchmark')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    encoder = TelemetryEncoder()
+    batches = [generate_batch(args.batch_size, REQUEST_ID) for _ in range(20)]
+    legacy = run("records() + json.dumps", lambda batch: json.dumps(batch.records()).encode(), batches, args.seconds)
+    specialized = run("TelemetryEncoder.encode", encoder.encode, batches, args.seconds)
+    print(f"speedup: {legacy / specialized:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# Benchmark: memory and records/sec of the stateful fleet simulator against the random telemetry generator.
+#
+# Usage: python3 benchmarks/bench_fleet.py [--fleet-size 50000] [--batch-size 200] [--seconds 3]
+
+import argparse
+import datetime
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common-layer', 'python'))
+
+from agri_common.fleet import FleetSimulator  # noqa: E402
+from agri_common.telemetry import generate_batch  # noqa: E402
+
+REQUEST_ID = str(uuid.uuid4())
+
+
+def run(name, generate, batch_size, seconds):
+    records = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        generate(batch_size)
+        records += batch_size
+    elapsed = time.perf_counter() - start
+    rate = records / elapsed
+    print(f"{name:<28} {rate:>12,.0f} records/s")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fleet simulator benchmark')
+    parser.add_argument('--fleet-size', type=int, default=50000)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    fleet = FleetSimulator(args.fleet_size)
+    print(f"init:       {(time.perf_counter() - start) * 1000:.1f} ms for {args.fleet_size:,} vehicles")
+    # Touch every vehicle once so all of them carry state
+    now = datetime.datetime.now()
+    fleet.tick(args.fleet_size, REQUEST_ID, vehicles=range(args.fleet_size), now=now)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"state:      {fleet.memory_bytes() / 2**20:.1f} MiB ({fleet.memory_bytes() / args.fleet_size:.0f} bytes/vehicle), "
+          f"peak traced {peak / 2**20:.1f} MiB while reading the whole fleet once\n")
+
+    random_rate = run("random generator", lambda n: generate_batch(n, REQUEST_ID), args.batch_size, args.seconds)
+    fleet_rate = run("fleet simulator", lambda n: fleet.tick(n, REQUEST_ID), args.batch_size, args.seconds)
+    print(f"fleet simulator costs {random_rate / fleet_rate:.1f}x the CPU per record of the random generator")
+
+    # One vehicle over a few minutes of simulated time
+    print("\nvehicle 1, one reading per minute:")
+    for minute in range(1, 11):
+        record = fleet.tick(1, REQUEST_ID, vehicles=[0], now=now + datetime.timedelta(minutes=minute)).records()[0]
+        print(f"  +{minute:>2} min  engine {fleet.enginestate[0]}  speed {record['drivingspeed']:>2} km/h  "
+              f"pos {record['latitude']:>10.6f},{record['longitude']:>11.6f}  fuel {record['fuel_tank_level']:>3}%  "
+              f"engine temp {record['engine_temperature']:>6.2f}")
+
+
+if __name__ == '__main__':
+    main()
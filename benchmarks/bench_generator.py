@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# Benchmark: records/sec of the columnar telemetry generator against the original per-record generator.
+#
+# Usage: python3 benchmarks/bench_generator.py [--batch-size 200] [--seconds 3]
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common-layer', 'python'))
+
+from agri_common.telemetry import DROPOUT_RULES, generate_batch  # noqa: E402
+
+REQUEST_ID = str(uuid.uuid4())
+
+
+# The per-record generator as it was in iot-lambda and load-lambda, kept here as the baseline
+def legacy_generate_synthetic_data(num_records, request_id):
+    data = []
+
+    for _ in range(num_records):
+        current_time = datetime.datetime.now().isoformat()
+        record = {
+            "_id": str(uuid.uuid4()) + "-" + request_id,
+            'ts': current_time,
+            'vehicleid': random.randint(1, 50000),
+            'temperature': round(random.uniform(5.0, 40.0), 2),
+            'operatingtime': random.randint(0, 1000),
+            'fuelusage': round(random.uniform(0.0, 10.0), 2),
+            'front_linkage_position': random.randint(0, 100),
+            'drivingspeed': random.randint(0, 40),
+            'enginestate': random.choice([0, 1]),
+            'autopilot_system_state': random.choice([0, 1]),
+            'engine_load': round(random.uniform(0.0, 100.0), 2),
+            'latitude': round(random.uniform(-90.0, 90.0), 6),
+            'longitude': round(random.uniform(-180.0, 180.0), 6),
+            'altitude': round(random.uniform(0.0, 1000.0), 2),
+            'engine_rotation': round(random.uniform(0.0, 3000.0), 2),
+            'front_pme_shaft': round(random.uniform(0.0, 100.0), 2),
+            'rear_linkage_position': random.randint(0, 100),
+            'four_wheel_driving_state': random.choice(['Engaged', 'Disengaged']),
+            'fuel_tank_level': random.randint(0, 100),
+            'last_error_msg': random.choice(['No Error', 'Warning: Low Fuel Level', 'Error: Engine Overheating']),
+            'engine_temperature': round(random.uniform(60.0, 110.0), 2),
+            'connection_state': random.choice(['Connected', 'Disconnected']),
+            'lte_connection_level': round(random.uniform(0.0, 100.0), 2),
+            'mode': random.choice(['Normal', 'Eco', 'Work'])
+        }
+
+        if random.random() < 0.5:
+            record.pop('operatingtime')
+        if random.random() < 0.5:
+            record.pop('autopilot_system_state')
+        if random.random() < 0.5:
+            record.pop('enginestate')
+        if random.random() < 0.5:
+            record.pop('temperature')
+
+        if random.random() < 0.3:
+            record.pop('front_linkage_position')
+            record.pop('rear_linkage_position')
+            record.pop('engine_rotation')
+            record.pop('four_wheel_driving_state')
+        if random.random() < 0.4:
+            record.pop('front_pme_shaft')
+
+        data.append(record)
+
+    return data
+
+
+def run(name, generate, batch_size, seconds):
+    records = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        generate(batch_size)
+        records += batch_size
+    elapsed = time.perf_counter() - start
+    rate = records / elapsed
+    print(f"{name:<28} {rate:>12,.0f} records/s")
+    return rate
+
+
+def summarize(records):
+    # Value ranges and dropout rates, to check both generators produce the same distribution
+    summary = {}
+    for record in records:
+        for key, value in record.items():
+            if key in ('_id', 'ts'):
+                continue
+            if isinstance(value, str):
+                entry = summary.setdefault(key, [0, set()])
+                entry[1].add(value)
+            else:
+                entry = summary.setdefault(key, [0, value, value])
+                entry[1] = min(entry[1], value)
+                entry[2] = max(entry[2], value)
+            entry[0] += 1
+    return summary
+
+
+def describe(entry):
+    if len(entry) == 2:
+        return f"{len(entry[1])} values"
+    return f"[{entry[1]}, {entry[2]}]"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Telemetry generator benchmark')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    legacy = run("per-record (legacy)", lambda n: legacy_generate_synthetic_data(n, REQUEST_ID), args.batch_size, args.seconds)
+    columns = run("columnar, columns only", lambda n: generate_batch(n, REQUEST_ID), args.batch_size, args.seconds)
+    dicts = run("columnar + records()", lambda n: generate_batch(n, REQUEST_ID).records(), args.batch_size, args.seconds)
+    print(f"speedup: {columns / legacy:.1f}x (columns only), {dicts / legacy:.1f}x (with dicts)")
+
+    sample_size = 100000
+    legacy_summary = summarize(legacy_generate_synthetic_data(sample_size, REQUEST_ID))
+    columnar_summary = summarize(generate_batch(sample_size, REQUEST_ID).records())
+    optional = {field for _, fields in DROPOUT_RULES for field in fields}
+    print(f"\n{'field':<26} {'present legacy':>15} {'present new':>12}  range legacy / new")
+    for field, entry in legacy_summary.items():
+        new_entry = columnar_summary[field]
+        marker = '*' if field in optional else ' '
+        print(f"{marker}{field:<25} {entry[0] / sample_size:>15.3f} {new_entry[0] / sample_size:>12.3f}  "
+              f"{describe(entry)} / {describe(new_entry)}")
+
+
+if __name__ == '__main__':
+    main()
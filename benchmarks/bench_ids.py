@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# Benchmark: uuid string _ids vs. time ordered ObjectIds (ID_FORMAT = "uuid" vs. "objectid").
+#
+# The documents of --producers concurrent producers (Lambdas with their own ObjectId process value) are
+# interleaved batch by batch, as they arrive at MongoDB. Without a database it compares the cost of
+# generating the ids, their BSON size and how many inserts land in the _id index right behind the
+# previous id of the same producer instead of on a random page. With --uri it inserts the
+# documents into two scratch collections and compares insert throughput and the size of the _id index.
+# The scratch collections are dropped afterwards.
+#
+# Usage: python3 benchmarks/bench_ids.py [--records 100000] [--producers 4] [--uri mongodb+srv://... --db benchdb]
+
+import argparse
+import bisect
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common-layer', 'python'))
+
+import bson  # noqa: E402
+
+from agri_common.ids import ID_FORMATS, ID_OBJECTID, ObjectIdGenerator, to_object_ids  # noqa: E402
+from agri_common.telemetry import _ids, generate_batch  # noqa: E402
+
+BATCH_SIZE = 200
+
+
+def id_batches(id_format, records, producers):
+    # Batches of ids in arrival order: producers take turns, every producer with its own generator
+    rng = random.Random(42)
+    generators = [ObjectIdGenerator() for _ in range(producers)]
+    request_ids = [str(uuid.uuid4()) for _ in range(producers)]
+    batches = []
+    for i in range(max(records // BATCH_SIZE, 1)):
+        producer = i % producers
+        if id_format == ID_OBJECTID:
+            # Every generator draws its own process value, like a separate Lambda
+            batches.append(generators[producer].hex_ids(BATCH_SIZE))
+        else:
+            batches.append(_ids(rng, BATCH_SIZE, request_ids[producer]))
+    return batches
+
+
+def sequential_ratio(batches, producers):
+    # Share of ids that land in the index right behind the previous id of the same producer, i.e. on the
+    # leaf page that producer wrote last instead of a random page of the B-tree
+    seen = []
+    last = [None] * producers
+    sequential = 0
+    total = 0
+    for i, batch in enumerate(batches):
+        producer = i % producers
+        for value in batch:
+            position = bisect.bisect(seen, value)
+            sequential += position > 0 and seen[position - 1] == last[producer]
+            seen.insert(position, value)
+            last[producer] = value
+            total += 1
+    return sequential / total
+
+
+def offline(args):
+    print(f"{args.producers} producers, batches of {BATCH_SIZE}:")
+    for id_format in ID_FORMATS:
+        rounds = max(args.records // BATCH_SIZE, 1)
+        rng = random.Random(1)
+        generator = ObjectIdGenerator()
+        start = time.perf_counter()
+        for _ in range(rounds):
+            if id_format == ID_OBJECTID:
+                generator.hex_ids(BATCH_SIZE)
+            else:
+                _ids(rng, BATCH_SIZE, 'request')
+        generate_us = (time.perf_counter() - start) / (rounds * BATCH_SIZE) * 1e6
+
+        docs = [{'_id': value} for value in id_batches(id_format, BATCH_SIZE, 1)[0]]
+        if id_format == ID_OBJECTID:
+            start = time.perf_counter()
+            to_object_ids(docs)
+            convert_us = (time.perf_counter() - start) / len(docs) * 1e6
+        else:
+            convert_us = 0.0
+        id_size = len(bson.encode(docs[0])) - len(bson.encode({}))
+        sequential = sequential_ratio(id_batches(id_format, min(args.records, 50000), args.producers), args.producers)
+        print(f"  {id_format:<9} generate {generate_us:>5.2f} us/id   convert {convert_us:>5.2f} us/id   "
+              f"{id_size:>3} bytes per _id element   {sequential:>6.1%} inserted behind the producer's previous id")
+
+
+def online(args):
+    from pymongo import MongoClient
+
+    db = MongoClient(args.uri)[args.db]
+    results = {}
+    try:
+        for id_format in ID_FORMATS:
+            collection = db[f"bench_ids_{id_format}"]
+            collection.drop()
+            batches = []
+            for ids in id_batches(id_format, args.records, args.producers):
+                docs = generate_batch(len(ids), 'request').records()
+                for doc, value in zip(docs, ids):
+                    doc['_id'] = value
+                if id_format == ID_OBJECTID:
+                    to_object_ids(docs)
+                batches.append(docs)
+            start = time.perf_counter()
+            for docs in batches:
+                collection.insert_many(docs, ordered=False)
+            elapsed = time.perf_counter() - start
+            stats = db.command('collStats', collection.name)
+            results[id_format] = stats['indexSizes']['_id_']
+            print(f"  {id_format:<9} insert {args.records / elapsed:>8,.0f} docs/s   "
+                  f"_id index {results[id_format] / 2**10:>8,.0f} KiB   "
+                  f"data {stats['size'] / 2**20:>6.1f} MiB")
+    finally:
+        if not args.keep:
+            for id_format in ID_FORMATS:
+                db.drop_collection(f"bench_ids_{id_format}")
+    print(f"  _id index size objectid/uuid: {results[ID_OBJECTID] / results['uuid']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='uuid string _ids vs. time ordered ObjectIds')
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--producers', type=int, default=4, help='concurrent producers whose batches interleave')
+    parser.add_argument('--uri', default=os.environ.get('MONGODB_URI'), help='MongoDB to run the insert comparison on')
+    parser.add_argument('--db', default='benchdb')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch collections')
+    args = parser.parse_args()
+
+    offline(args)
+    if args.uri:
+        print(f"\n{args.records:,} documents per format inserted into {args.db}:")
+        online(args)
+    else:
+        print("\nno --uri (or MONGODB_URI) given, skipping the insert throughput and index size comparison")
+
+
+if __name__ == '__main__':
+    main()
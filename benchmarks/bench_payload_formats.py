@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# Benchmark: payload size, producer encode CPU and Kinesis reader decode CPU of the row and columnar
+# batch formats. Every decoded columnar batch is checked against the generated documents first.
+#
+# Usage: python3 benchmarks/bench_payload_formats.py [--batch-size 200] [--repeat 200]
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common-layer', 'python'))
+
+from agri_common.columnar import decode_columns, encode_columns  # noqa: E402
+from agri_common.encoder import TelemetryEncoder  # noqa: E402
+from agri_common.telemetry import FIELDS, generate_batch  # noqa: E402
+
+REQUEST_ID = str(uuid.uuid4())
+
+
+def cpu_time(function, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        function()
+    return (time.process_time() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Row vs. columnar payload format benchmark')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    batch = generate_batch(args.batch_size, REQUEST_ID)
+    documents = batch.records()
+    encoder = TelemetryEncoder()
+    rows = bytes(encoder.encode(batch))
+    columns = encode_columns(batch, FIELDS)
+    if decode_columns(columns) != documents or json.loads(rows) != documents:
+        raise SystemExit("decoded documents differ from the generated documents")
+
+    results = [
+        ("rows", len(rows), cpu_time(lambda: encoder.encode(batch), args.repeat), cpu_time(lambda: json.loads(rows), args.repeat)),
+        ("columns", len(columns), cpu_time(lambda: encode_columns(batch, FIELDS), args.repeat), cpu_time(lambda: decode_columns(columns), args.repeat)),
+    ]
+    print(f"{args.batch_size} records per payload")
+    print(f"{'format':<8} {'bytes':>9} {'bytes/record':>13} {'encode us':>10} {'decode us':>10}")
+    for name, size, encode, decode in results:
+        print(f"{name:<8} {size:>9,} {size / args.batch_size:>13,.0f} {encode * 1e6:>10,.0f} {decode * 1e6:>10,.0f}")
+    print(f"columnar payloads are {1 - len(columns) / len(rows):.0%} smaller")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# Benchmark: throughput of the real IOT producer lambda_handler against the in-process loopback publisher.
+#
+# The producer is configured through the same environment variables as in the stack. IOT_PUBLISHER=loopback
+# replaces IOT Core and skips all AWS calls, RUN_SECONDS bounds the handler's loop. The generate, serialize,
+# frame and publish stages are wrapped to account the CPU time the handler's thread spends in them, the
+# generation worker processes (GENERATION_WORKERS) report their own CPU time.
+# Requires awscrt and awsiotsdk locally (pip install awscrt==0.16.18 awsiotsdk==1.15.1, the versions in the layer).
+#
+# Usage: python3 benchmarks/bench_producer.py [--seconds 10] [--ack-delay 0] [--set PAYLOAD_FORMAT=columns ...]
+
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import time
+import uuid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+class Context:
+    # The parts of the Lambda context object the producer uses
+
+    def __init__(self, seconds):
+        self.aws_request_id = str(uuid.uuid4())
+        self.function_name = 'bench_producer'
+        self.deadline = time.monotonic() + seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(int((self.deadline - time.monotonic()) * 1000), 0)
+
+
+class StageTimer:
+    # Wraps functions and accounts the CPU time of the calling thread spent in them per stage
+
+    def __init__(self):
+        self.cpu = {}
+        self.calls = {}
+        self._active = None
+
+    def wrap(self, stage, function):
+        def wrapper(*args, **kwargs):
+            if self._active:
+                # Nested stages are accounted to the outermost one
+                return function(*args, **kwargs)
+            self._active = stage
+            started = time.thread_time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.cpu[stage] = self.cpu.get(stage, 0.0) + time.thread_time() - started
+                self.calls[stage] = self.calls.get(stage, 0) + 1
+                self._active = None
+        return wrapper
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IOT producer throughput benchmark (loopback publisher)')
+    parser.add_argument('--seconds', type=int, default=10)
+    parser.add_argument('--ack-delay', type=float, default=0.0, help='emulated PUBACK latency in seconds')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='producer environment variable, e.g. PAYLOAD_FORMAT=columns or COMPRESSION=zlib')
+    parser.add_argument('--verbose', action='store_true', help="show the producer's own log output")
+    args = parser.parse_args()
+
+    os.environ.update({
+        'IOT_PUBLISHER': 'loopback',
+        'LOOPBACK_ACK_DELAY': str(args.ack_delay),
+        'RUN_SECONDS': str(args.seconds),
+        'IOT_TOPIC': 'bench',
+        'METRICS_FLUSH_INTERVAL': str(10 ** 9),
+    })
+    for setting in args.set:
+        name, _, value = setting.partition('=')
+        os.environ[name] = value
+
+    devnull = open(os.devnull, 'w')
+    if not args.verbose:
+        # Keep the producer's logging at the level it uses in Lambda (it is part of its cost) but out of the terminal
+        logging.basicConfig(level=logging.INFO, stream=devnull)
+
+    sys.path.insert(0, os.path.join(ROOT, 'common-layer', 'python'))
+    sys.path.insert(0, os.path.join(ROOT, 'iot-lambda', 'code'))
+    import lambda_function as producer  # noqa: E402
+
+    producer.metrics.emit = lambda document: None
+
+    stages = StageTimer()
+    producer.generate_synthetic_data = stages.wrap('generate', producer.generate_synthetic_data)
+    producer.encoder.encode = stages.wrap('serialize', producer.encoder.encode)
+    producer.encoder.encode_records = stages.wrap('serialize', producer.encoder.encode_records)
+    producer.encode_columns = stages.wrap('serialize', producer.encode_columns)
+    producer.frame_payload = stages.wrap('frame', producer.frame_payload)
+    producer.publish_payload = stages.wrap('publish', producer.publish_payload)
+    connections = []
+    connect_mqtt = producer.connect_mqtt
+    pools = []
+    worker_pool = producer.WorkerPool
+    producer.WorkerPool = lambda *args, **kwargs: pools.append(worker_pool(*args, **kwargs)) or pools[-1]
+    producer.connect_mqtt = lambda client_id: connections.append(connect_mqtt(client_id)) or connections[-1]
+
+    settings = ', '.join(args.set) or 'defaults'
+    print(f"running the producer for {args.seconds}s against the loopback publisher ({settings})")
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+        # RUN_SECONDS bounds the run, the context only has to outlast it by the safety margin
+        producer.lambda_handler({}, Context(args.seconds + 60))
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    workers_cpu = sum(pool.cpu_time() for pool in pools)
+
+    stats = connections[0].stats()
+    print(f"records/s:  {stats['published_records'] / elapsed:>12,.0f}")
+    print(f"payloads/s: {stats['published'] / elapsed:>12,.1f}")
+    print(f"MiB/s:      {stats['published_bytes'] / elapsed / 2**20:>12,.2f}  "
+          f"({stats['published_bytes'] / max(stats['published'], 1) / 1024:.1f} KiB per payload)")
+    print(f"\nCPU time of the handler's thread per stage ({elapsed:.1f}s wall):")
+    for stage in ('generate', 'serialize', 'frame', 'publish'):
+        if stage in stages.cpu:
+            print(f"  {stage:<10} {stages.cpu[stage]:>8.2f}s {stages.cpu[stage] / elapsed:>7.1%}  "
+                  f"{stages.cpu[stage] / stages.calls[stage] * 1e6:>9.0f} us/call")
+    print(f"  {'process':<10} {cpu:>8.2f}s {cpu / elapsed:>7.1%}  (all threads)")
+    if pools:
+        print(f"  {'workers':<10} {workers_cpu:>8.2f}s {workers_cpu / elapsed:>7.1%}  (generation worker processes)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# Benchmark: ts as iso string vs. BSON datetime (TS_FORMAT = "iso" vs. "epoch_ms"), and a time series
+# collection (MONGODB_TIMESERIES).
+#
+# Without a database it compares the BSON size of the documents and of the {vehicleid, ts} index keys,
+# and the cost of the reader's bulk conversion of epoch milliseconds to BSON datetimes. With --uri it loads
+# the same telemetry into three scratch collections, one per format and a time series collection with
+# datetimes, creates the {vehicleid: 1, ts: 1} index the query functions use, and compares storage and
+# index sizes and the latency of the query function's aggregation. The scratch collections are dropped
+# afterwards.
+#
+# Usage: python3 benchmarks/bench_ts.py [--records 20000] [--uri mongodb+srv://... --db benchdb --queries 200]
+
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common-layer', 'python'))
+
+import bson  # noqa: E402
+
+from agri_common import timeseries  # noqa: E402
+from agri_common.telemetry import generate_batch  # noqa: E402
+from agri_common.timestamps import TS_EPOCH_MS, TS_FORMATS, TS_ISO, since, to_datetimes  # noqa: E402
+
+REQUEST_ID = str(uuid.uuid4())
+BATCH_SIZE = 200
+FLEET_SIZE = 50000
+TIMESERIES = 'timeseries'
+# (collection suffix, ts format of the documents, time series collection)
+VARIANTS = ((TS_ISO, TS_ISO, False), (TS_EPOCH_MS, TS_EPOCH_MS, False), (TIMESERIES, TS_EPOCH_MS, True))
+
+
+def documents(ts_format, records, span, seed):
+    # The same records for both formats: batches spread evenly over the last `span` seconds
+    rng = random.Random(seed)
+    end = datetime.datetime.now()
+    nr_of_batches = max(records // BATCH_SIZE, 1)
+    docs = []
+    for i in range(nr_of_batches):
+        now = end - datetime.timedelta(seconds=span * (nr_of_batches - i) / nr_of_batches)
+        docs.extend(generate_batch(BATCH_SIZE, REQUEST_ID, rng=rng, now=now, ts_format=ts_format).records())
+    if ts_format == TS_EPOCH_MS:
+        to_datetimes(docs)
+    return docs
+
+
+def offline(records):
+    print("BSON sizes:")
+    for ts_format in TS_FORMATS:
+        docs = documents(ts_format, records, 3600, 42)
+        document_size = sum(len(bson.encode(doc)) for doc in docs) / len(docs)
+        key_size = sum(len(bson.encode({'v': doc['vehicleid'], 't': doc['ts']})) for doc in docs) / len(docs)
+        print(f"  {ts_format:<9} {document_size:>7.1f} bytes/document   {key_size:>5.1f} bytes per {{vehicleid, ts}} key")
+
+    docs = generate_batch(BATCH_SIZE, REQUEST_ID, ts_format=TS_EPOCH_MS).records()
+    rounds = max(records // BATCH_SIZE, 1)
+    batches = [[dict(doc) for doc in docs] for _ in range(rounds)]
+    start = time.perf_counter()
+    for batch in batches:
+        to_datetimes(batch)
+    elapsed = time.perf_counter() - start
+    print(f"\nreader conversion to BSON datetimes: {elapsed / (rounds * BATCH_SIZE) * 1e6:.2f} us/document")
+
+
+def online(args):
+    from pymongo import ASCENDING, MongoClient
+
+    db = MongoClient(args.uri)[args.db]
+    results = {}
+    try:
+        for name, ts_format, is_timeseries in VARIANTS:
+            collection = db[f"bench_ts_{name}"]
+            collection.drop()
+            if is_timeseries:
+                timeseries.ensure_collection(db, collection.name, args.granularity)
+            docs = documents(ts_format, args.records, args.span, 42)
+            start = time.perf_counter()
+            for i in range(0, len(docs), 1000):
+                collection.insert_many(docs[i:i + 1000], ordered=False)
+            load = time.perf_counter() - start
+            collection.create_index([('vehicleid', ASCENDING), ('ts', ASCENDING)])
+            stats = db.command('collStats', collection.name)
+            index_size = stats['indexSizes'].get('vehicleid_1_ts_1', 0)
+
+            rng = random.Random(7)
+            latencies = []
+            for _ in range(args.queries):
+                started = time.perf_counter()
+                list(collection.aggregate([
+                    {'$match': {'ts': since(ts_format, args.window), 'vehicleid': rng.randint(1, FLEET_SIZE)}},
+                    {'$group': {'_id': None, 'avg_speed': {'$avg': '$drivingspeed'}}},
+                ]))
+                latencies.append((time.perf_counter() - started) * 1000)
+            latencies.sort()
+            results[name] = (index_size, stats['storageSize'])
+            print(f"  {name:<10} load {len(docs) / load:>8,.0f} docs/s   storage {stats['storageSize'] / 2**10:>8,.0f} KiB   "
+                  f"index {index_size / 2**10:>8,.0f} KiB   query p50 {statistics.median(latencies):>6.2f} ms   "
+                  f"p95 {latencies[int(len(latencies) * 0.95) - 1]:>6.2f} ms")
+    finally:
+        if not args.keep:
+            for name, _, _ in VARIANTS:
+                db.drop_collection(f"bench_ts_{name}")
+    if results.get(TS_ISO) and results[TS_ISO][0]:
+        print(f"  index size epoch_ms/iso: {results[TS_EPOCH_MS][0] / results[TS_ISO][0]:.2f}")
+    if results.get(TS_EPOCH_MS) and results[TS_EPOCH_MS][1]:
+        print(f"  storage size timeseries/epoch_ms: {results[TIMESERIES][1] / results[TS_EPOCH_MS][1]:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ts as iso string vs. BSON datetime')
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--uri', default=os.environ.get('MONGODB_URI'), help='MongoDB to run the index and query comparison on')
+    parser.add_argument('--db', default='benchdb')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--span', type=int, default=3600, help='seconds the loaded records are spread over')
+    parser.add_argument('--window', type=int, default=300, help='seconds of the queried time range')
+    parser.add_argument('--granularity', default='seconds', choices=timeseries.GRANULARITIES,
+                        help='bucket granularity of the time series collection')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch collections')
+    args = parser.parse_args()
+
+    offline(args.records)
+    if args.uri:
+        print(f"\n{args.records:,} documents per collection in {args.db}, {args.queries} queries over the last {args.window}s:")
+        online(args)
+    else:
+        print("\nno --uri (or MONGODB_URI) given, skipping the index size and query latency comparison")
+
+
+if __name__ == '__main__':
+    main()
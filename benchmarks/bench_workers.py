@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# Benchmark: records/sec of generating and encoding telemetry payloads in 0..K worker processes
+# (agri_common.workers), with the parent only receiving the payloads like the IOT producer does.
+#
+# Usage: python3 benchmarks/bench_workers.py [--max-workers 4] [--batch-size 200] [--seconds 3]
+
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common-layer', 'python'))
+
+from agri_common.encoder import TelemetryEncoder  # noqa: E402
+from agri_common.telemetry import generate_batch  # noqa: E402
+from agri_common.workers import WorkerPool  # noqa: E402
+
+REQUEST_ID = str(uuid.uuid4())
+
+
+def payload_factory(batch_size):
+    def factory(index, nr_of_workers):
+        encoder = TelemetryEncoder()
+
+        def produce(request):
+            if request is None:
+                return b'', 0
+            return bytes(encoder.encode(generate_batch(batch_size, REQUEST_ID))), batch_size
+
+        return produce
+
+    return factory
+
+
+def run(nr_of_workers, batch_size, seconds):
+    produce = payload_factory(batch_size)(0, 1)
+    pool = None
+    if nr_of_workers:
+        pool = WorkerPool(nr_of_workers, payload_factory(batch_size))
+        pool.start()
+        produce = lambda request: pool.next()  # noqa: E731
+    records = 0
+    payload_bytes = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        payload, nr_of_records = produce(True)
+        records += nr_of_records
+        payload_bytes += len(payload)
+    elapsed = time.perf_counter() - start
+    if pool:
+        pool.close()
+    rate = records / elapsed
+    name = f"{nr_of_workers} workers" if nr_of_workers else "in process"
+    print(f"{name:<14} {rate:>12,.0f} records/s {payload_bytes / elapsed / 2**20:>8.1f} MiB/s")
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generation worker benchmark')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs")
+    baseline = run(0, args.batch_size, args.seconds)
+    for nr_of_workers in range(1, args.max_workers + 1):
+        rate = run(nr_of_workers, args.batch_size, args.seconds)
+        print(f"{'':<14} {rate / baseline:>11.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2 @@
+# Shared helpers for the agricultural IOT demo Lambda functions.
+# This package is deployed as the AgriCommonLambdaLayer and attached to every function that needs it.
@@ -0,0 +1,146 @@
+# BSON payloads: the documents of a batch as concatenated BSON documents, ready to be inserted.
+#
+# TelemetryBSONEncoder turns a TelemetryBatch into the bytes bson.encode() would produce for the
+# documents the Kinesis reader stores from a JSON payload: epoch millisecond ts values become BSON
+# datetimes and 24 digit hex _ids ObjectIds, the conversions the reader applies to JSON payloads. It needs
+# no bson package (the IOT Producer's layer has none) and, like agri_common.encoder, builds the element
+# of every distinct key/value once and writes the records column by column.
+#
+# raw_documents() slices such a body into RawBSONDocuments for insert_many, without decoding or
+# re-encoding the documents. Where bson runs as pure Python (the layers ship no Linux build of its C
+# extension) the documents are zero-copy memoryviews of the body, the C extension only accepts bytes.
+
+import struct
+
+from agri_common.encoder import ENUM_FIELDS, MAX_FRAGMENT_TABLE_SIZE
+from agri_common.ids import OBJECTID_HEX_LENGTH
+from agri_common.telemetry import FIELDS
+
+BSON_DOUBLE = b'\x01'
+BSON_STRING = b'\x02'
+BSON_OBJECTID = b'\x07'
+BSON_DATETIME = b'\x09'
+BSON_INT32 = b'\x10'
+BSON_INT64 = b'\x12'
+
+INT32 = struct.Struct('<i')
+INT64 = struct.Struct('<q')
+DOUBLE = struct.Struct('<d')
+
+INT32_MIN = -2 ** 31
+INT32_MAX = 2 ** 31 - 1
+
+
+def _string(value):
+    data = value.encode()
+    return INT32.pack(len(data) + 1) + data + b'\x00'
+
+
+def _value(value):
+    # (type byte, encoded value) of the types the telemetry records hold, like bson.encode()
+    if type(value) is str:
+        return BSON_STRING, _string(value)
+    if type(value) is float:
+        return BSON_DOUBLE, DOUBLE.pack(value)
+    if type(value) is int:
+        if INT32_MIN <= value <= INT32_MAX:
+            return BSON_INT32, INT32.pack(value)
+        return BSON_INT64, INT64.pack(value)
+    raise TypeError(f"Cannot encode {type(value).__name__} values in a BSON payload")
+
+
+def _id_value(value):
+    # ObjectId hex strings become ObjectIds, as agri_common.ids.to_object_ids() does in the reader
+    if type(value) is str and len(value) == OBJECTID_HEX_LENGTH:
+        try:
+            return BSON_OBJECTID, bytes.fromhex(value)
+        except ValueError:
+            pass
+    return _value(value)
+
+
+def _ts_value(value):
+    # Epoch milliseconds become BSON datetimes, as agri_common.timestamps.to_datetimes() does in the reader
+    if type(value) is int:
+        return BSON_DATETIME, INT64.pack(value)
+    return _value(value)
+
+
+class TelemetryBSONEncoder:
+
+    def __init__(self, fields=FIELDS):
+        self.fields = fields
+        self.names = {field: field.encode() + b'\x00' for field in fields}
+        self.fragments = {field: {} for field in fields}
+        self.buffer = bytearray()
+
+    def _element(self, field, value):
+        if field == '_id':
+            kind, data = _id_value(value)
+        elif field == 'ts':
+            kind, data = _ts_value(value)
+        else:
+            kind, data = _value(value)
+        return kind + self.names[field] + data
+
+    def _column_fragments(self, field, values):
+        # Encode one column into elements, one per record
+        element = self._element
+        if field == '_id':
+            return [element(field, value) for value in values]
+        table = self.fragments[field]
+        if field in ENUM_FIELDS or field == 'ts' or len(table) < MAX_FRAGMENT_TABLE_SIZE:
+            for value in set(values).difference(table):
+                table[value] = element(field, value)
+            return [table[value] for value in values]
+        get = table.get
+        return [get(value) or element(field, value) for value in values]
+
+    def encode_records(self, batch):
+        # Encode every record of a TelemetryBatch into its own BSON document, returns a list of bytes
+        columns = []
+        for field in self.fields:
+            fragments = self._column_fragments(field, batch.columns[field])
+            dropped = batch.dropped.get(field)
+            if dropped is not None:
+                fragments = [b'' if is_dropped else fragment for fragment, is_dropped in zip(fragments, dropped)]
+            columns.append(fragments)
+        join = b''.join
+        pack = INT32.pack
+        records = []
+        for row in zip(*columns):
+            elements = join(row)
+            # Length prefix includes itself and the terminating zero byte
+            records.append(pack(len(elements) + 5) + elements + b'\x00')
+        return records
+
+    def encode(self, batch):
+        # Encode a TelemetryBatch as concatenated BSON documents into the reusable buffer and return the
+        # buffer. The returned bytearray is overwritten by the next call to encode().
+        buffer = self.buffer
+        del buffer[:]
+        for record in self.encode_records(batch):
+            buffer += record
+        return buffer
+
+
+def raw_documents(body):
+    # Slice concatenated BSON documents into RawBSONDocuments, returns a list
+    import bson
+    from bson.raw_bson import RawBSONDocument
+
+    data = memoryview(body) if not bson.has_c() else bytes(body)
+    unpack = INT32.unpack_from
+    documents = []
+    position = 0
+    end = len(data)
+    while position < end:
+        if end - position < 5:
+            raise ValueError(f"Truncated BSON payload at byte {position}")
+        length = unpack(data, position)[0]
+        if length < 5 or position + length > end:
+            raise ValueError(f"Invalid BSON document length {length} at byte {position}")
+        # RawBSONDocument checks the length prefix and the terminating zero byte of the document
+        documents.append(RawBSONDocument(data[position:position + length]))
+        position += length
+    return documents
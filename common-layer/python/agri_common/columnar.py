@@ -0,0 +1,86 @@
+# Columnar (struct of arrays) batch format.
+#
+# Instead of a JSON array of documents, which repeats every field name in every record, a columnar
+# batch is one JSON object:
+#
+#   {"v": 1, "n": <records>, "fields": [<field>, ...], "columns": [[<values>], ...],
+#    "present": {<optional field>: "<base64 presence bitmap>"}}
+#
+# columns[i] holds the values of fields[i]. For a field listed in "present" only the values of the
+# records that have the field are stored; bit j (least significant bit first) of its bitmap tells
+# whether record j has it. Fields without a bitmap are present in every record.
+
+import base64
+import json
+from itertools import compress
+
+COLUMNAR_VERSION = 1
+
+
+def _bitmap(flags):
+    # Encode a sequence of bools as a little endian bitmap
+    n = len(flags)
+    if not n:
+        return ''
+    value = int(''.join(['1' if flag else '0' for flag in reversed(flags)]), 2)
+    return base64.b64encode(value.to_bytes((n + 7) // 8, 'little')).decode('ascii')
+
+
+def _flags(bitmap, n):
+    # Decode a bitmap into a string of '0'/'1' characters, one per record
+    value = int.from_bytes(base64.b64decode(bitmap), 'little')
+    return format(value, 'b').zfill(n)[::-1][:n]
+
+
+def encode_columns(batch, fields):
+    # Encode a TelemetryBatch (or anything with .size, .columns and .dropped) as columnar JSON bytes
+    columns = []
+    present = {}
+    for field in fields:
+        values = batch.columns[field]
+        dropped = batch.dropped.get(field)
+        if dropped is None:
+            columns.append(list(values))
+        else:
+            flags = [not is_dropped for is_dropped in dropped]
+            columns.append(list(compress(values, flags)))
+            present[field] = _bitmap(flags)
+    return json.dumps({
+        'v': COLUMNAR_VERSION,
+        'n': batch.size,
+        'fields': list(fields),
+        'columns': columns,
+        'present': present,
+    }, separators=(',', ':')).encode()
+
+
+def decode_columns(body):
+    # Decode a columnar batch into a list of documents.
+    # Fields present in every record are zipped into the documents in one pass, optional fields are then
+    # added only to the records their bitmap selects.
+    batch = json.loads(body)
+    if batch.get('v') != COLUMNAR_VERSION:
+        raise ValueError(f"Unsupported columnar batch version {batch.get('v')}")
+    n = batch['n']
+    present = batch['present']
+
+    required_fields = []
+    required_columns = []
+    optional = []
+    for field, values in zip(batch['fields'], batch['columns']):
+        if field in present:
+            optional.append((field, values, present[field]))
+        else:
+            required_fields.append(field)
+            required_columns.append(values)
+
+    if required_fields:
+        documents = [dict(zip(required_fields, values)) for values in zip(*required_columns)]
+    else:
+        documents = [{} for _ in range(n)]
+
+    for field, values, bitmap in optional:
+        selected = compress(documents, map(int, _flags(bitmap, n)))
+        for document, value in zip(selected, values):
+            document[field] = value
+    return documents
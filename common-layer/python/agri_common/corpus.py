@@ -0,0 +1,178 @@
+# Pre-generated telemetry corpus and replay.
+#
+# write_corpus() draws a seeded sequence of batches with generate_batch() and stores every column in a
+# binary file. Corpus memory-maps that file and hands out TelemetryBatch slices whose columns are
+# zero-copy memoryviews into the mapping; only '_id' and 'ts' are created fresh for every batch. Replaying
+# costs a fraction of generating, and two corpora built with the same seed hold the same workload.
+#
+# File layout (little endian):
+#
+#   magic (8 bytes) | index length (uint32) | JSON index | padding | column data ...
+#
+# The index holds the number of records, the seed and per column its offset, array typecode and, for
+# string fields, the list of values the stored codes refer to. The dropout masks of DROPOUT_RULES are
+# stored as one byte per record under "masks". Every column starts at a multiple of 8 bytes.
+
+import json
+import mmap
+import random
+import struct
+from array import array
+
+from agri_common.encoder import ENUM_FIELDS
+from agri_common.telemetry import DROPOUT_RULES, FIELDS, TelemetryBatch, _ids, generate_batch
+from agri_common.ids import ID_UUID
+from agri_common.timestamps import TS_ISO, ts_column
+
+CORPUS_MAGIC = b'\x89AGRCORP'
+CORPUS_VERSION = 1
+HEADER = struct.Struct('<8sI')
+
+# Fields created per batch instead of being stored
+PATCHED_FIELDS = ('_id', 'ts')
+
+# Integer columns fit into 32 bit, decimals are stored as doubles
+INT_TYPECODE = 'i'
+FLOAT_TYPECODE = 'd'
+CODE_TYPECODE = 'B'
+
+DEFAULT_CHUNK_SIZE = 10000
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def write_corpus(path, num_records, seed, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Generate num_records records with a random.Random(seed) and write them to path
+    rng = random.Random(seed)
+    stored = [field for field in FIELDS if field not in PATCHED_FIELDS]
+    columns = {}
+    masks = [array(CODE_TYPECODE) for _ in DROPOUT_RULES]
+    codes = {field: {value: code for code, value in enumerate(values)} for field, values in ENUM_FIELDS.items()}
+
+    written = 0
+    while written < num_records:
+        batch = generate_batch(min(chunk_size, num_records - written), '', rng=rng)
+        for field in stored:
+            values = batch.columns[field]
+            column = columns.get(field)
+            if column is None:
+                if field in codes:
+                    typecode = CODE_TYPECODE
+                elif isinstance(values[0], float):
+                    typecode = FLOAT_TYPECODE
+                else:
+                    typecode = INT_TYPECODE
+                column = columns[field] = array(typecode)
+            if field in codes:
+                table = codes[field]
+                column.extend([table[value] for value in values])
+            else:
+                column.fromlist(values.tolist())
+        for mask, (_, fields) in zip(masks, DROPOUT_RULES):
+            mask.extend(batch.dropped[fields[0]])
+        written += len(batch)
+
+    # Lay out the columns behind the index. The index length depends on the offsets, so the offsets are
+    # computed relative to the data section first and the data section start is fixed afterwards.
+    index = {'version': CORPUS_VERSION, 'records': num_records, 'seed': seed, 'columns': {}, 'masks': []}
+    blocks = []
+    offset = 0
+    for field in stored:
+        column = columns[field]
+        entry = {'offset': offset, 'typecode': column.typecode}
+        if field in ENUM_FIELDS:
+            entry['values'] = list(ENUM_FIELDS[field])
+        index['columns'][field] = entry
+        blocks.append((offset, column))
+        offset = _align(offset + len(column) * column.itemsize)
+    for mask, (_, fields) in zip(masks, DROPOUT_RULES):
+        index['masks'].append({'offset': offset, 'fields': list(fields)})
+        blocks.append((offset, mask))
+        offset = _align(offset + len(mask))
+
+    index_bytes = json.dumps(index, separators=(',', ':')).encode()
+    data_start = _align(HEADER.size + len(index_bytes))
+    with open(path, 'wb') as corpus_file:
+        corpus_file.write(HEADER.pack(CORPUS_MAGIC, len(index_bytes)))
+        corpus_file.write(index_bytes)
+        for block_offset, block in blocks:
+            corpus_file.seek(data_start + block_offset)
+            block.tofile(corpus_file)
+        corpus_file.truncate(data_start + offset)
+    return index
+
+
+class Corpus:
+    # Read-only view of a corpus file. The mapping stays open for the lifetime of the object, which in a
+    # Lambda function is the lifetime of the sandbox.
+
+    def __init__(self, path):
+        with open(path, 'rb') as corpus_file:
+            self.mmap = mmap.mmap(corpus_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_length = HEADER.unpack_from(self.mmap)
+        if magic != CORPUS_MAGIC:
+            raise ValueError(f"{path} is not a telemetry corpus")
+        index = json.loads(self.mmap[HEADER.size:HEADER.size + index_length])
+        if index['version'] != CORPUS_VERSION:
+            raise ValueError(f"Unsupported corpus version {index['version']}")
+        self.path = path
+        self.size = index['records']
+        self.seed = index['seed']
+
+        data = memoryview(self.mmap)[_align(HEADER.size + index_length):]
+        self.columns = {}
+        self.values = {}
+        for field, entry in index['columns'].items():
+            itemsize = array(entry['typecode']).itemsize
+            start = entry['offset']
+            self.columns[field] = data[start:start + self.size * itemsize].cast(entry['typecode'])
+            if 'values' in entry:
+                self.values[field] = tuple(entry['values'])
+        self.masks = []
+        for entry in index['masks']:
+            start = entry['offset']
+            self.masks.append((tuple(entry['fields']), data[start:start + self.size]))
+
+    def __len__(self):
+        return self.size
+
+    def batch(self, start, stop, request_id, rng=None, now=None, ts_format=TS_ISO, id_format=ID_UUID):
+        # Records start..stop-1 as a TelemetryBatch with fresh '_id' and 'ts' values
+        n = stop - start
+        columns = {
+            '_id': _ids(rng or random, n, request_id, id_format),
+            'ts': ts_column(n, ts_format, now),
+        }
+        for field, column in self.columns.items():
+            values = self.values.get(field)
+            if values is None:
+                columns[field] = column[start:stop]
+            else:
+                columns[field] = list(map(values.__getitem__, column[start:stop]))
+        dropped = {}
+        for fields, mask in self.masks:
+            mask = mask[start:stop]
+            for field in fields:
+                dropped[field] = mask
+        return TelemetryBatch(n, columns, dropped)
+
+
+class CorpusReplay:
+    # Streams consecutive slices of a corpus, starting over at the beginning after the last record
+
+    def __init__(self, corpus, position=0):
+        self.corpus = corpus
+        self.position = position % len(corpus)
+        self.laps = 0
+
+    def next_batch(self, num_records, request_id, now=None, ts_format=TS_ISO, id_format=ID_UUID):
+        # The next num_records records, fewer when the end of the corpus is reached
+        start = self.position
+        stop = min(start + num_records, len(self.corpus))
+        self.position = stop
+        if stop == len(self.corpus):
+            self.position = 0
+            self.laps += 1
+        return self.corpus.batch(start, stop, request_id, now=now, ts_format=ts_format, id_format=id_format)
@@ -0,0 +1,100 @@
+# JSON encoder specialized to the telemetry schema.
+#
+# TelemetryEncoder.encode() turns a TelemetryBatch into the same bytes json.dumps(batch.records()).encode()
+# would produce, without building the per-record dicts. Key fragments are encoded once, every column is
+# formatted in one pass and the records are written into a bytearray that is reused between batches.
+
+from json.encoder import encode_basestring_ascii
+
+from agri_common.telemetry import CONNECTION_STATES, ERROR_MESSAGES, FIELDS, FOUR_WHEEL_DRIVING_STATES, MODES
+
+# Low cardinality string fields: every possible value gets a pre-encoded fragment
+ENUM_FIELDS = {
+    'four_wheel_driving_state': FOUR_WHEEL_DRIVING_STATES,
+    'last_error_msg': ERROR_MESSAGES,
+    'connection_state': CONNECTION_STATES,
+    'mode': MODES,
+}
+
+# String fields that differ per record ('_id'), fields that repeat within a batch ('ts', an iso string or
+# epoch milliseconds)
+UNIQUE_STRING_FIELDS = ('_id',)
+REPEATED_FIELDS = ('ts',)
+
+# Numeric fragments are memoized per field up to this many distinct values, which covers the small
+# integer ranges and the coarser decimal fields while keeping the tables to a few MB
+MAX_FRAGMENT_TABLE_SIZE = 8192
+
+
+def _key_fragment(field, first):
+    # '{"field": ' for the first field of a record, ', "field": ' for all others (json.dumps default separators)
+    return ('{' if first else ', ') + encode_basestring_ascii(field) + ': '
+
+
+class TelemetryEncoder:
+    # The first and the last field carry the record's braces, so neither of them may be an optional field.
+
+    def __init__(self, fields=FIELDS):
+        self.fields = fields
+        self.last = fields[-1]
+        self.prefixes = {field: _key_fragment(field, index == 0) for index, field in enumerate(fields)}
+        self.enum_fragments = {
+            field: {value: (self.prefixes[field] + encode_basestring_ascii(value)).encode() for value in values}
+            for field, values in ENUM_FIELDS.items() if field in self.prefixes
+        }
+        self.numeric_fragments = {field: {} for field in fields}
+        self.buffer = bytearray()
+
+    def _column_fragments(self, field, values):
+        # Encode one column into "key: value" fragments, one per record
+        prefix = self.prefixes[field]
+        if field in self.enum_fragments:
+            table = self.enum_fragments[field]
+            fragments = [table[value] for value in values]
+        elif field in UNIQUE_STRING_FIELDS:
+            fragments = [(prefix + encode_basestring_ascii(value)).encode() for value in values]
+        elif field in REPEATED_FIELDS:
+            table = {value: (prefix + (encode_basestring_ascii(value) if isinstance(value, str) else repr(value))).encode()
+                     for value in set(values)}
+            fragments = [table[value] for value in values]
+        else:
+            # %a renders ints and floats exactly like json.dumps (int.__repr__ / float.__repr__)
+            template = prefix.encode() + b'%a'
+            table = self.numeric_fragments[field]
+            if len(table) < MAX_FRAGMENT_TABLE_SIZE:
+                for value in set(values).difference(table):
+                    table[value] = template % value
+                fragments = [table[value] for value in values]
+            else:
+                get = table.get
+                fragments = [get(value) or template % value for value in values]
+        if field == self.last:
+            fragments = [fragment + b'}' for fragment in fragments]
+        return fragments
+
+    def encode_records(self, batch):
+        # Encode every record of a TelemetryBatch into its own JSON object, returns a list of bytes
+        columns = []
+        for field in self.fields:
+            fragments = self._column_fragments(field, batch.columns[field])
+            dropped = batch.dropped.get(field)
+            if dropped is not None:
+                fragments = [b'' if is_dropped else fragment for fragment, is_dropped in zip(fragments, dropped)]
+            columns.append(fragments)
+        join = b''.join
+        return [join(row) for row in zip(*columns)]
+
+    def encode(self, batch):
+        # Encode a TelemetryBatch as a JSON array into the reusable buffer and return the buffer.
+        # The returned bytearray is overwritten by the next call to encode().
+        buffer = self.buffer
+        del buffer[:]
+        buffer += b'['
+        separator = False
+        for record in self.encode_records(batch):
+            if separator:
+                buffer += b', '
+            buffer += record
+            separator = True
+        buffer += b']'
+        return buffer
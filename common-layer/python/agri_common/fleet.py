@@ -0,0 +1,240 @@
+# Stateful fleet simulator producing realistic per-vehicle telemetry time series.
+#
+# Every vehicle of the fleet has a compact state (position, heading, speed, fuel, engine, ...) kept in
+# array module columns, about 100 bytes per vehicle. Vehicles are advanced lazily: when a vehicle is
+# picked for a reading, its state is integrated over the time passed since its previous reading. That gives
+# the same smooth series as updating the whole fleet every tick, while a tick only costs as much as the
+# readings it emits. The readings come out as a TelemetryBatch, so the encoders work unchanged.
+
+import datetime
+import math
+import random
+from array import array
+
+from agri_common.telemetry import (
+    CONNECTION_STATES, DROPOUT_RULES, ERROR_MESSAGES, FOUR_WHEEL_DRIVING_STATES, MODES, TelemetryBatch, _ids,
+)
+from agri_common.ids import ID_UUID
+from agri_common.timestamps import TS_ISO, ts_column
+
+FLEET_SIZE = 50000
+
+# Mean time in seconds an engine stays on / off, tank size in litres
+MEAN_ENGINE_ON_SEC = 1800.0
+MEAN_ENGINE_OFF_SEC = 600.0
+FUEL_TANK_LITRES = 300.0
+# State changes are integrated over at most this many seconds, longer gaps behave like a fresh start
+MAX_STEP_SEC = 3600.0
+
+KM_PER_DEGREE = 111.0
+NO_ERROR, LOW_FUEL, OVERHEATING = ERROR_MESSAGES
+
+
+def _clamp(value, low, high):
+    return low if value < low else high if value > high else value
+
+
+class FleetSimulator:
+
+    def __init__(self, fleet_size=FLEET_SIZE, rng=None):
+        self.fleet_size = fleet_size
+        self.rng = rng or random.Random()
+        # Vehicles tick() picks readings from
+        self.population = range(fleet_size)
+        n = fleet_size
+
+        # All columns start zeroed, a vehicle gets its random initial state on its first reading
+        zeros = bytes(8 * n)
+        # Float state
+        self.latitude = array('d', zeros)
+        self.longitude = array('d', zeros)
+        self.heading = array('d', zeros)
+        self.altitude = array('d', zeros)
+        self.speed = array('d', zeros)
+        self.fuel_tank_level = array('d', zeros)
+        self.operatingtime = array('d', zeros)
+        self.engine_temperature = array('d', zeros)
+        self.ambient_temperature = array('d', zeros)
+        self.lte_connection_level = array('d', zeros)
+        # Time of the last reading, 0 for vehicles that have not reported yet
+        self.last_update = array('d', zeros)
+        # Small integer state
+        self.front_linkage_position = array('b', zeros[:n])
+        self.rear_linkage_position = array('b', zeros[:n])
+        self.enginestate = array('b', zeros[:n])
+        self.autopilot_system_state = array('b', zeros[:n])
+        self.mode = array('b', zeros[:n])
+
+    def _spawn(self, v, now):
+        # Random initial state of vehicle v
+        rng = self.rng
+        uniform = rng.uniform
+        self.latitude[v] = uniform(-60.0, 60.0)
+        self.longitude[v] = uniform(-180.0, 180.0)
+        self.heading[v] = uniform(0.0, 2 * math.pi)
+        self.altitude[v] = uniform(0.0, 1000.0)
+        self.fuel_tank_level[v] = uniform(20.0, 100.0)
+        self.operatingtime[v] = uniform(0.0, 1000.0)
+        self.engine_temperature[v] = 60.0
+        self.ambient_temperature[v] = uniform(5.0, 40.0)
+        self.lte_connection_level[v] = uniform(20.0, 100.0)
+        self.front_linkage_position[v] = rng.randint(0, 100)
+        self.rear_linkage_position[v] = rng.randint(0, 100)
+        self.mode[v] = rng.randrange(len(MODES))
+        self.last_update[v] = now
+
+    def memory_bytes(self):
+        # Bytes held by the state arrays
+        return sum(column.itemsize * len(column) for column in self.state().values())
+
+    def state(self):
+        # The state arrays by name (not copies), picklable to hand the fleet to another process
+        return {name: column for name, column in vars(self).items() if isinstance(column, array)}
+
+    def partition_state(self, index, nr_of_partitions):
+        # Copy of the state of the vehicles in one partition (see restrict) as (state, index, nr_of_partitions),
+        # the arguments of load_state
+        return {name: column[index::nr_of_partitions] for name, column in self.state().items()}, index, nr_of_partitions
+
+    def load_state(self, state, index=0, nr_of_partitions=1):
+        # Overwrite the state of all vehicles, or of one partition, with the arrays of state() or partition_state()
+        for name, column in state.items():
+            getattr(self, name)[index::nr_of_partitions] = column
+
+    def _advance(self, v, now, reading):
+        # Integrate the state of vehicle v up to now and write its reading into the reading columns
+        rng = self.rng
+        gauss = rng.gauss
+        rand = rng.random
+        if not self.last_update[v]:
+            self._spawn(v, now)
+        dt = _clamp(now - self.last_update[v], 0.0, MAX_STEP_SEC)
+        self.last_update[v] = now
+
+        # Engine switches on/off as a Markov process with exponential holding times
+        engine_on = self.enginestate[v]
+        if engine_on and rand() < 1.0 - math.exp(-dt / MEAN_ENGINE_ON_SEC):
+            engine_on = 0
+        elif not engine_on and rand() < 1.0 - math.exp(-dt / MEAN_ENGINE_OFF_SEC):
+            engine_on = 1
+        self.enginestate[v] = engine_on
+
+        if engine_on:
+            speed = _clamp(self.speed[v] + gauss(0.0, 4.0), 0.0, 40.0)
+            if rand() < 0.05:
+                self.autopilot_system_state[v] ^= 1
+        else:
+            speed = 0.0
+            self.autopilot_system_state[v] = 0
+        self.speed[v] = speed
+
+        # Move along the heading
+        heading = (self.heading[v] + gauss(0.0, 0.3)) % (2 * math.pi)
+        distance_km = speed * dt / 3600.0
+        latitude = self.latitude[v] + distance_km / KM_PER_DEGREE * math.cos(heading)
+        if not -90.0 <= latitude <= 90.0:
+            latitude = _clamp(latitude, -90.0, 90.0)
+            heading = (math.pi - heading) % (2 * math.pi)
+        cos_latitude = max(math.cos(math.radians(latitude)), 0.01)
+        longitude = (self.longitude[v] + distance_km / (KM_PER_DEGREE * cos_latitude) * math.sin(heading) + 180.0) % 360.0 - 180.0
+        altitude = _clamp(self.altitude[v] + gauss(0.0, 1.0 + 5.0 * distance_km), 0.0, 1000.0)
+        self.latitude[v] = latitude
+        self.longitude[v] = longitude
+        self.heading[v] = heading
+        self.altitude[v] = altitude
+
+        # Implements, load, fuel
+        front_linkage = int(_clamp(self.front_linkage_position[v] + rng.randint(-5, 5), 0, 100))
+        rear_linkage = int(_clamp(self.rear_linkage_position[v] + rng.randint(-5, 5), 0, 100))
+        self.front_linkage_position[v] = front_linkage
+        self.rear_linkage_position[v] = rear_linkage
+        if engine_on:
+            engine_load = _clamp(20.0 + speed * 1.5 + (front_linkage + rear_linkage) * 0.1 + gauss(0.0, 5.0), 0.0, 100.0)
+            fuelusage = 1.0 + engine_load * 0.09
+        else:
+            engine_load = 0.0
+            fuelusage = 0.0
+        fuel = self.fuel_tank_level[v] - fuelusage * dt / 3600.0 / FUEL_TANK_LITRES * 100.0
+        if fuel < 3.0:
+            fuel = 100.0  # refuelled
+        self.fuel_tank_level[v] = fuel
+        operatingtime = self.operatingtime[v] + (dt / 3600.0 if engine_on else 0.0)
+        self.operatingtime[v] = operatingtime % 1001.0
+
+        # Temperatures approach their targets exponentially
+        target = 75.0 + engine_load * 0.35 if engine_on else 60.0
+        engine_temperature = self.engine_temperature[v]
+        engine_temperature = _clamp(engine_temperature + (target - engine_temperature) * (1.0 - math.exp(-dt / 600.0)) + gauss(0.0, 0.5), 60.0, 110.0)
+        self.engine_temperature[v] = engine_temperature
+        ambient = _clamp(self.ambient_temperature[v] + gauss(0.0, 0.3), 5.0, 40.0)
+        self.ambient_temperature[v] = ambient
+        lte = _clamp(self.lte_connection_level[v] + gauss(0.0, 5.0), 0.0, 100.0)
+        self.lte_connection_level[v] = lte
+        if rand() < 0.01:
+            self.mode[v] = rng.randrange(len(MODES))
+
+        if engine_temperature > 105.0:
+            error = OVERHEATING
+        elif fuel < 15.0:
+            error = LOW_FUEL
+        else:
+            error = NO_ERROR
+
+        reading['vehicleid'].append(v + 1)
+        reading['temperature'].append(round(ambient, 2))
+        reading['operatingtime'].append(int(self.operatingtime[v]))
+        reading['fuelusage'].append(round(fuelusage, 2))
+        reading['front_linkage_position'].append(front_linkage)
+        reading['drivingspeed'].append(int(speed))
+        reading['enginestate'].append(engine_on)
+        reading['autopilot_system_state'].append(self.autopilot_system_state[v])
+        reading['engine_load'].append(round(engine_load, 2))
+        reading['latitude'].append(round(latitude, 6))
+        reading['longitude'].append(round(longitude, 6))
+        reading['altitude'].append(round(altitude, 2))
+        reading['engine_rotation'].append(round(800.0 + engine_load * 22.0, 2) if engine_on else 0.0)
+        reading['front_pme_shaft'].append(round(_clamp(engine_load + gauss(0.0, 5.0), 0.0, 100.0), 2) if engine_on else 0.0)
+        reading['rear_linkage_position'].append(rear_linkage)
+        reading['four_wheel_driving_state'].append(FOUR_WHEEL_DRIVING_STATES[0] if engine_load > 70.0 else FOUR_WHEEL_DRIVING_STATES[1])
+        reading['fuel_tank_level'].append(int(fuel))
+        reading['last_error_msg'].append(error)
+        reading['engine_temperature'].append(round(engine_temperature, 2))
+        reading['connection_state'].append(CONNECTION_STATES[0] if lte >= 10.0 else CONNECTION_STATES[1])
+        reading['lte_connection_level'].append(round(lte, 2))
+        reading['mode'].append(MODES[self.mode[v]])
+
+    def restrict(self, index, nr_of_partitions):
+        # Only pick vehicles of one of nr_of_partitions disjoint partitions of the fleet, so several
+        # processes with their own copy of the simulator never report the same vehicle
+        self.population = range(index, self.fleet_size, nr_of_partitions)
+
+    def tick(self, num_records, request_id, vehicles=None, now=None, ts_format=TS_ISO, id_format=ID_UUID):
+        # Advance num_records vehicles (a random subset of the population, or the given 0-based indices) to
+        # now and return their readings as a TelemetryBatch
+        if vehicles is None:
+            vehicles = self.rng.sample(self.population, min(num_records, len(self.population)))
+        now_dt = now or datetime.datetime.now()
+        now_ts = now_dt.timestamp()
+        n = len(vehicles)
+
+        reading = {
+            '_id': _ids(self.rng, n, request_id, id_format),
+            'ts': ts_column(n, ts_format, now_dt),
+        }
+        for field in ('vehicleid', 'temperature', 'operatingtime', 'fuelusage', 'front_linkage_position',
+                      'drivingspeed', 'enginestate', 'autopilot_system_state', 'engine_load', 'latitude',
+                      'longitude', 'altitude', 'engine_rotation', 'front_pme_shaft', 'rear_linkage_position',
+                      'four_wheel_driving_state', 'fuel_tank_level', 'last_error_msg', 'engine_temperature',
+                      'connection_state', 'lte_connection_level', 'mode'):
+            reading[field] = []
+        for v in vehicles:
+            self._advance(v, now_ts, reading)
+
+        # Optional fields are still left out with the schema's probabilities
+        rand = self.rng.random
+        dropped = {}
+        for probability, fields in DROPOUT_RULES:
+            mask = [rand() < probability for _ in range(n)]
+            for field in fields:
+                dropped[field] = mask
+        return TelemetryBatch(n, reading, dropped)
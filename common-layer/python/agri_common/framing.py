@@ -0,0 +1,82 @@
+# Self describing framing for batch payloads travelling IOT Core -> Kinesis -> Kinesis reader.
+#
+# A framed payload starts with a fixed header followed by the (optionally compressed) body:
+#
+#   magic     4 bytes  b'\x89AGR', cannot be the start of a JSON document
+#   version   1 byte   FRAME_VERSION
+#   codec     1 byte   CODEC_NONE, CODEC_ZLIB or CODEC_ZSTD
+#   format    1 byte   content of the body once decompressed: FORMAT_JSON_ROWS is a JSON array of documents,
+#                      FORMAT_JSON_COLUMNS a columnar batch (see agri_common.columnar), FORMAT_BSON
+#                      concatenated BSON documents (see agri_common.bsonbatch)
+#   length    4 bytes  big endian length of the uncompressed body
+#
+# Payloads without the magic are legacy plain JSON arrays and are passed through unchanged.
+
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # not part of the Lambda layers, zstd is only used where it is installed
+    zstandard = None
+
+MAGIC = b'\x89AGR'
+FRAME_VERSION = 1
+HEADER = struct.Struct('>4sBBBI')
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODECS = {'none': CODEC_NONE, 'zlib': CODEC_ZLIB, 'zstd': CODEC_ZSTD}
+
+FORMAT_JSON_ROWS = 0
+FORMAT_JSON_COLUMNS = 1
+FORMAT_BSON = 2
+FORMATS = {'rows': FORMAT_JSON_ROWS, 'columns': FORMAT_JSON_COLUMNS, 'bson': FORMAT_BSON}
+
+
+def zstd_available():
+    return zstandard is not None
+
+
+def compress(body, codec, level=None):
+    if codec == CODEC_NONE:
+        return bytes(body)
+    if codec == CODEC_ZLIB:
+        return zlib.compress(body, 6 if level is None else level)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd compression requested but the zstandard package is not installed")
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(body)
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def decompress(body, codec, length):
+    if codec == CODEC_NONE:
+        return bytes(body)
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(body, bufsize=max(length, 1))
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd compressed payload received but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(body, max_output_size=length)
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def frame(body, codec=CODEC_NONE, content_format=FORMAT_JSON_ROWS, level=None):
+    # Compress body with codec and prepend the header, returns bytes
+    return HEADER.pack(MAGIC, FRAME_VERSION, codec, content_format, len(body)) + compress(body, codec, level)
+
+
+def is_framed(payload):
+    return payload[:len(MAGIC)] == MAGIC
+
+
+def unframe(payload):
+    # Returns (content_format, body) with body decompressed. Legacy payloads are returned as FORMAT_JSON_ROWS.
+    if not is_framed(payload):
+        return FORMAT_JSON_ROWS, payload
+    magic, version, codec, content_format, length = HEADER.unpack_from(payload)
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported payload frame version {version}")
+    return content_format, decompress(memoryview(payload)[HEADER.size:], codec, length)
@@ -0,0 +1,75 @@
+# Document ids of the telemetry records.
+#
+#   uuid      uuid4 string with the request id appended (~73 characters, the original format)
+#   objectid  12 byte MongoDB ObjectId: 4 byte seconds timestamp, 5 byte random process value, 3 byte counter
+#
+# Random uuid strings spread the inserts over the whole _id index. ObjectIds grow with time, so every
+# producer appends to the right edge of the index, and take 12 bytes instead of ~73. ObjectIdGenerator
+# creates the ids of a whole batch from one clock read and one counter reservation. Ids are unique across
+# concurrent Lambdas (and worker processes) through the random process value, which is drawn again after
+# a fork, and within a process through the counter.
+#
+# The ids travel as 24 digit hex strings in the JSON payloads. The Kinesis reader (and the load generator)
+# turn them into BSON ObjectIds with to_object_ids() before inserting.
+
+import os
+import time
+
+ID_UUID = 'uuid'
+ID_OBJECTID = 'objectid'
+ID_FORMATS = (ID_UUID, ID_OBJECTID)
+
+OBJECTID_HEX_LENGTH = 24
+COUNTER_MASK = 0xFFFFFF
+
+
+def check_format(id_format):
+    if id_format not in ID_FORMATS:
+        raise ValueError(f"Unknown ID_FORMAT {id_format}, use one of {list(ID_FORMATS)}")
+    return id_format
+
+
+class ObjectIdGenerator:
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._pid = None
+
+    def _reset(self):
+        # Fresh random process value and counter start, in a new process (also a forked worker) before the first id
+        self._pid = os.getpid()
+        self._process = os.urandom(5)
+        self._counter = int.from_bytes(os.urandom(3), 'big')
+
+    def hex_ids(self, n):
+        # n ObjectIds as hex strings, increasing within the batch (unless the 3 byte counter wraps around)
+        if self._pid != os.getpid():
+            self._reset()
+        start = self._counter
+        self._counter = (start + n) & COUNTER_MASK
+        prefix = (int(self.clock()).to_bytes(4, 'big') + self._process).hex()
+        if start + n <= COUNTER_MASK + 1:
+            return [f"{prefix}{counter:06x}" for counter in range(start, start + n)]
+        return [f"{prefix}{counter & COUNTER_MASK:06x}" for counter in range(start, start + n)]
+
+
+# One generator per process, shared by all generators of telemetry
+object_ids = ObjectIdGenerator()
+
+
+def to_object_ids(documents, field='_id'):
+    # Replace 24 digit hex ids in `field` by BSON ObjectIds, in place. Other ids (e.g. uuid strings of
+    # older producers) are left as they are. Returns the number of converted documents.
+    from bson.objectid import ObjectId
+
+    count = 0
+    for document in documents:
+        value = document.get(field)
+        if type(value) is str and len(value) == OBJECTID_HEX_LENGTH:
+            try:
+                # From the 12 raw bytes, which skips ObjectId's own hex validation
+                document[field] = ObjectId(bytes.fromhex(value))
+            except ValueError:
+                continue
+            count += 1
+    return count
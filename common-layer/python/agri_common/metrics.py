@@ -0,0 +1,168 @@
+# CloudWatch Embedded Metric Format (EMF) instrumentation for the Lambda functions.
+#
+# Metrics buffers counters and latency histograms in memory and writes them as EMF JSON lines to stdout,
+# where CloudWatch Logs turns them into metrics without any API calls. flush() is called once per
+# interval from the handler's loop (maybe_flush()) and at the end of the handler.
+#
+# Counters are summed per flush. Histograms keep exact count/sum/min/max and a bounded reservoir sample of
+# the observed values. The samples are emitted as EMF value arrays (at most 100 values per metric and
+# document, so a flush may write several documents), which is what CloudWatch computes percentiles from.
+
+import json
+import os
+import random
+import threading
+import time
+
+DEFAULT_NAMESPACE = 'AgriIoTDemo'
+DEFAULT_FLUSH_INTERVAL = 60.0
+
+# EMF allows at most 100 values per metric in one document
+MAX_VALUES_PER_DOCUMENT = 100
+# Values kept per histogram and flush interval, beyond that a uniform sample is kept
+MAX_SAMPLES = 1000
+
+COUNT = 'Count'
+BYTES = 'Bytes'
+MILLISECONDS = 'Milliseconds'
+
+
+class Histogram:
+
+    __slots__ = ('unit', 'count', 'total', 'minimum', 'maximum', 'samples')
+
+    def __init__(self, unit):
+        self.unit = unit
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.samples = []
+
+    def add(self, value, randrange):
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(value)
+        else:
+            # Reservoir sampling keeps every observed value with the same probability
+            slot = randrange(self.count)
+            if slot < MAX_SAMPLES:
+                self.samples[slot] = value
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': round(self.total, 3),
+            'min': round(self.minimum, 3),
+            'max': round(self.maximum, 3),
+        }
+
+
+class _Timer:
+    # Context manager recording the elapsed wall time of its block in milliseconds
+
+    __slots__ = ('metrics', 'name', 'started')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, (time.perf_counter() - self.started) * 1000)
+        return False
+
+
+class Metrics:
+
+    def __init__(self, namespace=None, dimensions=None, flush_interval=None, clock=time.monotonic, emit=print):
+        environ = os.environ
+        self.namespace = namespace or environ.get('METRICS_NAMESPACE', DEFAULT_NAMESPACE)
+        if dimensions is None:
+            dimensions = {'FunctionName': environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')}
+        self.dimensions = dimensions
+        if flush_interval is None:
+            flush_interval = float(environ.get('METRICS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL))
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.emit = emit
+        self.properties = {}
+        self.counters = {}
+        self.histograms = {}
+        self._randrange = random.Random().randrange
+        # Publish callbacks record from the event loop thread
+        self._lock = threading.Lock()
+        self._last_flush = clock()
+
+    def set_property(self, key, value):
+        # Extra field written into every document (searchable in Logs Insights, not a metric)
+        self.properties[key] = value
+
+    def count(self, name, value=1, unit=COUNT):
+        with self._lock:
+            counter = self.counters.get(name)
+            self.counters[name] = (counter[0] + value if counter else value, unit)
+
+    def observe(self, name, value, unit=MILLISECONDS):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(unit)
+            histogram.add(value, self._randrange)
+
+    def timer(self, name):
+        return _Timer(self, name)
+
+    def maybe_flush(self):
+        # Flush if the flush interval has passed since the last flush
+        if self.clock() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        # Write everything buffered since the last flush as EMF documents and reset the buffers
+        with self._lock:
+            counters, self.counters = self.counters, {}
+            histograms, self.histograms = self.histograms, {}
+        self._last_flush = self.clock()
+        if not counters and not histograms:
+            return
+
+        # The first document carries the counters and the first chunk of every histogram, further
+        # documents only carry the remaining histogram chunks
+        chunks = {name: [histogram.samples[start:start + MAX_VALUES_PER_DOCUMENT]
+                         for start in range(0, len(histogram.samples), MAX_VALUES_PER_DOCUMENT)]
+                  for name, histogram in histograms.items()}
+        summary = {name: histogram.summary() for name, histogram in histograms.items()}
+        for index in range(max([len(values) for values in chunks.values()] or [1])):
+            values = {name: (value, unit) for name, (value, unit) in counters.items()} if index == 0 else {}
+            for name, histogram_chunks in chunks.items():
+                if index < len(histogram_chunks):
+                    values[name] = (histogram_chunks[index], histograms[name].unit)
+            self.emit(json.dumps(self._document(values, summary if index == 0 else None), separators=(',', ':')))
+
+    def _document(self, values, summary):
+        document = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(self.dimensions)],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in values.items()],
+                }],
+            },
+        }
+        document.update(self.dimensions)
+        document.update(self.properties)
+        if summary:
+            document['Summary'] = summary
+        for name, (value, _) in values.items():
+            document[name] = value
+        return document
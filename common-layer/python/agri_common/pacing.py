@@ -0,0 +1,117 @@
+# Closed-loop rate control for the load producing Lambda functions.
+#
+# A TokenBucket refills continuously at the target rate. Time spent generating, encoding and publishing
+# refills the bucket too, so pace() only sleeps for whatever is left of the time budget of a batch.
+# A RateController paces on records/sec and payloads/sec at once and periodically logs the achieved rate.
+
+import logging
+import time
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        # Allow one second worth of burst by default, so a slow batch can be made up for but not more
+        self.capacity = capacity if capacity is not None else rate
+        # Start empty, so a run does not begin with a burst of a full second worth of tokens
+        self.tokens = 0.0
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+
+    def acquire(self, tokens=1):
+        # Take tokens from the bucket, sleeping until the bucket is no longer in debt.
+        # Requests larger than the capacity are allowed and simply put the bucket into debt.
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= tokens
+        if self.tokens < 0:
+            wait = -self.tokens / self.rate
+            self.sleep(wait)
+            return wait
+        return 0.0
+
+
+class RateController:
+
+    def __init__(self, records_per_sec=None, payloads_per_sec=None, report_interval=10.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.records_per_sec = records_per_sec or None
+        self.payloads_per_sec = payloads_per_sec or None
+        self.report_interval = report_interval
+        self.clock = clock
+        self.buckets = []
+        if self.records_per_sec:
+            self.buckets.append((TokenBucket(self.records_per_sec, clock=clock, sleep=sleep), True))
+        if self.payloads_per_sec:
+            self.buckets.append((TokenBucket(self.payloads_per_sec, clock=clock, sleep=sleep), False))
+
+        self.records = 0
+        self.payloads = 0
+        self.slept = 0.0
+        self.started = clock()
+        self._interval_started = self.started
+        self._interval_records = 0
+        self._interval_payloads = 0
+
+    @classmethod
+    def from_config(cls, event, environ, **kwargs):
+        # Targets come from the event ("target_records_per_sec", "target_payloads_per_sec") or, if not set
+        # there, from the TARGET_RECORDS_PER_SEC and TARGET_PAYLOADS_PER_SEC environment variables
+        event = event if isinstance(event, dict) else {}
+
+        def setting(name):
+            value = event.get(name.lower(), environ.get(name.upper()))
+            return float(value) if value not in (None, "") else None
+
+        return cls(records_per_sec=setting('target_records_per_sec'),
+                   payloads_per_sec=setting('target_payloads_per_sec'),
+                   report_interval=float(environ.get('RATE_REPORT_INTERVAL', '10')),
+                   **kwargs)
+
+    @property
+    def active(self):
+        return bool(self.buckets)
+
+    def pace(self, records):
+        # Account for one payload holding `records` records and wait until it may be sent
+        for bucket, counts_records in self.buckets:
+            self.slept += bucket.acquire(records if counts_records else 1)
+        self.records += records
+        self.payloads += 1
+        self._interval_records += records
+        self._interval_payloads += 1
+        self.report()
+
+    def report(self, force=False):
+        now = self.clock()
+        elapsed = now - self._interval_started
+        if not force and elapsed < self.report_interval:
+            return
+        elapsed = max(elapsed, 1e-9)
+        logging.info(f"Rate: {self._interval_records / elapsed:,.0f} records/s (target {self._target(self.records_per_sec)}), "
+                     f"{self._interval_payloads / elapsed:,.1f} payloads/s (target {self._target(self.payloads_per_sec)}) "
+                     f"over the last {elapsed:.1f}s")
+        self._interval_started = now
+        self._interval_records = 0
+        self._interval_payloads = 0
+
+    def summary(self):
+        elapsed = max(self.clock() - self.started, 1e-9)
+        return {
+            'records': self.records,
+            'payloads': self.payloads,
+            'records_per_sec': round(self.records / elapsed, 1),
+            'payloads_per_sec': round(self.payloads / elapsed, 2),
+            'target_records_per_sec': self.records_per_sec,
+            'target_payloads_per_sec': self.payloads_per_sec,
+            'paced_sleep_sec': round(self.slept, 3),
+        }
+
+    @staticmethod
+    def _target(rate):
+        return f"{rate:,.0f}" if rate else "unlimited"
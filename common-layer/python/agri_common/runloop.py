@@ -0,0 +1,116 @@
+# Deadline aware run loop for the long running Lambda handlers.
+#
+# The handlers produce or query in a loop until the invocation is about to time out. RunLoop reads the
+# remaining time from context.get_remaining_time_in_millis() and stops issuing new work once the next
+# iteration (estimated from the previous ones) would run into the safety margin. The margin is what is
+# left to drain in-flight work, close connections and log the final summary before Lambda kills the
+# invocation.
+#
+#   run_loop = RunLoop(context, safety_margin=10)
+#   while run_loop.next():
+#       ...
+#       run_loop.add(records)
+#   pipeline.drain(timeout=run_loop.drain_timeout())
+#   logging.info(f"Run summary: {run_loop.summary()}")
+#
+# The functions read their limits with settings(os.environ) at init: RUN_SECONDS, the seconds the handler
+# runs at most, and RUN_SAFETY_MARGIN.
+
+import time
+
+DEFAULT_RUN_SECONDS = 900
+DEFAULT_SAFETY_MARGIN = 10.0
+# Part of the safety margin drain_timeout() keeps for the final summary, at most DRAIN_RESERVE seconds
+DRAIN_RESERVE = 1.0
+DRAIN_RESERVE_SHARE = 0.2
+
+# Weight of the latest iteration in the iteration time estimate
+EWMA_WEIGHT = 0.2
+
+
+def settings(environ):
+    # (RUN_SECONDS, RUN_SAFETY_MARGIN) from the function's environment variables
+    run_seconds = int(environ.get('RUN_SECONDS', str(DEFAULT_RUN_SECONDS)))
+    safety_margin = float(environ.get('RUN_SAFETY_MARGIN', str(DEFAULT_SAFETY_MARGIN)))
+    if run_seconds < 1:
+        raise ValueError("RUN_SECONDS must be at least 1")
+    if safety_margin <= 0:
+        raise ValueError("RUN_SAFETY_MARGIN must be positive, it is the time left to drain and disconnect")
+    return run_seconds, safety_margin
+
+
+class RunLoop:
+
+    def __init__(self, context, safety_margin=DEFAULT_SAFETY_MARGIN, max_seconds=None, clock=time.monotonic,
+                 sleep=time.sleep):
+        self.clock = clock
+        self._sleep = sleep
+        self.safety_margin = safety_margin
+        self.started = clock()
+        self.deadline = None
+        get_remaining_time = getattr(context, 'get_remaining_time_in_millis', None)
+        if get_remaining_time:
+            self.deadline = self.started + get_remaining_time() / 1000
+        if max_seconds is not None:
+            end = self.started + max_seconds + safety_margin
+            self.deadline = end if self.deadline is None else min(self.deadline, end)
+        self.iterations = 0
+        self.units = 0
+        self.estimate = 0.0
+        self.stopped_by = None
+        self._iteration_started = None
+
+    def remaining(self):
+        # Seconds until the deadline, None without a deadline
+        if self.deadline is None:
+            return None
+        return self.deadline - self.clock()
+
+    def next(self):
+        # True if another iteration fits before the safety margin. Call once at the top of every iteration.
+        now = self.clock()
+        if self._iteration_started is not None:
+            duration = now - self._iteration_started
+            self.estimate = duration if self.iterations == 1 else \
+                max(duration, (1 - EWMA_WEIGHT) * self.estimate + EWMA_WEIGHT * duration)
+        if self.deadline is not None and self.deadline - now < self.safety_margin + self.estimate:
+            self.stopped_by = 'deadline'
+            self._iteration_started = None
+            return False
+        self.iterations += 1
+        self._iteration_started = now
+        return True
+
+    def add(self, units=1):
+        # Count finished work (records, payloads, queries) for the summary
+        self.units += units
+
+    def sleep(self, seconds):
+        # Sleep, but never into the safety margin
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, remaining - self.safety_margin)
+        if seconds > 0:
+            self._sleep(seconds)
+
+    def drain_timeout(self, reserve=None):
+        # Time left for draining and closing, keeping `reserve` seconds for the final summary. By default
+        # the reserve is a part of the safety margin, so a small margin still leaves time to drain.
+        remaining = self.remaining()
+        if remaining is None:
+            return None
+        if reserve is None:
+            reserve = min(DRAIN_RESERVE, DRAIN_RESERVE_SHARE * self.safety_margin)
+        return max(remaining - reserve, 0.0)
+
+    def summary(self):
+        elapsed = self.clock() - self.started
+        remaining = self.remaining()
+        return {
+            'iterations': self.iterations,
+            'units': self.units,
+            'elapsed_sec': round(elapsed, 3),
+            'units_per_sec': round(self.units / elapsed, 1) if elapsed > 0 else 0.0,
+            'stopped_by': self.stopped_by or 'loop end',
+            'remaining_ms': None if remaining is None else int(remaining * 1000),
+        }
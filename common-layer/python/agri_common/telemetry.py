@@ -0,0 +1,169 @@
+# Column oriented generator for synthetic tractor telemetry.
+#
+# generate_batch() draws every field for the whole batch at once and keeps it as one column per field.
+# Optional fields are dropped with per-batch masks using the same probabilities as the original
+# per-record generator. Dicts are only built when records() is called (or never, if an encoder
+# consumes the columns directly).
+
+import random
+from array import array
+from itertools import compress
+
+from agri_common.ids import ID_OBJECTID, ID_UUID, object_ids
+from agri_common.timestamps import TS_ISO, ts_column
+
+# All fields of a telemetry record in the order they appear in the document
+FIELDS = (
+    '_id',
+    'ts',
+    'vehicleid',
+    'temperature',
+    'operatingtime',
+    'fuelusage',
+    'front_linkage_position',
+    'drivingspeed',
+    'enginestate',
+    'autopilot_system_state',
+    'engine_load',
+    'latitude',
+    'longitude',
+    'altitude',
+    'engine_rotation',
+    'front_pme_shaft',
+    'rear_linkage_position',
+    'four_wheel_driving_state',
+    'fuel_tank_level',
+    'last_error_msg',
+    'engine_temperature',
+    'connection_state',
+    'lte_connection_level',
+    'mode',
+)
+
+# (probability of being dropped, fields dropped together)
+DROPOUT_RULES = (
+    (0.5, ('operatingtime',)),
+    (0.5, ('autopilot_system_state',)),
+    (0.5, ('enginestate',)),
+    (0.5, ('temperature',)),
+    (0.3, ('front_linkage_position', 'rear_linkage_position', 'engine_rotation', 'four_wheel_driving_state')),
+    (0.4, ('front_pme_shaft',)),
+)
+
+OPTIONAL_FIELDS = tuple(field for _, fields in DROPOUT_RULES for field in fields)
+
+FOUR_WHEEL_DRIVING_STATES = ('Engaged', 'Disengaged')
+ERROR_MESSAGES = ('No Error', 'Warning: Low Fuel Level', 'Error: Engine Overheating')
+CONNECTION_STATES = ('Connected', 'Disconnected')
+MODES = ('Normal', 'Eco', 'Work')
+
+
+class TelemetryBatch:
+    # A batch of telemetry records stored as columns.
+    #   columns: field name -> sequence of values (one entry per record, dropped values included)
+    #   dropped: optional field name -> list of bools, True where the field is missing from the record
+
+    __slots__ = ('size', 'columns', 'dropped')
+
+    def __init__(self, size, columns, dropped):
+        self.size = size
+        self.columns = columns
+        self.dropped = dropped
+
+    def __len__(self):
+        return self.size
+
+    def slice(self, start, stop):
+        # A new batch holding the records start..stop-1, fields dropped together keep sharing one mask
+        columns = {field: values[start:stop] for field, values in self.columns.items()}
+        dropped = {}
+        for _, fields in DROPOUT_RULES:
+            mask = self.dropped[fields[0]][start:stop]
+            for field in fields:
+                dropped[field] = mask
+        return TelemetryBatch(len(columns['_id']), columns, dropped)
+
+    def records(self):
+        # Build the per-record dicts, e.g. for insert_many or json.dumps
+        columns = self.columns
+        rows = [dict(zip(FIELDS, values)) for values in zip(*(columns[field] for field in FIELDS))]
+        for _, fields in DROPOUT_RULES:
+            for row in compress(rows, self.dropped[fields[0]]):
+                for field in fields:
+                    del row[field]
+        return rows
+
+
+def _ints(choices, n, low, high):
+    # Equivalent of random.randint(low, high) for n records
+    return array('l', choices(range(low, high + 1), k=n))
+
+
+def _decimals(choices, n, low, high, digits):
+    # Equivalent of round(random.uniform(low, high), digits) for n records.
+    # Values are drawn as integers on the rounding grid and scaled once, which avoids round() per value.
+    scale = 10 ** digits
+    grid = range(round(low * scale), round(high * scale) + 1)
+    return array('d', [value / scale for value in choices(grid, k=n)])
+
+
+def _ids(rng, n, request_id, id_format=ID_UUID):
+    # uuid4 formatted strings with the request id appended, drawn from one block of random bytes,
+    # or time ordered ObjectIds as hex strings (see agri_common.ids)
+    if id_format == ID_OBJECTID:
+        return object_ids.hex_ids(n)
+    digits = rng.randbytes(16 * n).hex()
+    suffix = "-" + request_id
+    ids = []
+    for start in range(0, 32 * n, 32):
+        h = digits[start:start + 32]
+        ids.append(
+            f"{h[:8]}-{h[8:12]}-4{h[13:16]}-{'89ab'[int(h[16], 16) & 3]}{h[17:20]}-{h[20:]}{suffix}"
+        )
+    return ids
+
+
+def generate_batch(num_records, request_id, rng=None, now=None, ts_format=TS_ISO, id_format=ID_UUID):
+    # Generate num_records telemetry records as a TelemetryBatch.
+    # rng can be a seeded random.Random for reproducible batches, now a fixed datetime for ts.
+    # ts_format selects iso strings or epoch milliseconds for ts (see agri_common.timestamps), id_format
+    # uuid strings or ObjectIds for _id (see agri_common.ids).
+    rng = rng or random
+    rand = rng.random
+    choices = rng.choices
+    n = num_records
+
+    columns = {
+        '_id': _ids(rng, n, request_id, id_format),
+        'ts': ts_column(n, ts_format, now),
+        'vehicleid': _ints(choices, n, 1, 50000),
+        'temperature': _decimals(choices, n, 5.0, 40.0, 2),
+        'operatingtime': _ints(choices, n, 0, 1000),
+        'fuelusage': _decimals(choices, n, 0.0, 10.0, 2),
+        'front_linkage_position': _ints(choices, n, 0, 100),
+        'drivingspeed': _ints(choices, n, 0, 40),
+        'enginestate': _ints(choices, n, 0, 1),
+        'autopilot_system_state': _ints(choices, n, 0, 1),
+        'engine_load': _decimals(choices, n, 0.0, 100.0, 2),
+        'latitude': _decimals(choices, n, -90.0, 90.0, 6),
+        'longitude': _decimals(choices, n, -180.0, 180.0, 6),
+        'altitude': _decimals(choices, n, 0.0, 1000.0, 2),
+        'engine_rotation': _decimals(choices, n, 0.0, 3000.0, 2),
+        'front_pme_shaft': _decimals(choices, n, 0.0, 100.0, 2),
+        'rear_linkage_position': _ints(choices, n, 0, 100),
+        'four_wheel_driving_state': choices(FOUR_WHEEL_DRIVING_STATES, k=n),
+        'fuel_tank_level': _ints(choices, n, 0, 100),
+        'last_error_msg': choices(ERROR_MESSAGES, k=n),
+        'engine_temperature': _decimals(choices, n, 60.0, 110.0, 2),
+        'connection_state': choices(CONNECTION_STATES, k=n),
+        'lte_connection_level': _decimals(choices, n, 0.0, 100.0, 2),
+        'mode': choices(MODES, k=n),
+    }
+
+    dropped = {}
+    for probability, fields in DROPOUT_RULES:
+        mask = [rand() < probability for _ in range(n)]
+        for field in fields:
+            dropped[field] = mask
+
+    return TelemetryBatch(n, columns, dropped)
@@ -0,0 +1,82 @@
+# Optional time series collection for the telemetry (MONGODB_TIMESERIES in the stack).
+#
+# MongoDB groups the measurements of a time series collection into buckets per metaField value and time
+# span and stores every bucket column-wise and compressed. The telemetry uses
+#
+#   timeField  ts          a BSON datetime, iso strings and epoch milliseconds are converted by the writers
+#   metaField  vehicleid   the identity of the vehicle, so the readings of one vehicle share buckets
+#
+# Keeping vehicleid as it is (instead of moving it into a sub document) leaves the documents in the shape
+# the producers send, so BSON payloads are still inserted without decoding, and the query functions keep
+# their {vehicleid, ts} filters. The collection has to exist before the first insert, an insert into a
+# missing collection creates a regular one, so every writer calls ensure_collection() at cold start.
+#
+# Time series collections have no unique index on _id: documents of a replayed Kinesis record are stored
+# a second time instead of failing as duplicates.
+
+from agri_common.timestamps import TS_EPOCH_MS, check_format
+
+TIME_FIELD = 'ts'
+META_FIELD = 'vehicleid'
+# From fine to coarse, the granularity of an existing collection can only be raised
+GRANULARITIES = ('seconds', 'minutes', 'hours')
+
+NAMESPACE_EXISTS = 48
+
+
+def check_granularity(granularity):
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown time series granularity {granularity}, use one of {list(GRANULARITIES)}")
+    return granularity
+
+
+def enabled(environ):
+    # MONGODB_TIMESERIES: the function's MONGODB_COLLECTION is a time series collection
+    return environ.get('MONGODB_TIMESERIES', 'false').lower() == 'true'
+
+
+def stored_ts_format(environ):
+    # How ts is stored in MONGODB_COLLECTION, for the query functions: TS_FORMAT of the producers ("iso"
+    # strings or "epoch_ms" BSON datetimes), always datetimes in a time series collection
+    ts_format = check_format(environ.get('TS_FORMAT', 'iso'))
+    return TS_EPOCH_MS if enabled(environ) else ts_format
+
+
+def ensure_collection(db, name, granularity='seconds'):
+    # Create the time series collection `name`, or check an existing one and raise its granularity if
+    # needed. Safe to run concurrently from several cold starting functions. Returns what was done.
+    from pymongo import ASCENDING
+    from pymongo.errors import CollectionInvalid, OperationFailure
+
+    options = {'timeField': TIME_FIELD, 'metaField': META_FIELD, 'granularity': granularity}
+    try:
+        db.create_collection(name, timeseries=options)
+        action = 'created'
+    except CollectionInvalid:
+        action = None
+    except OperationFailure as error:
+        # Created by another function between pymongo's existence check and the create command
+        if error.code != NAMESPACE_EXISTS:
+            raise
+        action = None
+
+    if action is None:
+        info = next(db.list_collections(filter={'name': name}), None) or {}
+        timeseries = info.get('options', {}).get('timeseries')
+        if info.get('type') != 'timeseries' or not timeseries:
+            raise ValueError(f"Collection {name} exists and is no time series collection, choose another name")
+        if (timeseries.get('timeField'), timeseries.get('metaField')) != (TIME_FIELD, META_FIELD):
+            raise ValueError(f"Time series collection {name} uses timeField {timeseries.get('timeField')} and "
+                             f"metaField {timeseries.get('metaField')}, expected {TIME_FIELD} and {META_FIELD}")
+        current = timeseries.get('granularity', 'seconds')
+        if current in GRANULARITIES and GRANULARITIES.index(granularity) > GRANULARITIES.index(current):
+            db.command('collMod', name, timeseries={'granularity': granularity})
+            action = f"granularity raised from {current} to {granularity}"
+        elif current != granularity:
+            action = f"exists with granularity {current}, it cannot be lowered to {granularity}"
+        else:
+            action = 'exists'
+
+    # Secondary index for the per vehicle time window queries, a no-op when it exists
+    db[name].create_index([(META_FIELD, ASCENDING), (TIME_FIELD, ASCENDING)])
+    return action
@@ -0,0 +1,168 @@
+# Worker processes for CPU bound data generation.
+#
+# Lambda functions get several vCPUs at larger memory sizes, but generating and serializing telemetry is
+# GIL bound Python. A WorkerPool forks K processes that each run a producer and connects them with
+# multiprocessing.Pipe (Lambda has no /dev/shm, so multiprocessing.Queue and Pool are not available).
+#
+# The protocol is request/response per worker: the parent sends True to ask for the next result and None
+# to stop. Every worker has up to `prefetch` requests outstanding, so it keeps generating while the parent
+# publishes or inserts. On None the producer is called one last time with None (to flush whatever it
+# buffers) and the worker exits. Exceptions in a worker are sent back and raised in the parent. Every
+# response also carries the CPU time the worker has used so far (cpu_time() sums them): with the fork server
+# the workers are not children of the parent, so RUSAGE_CHILDREN does not see them.
+#
+# The producer factory is called in the worker process, with (index, nr_of_workers), and returns the
+# producer callable. With the default start method 'fork' the workers are copies of the parent, so the
+# factory can use everything the caller set up. Forking a process that runs other threads (e.g. the event
+# loop threads of an MQTT connection kept across invocations) can deadlock the child on a lock one of them
+# held. Such callers use start_method='forkserver': the workers are forked from a server process that
+# starts without threads and imports the `preload` modules once, the factory must be picklable then (a
+# module level function or a functools.partial of one).
+
+import logging
+import multiprocessing
+import time
+import traceback
+from multiprocessing.connection import wait
+
+_OK = 0
+_ERROR = 1
+
+
+def _worker_main(conn, factory, index, nr_of_workers):
+    try:
+        produce = factory(index, nr_of_workers)
+        while True:
+            request = conn.recv()
+            value = produce(request)
+            # The CPU time of a forked process starts at zero
+            conn.send((_OK, value, time.process_time()))
+            if request is None:
+                break
+    except Exception:
+        conn.send((_ERROR, traceback.format_exc(), time.process_time()))
+    finally:
+        conn.close()
+
+
+class WorkerError(RuntimeError):
+    pass
+
+
+class WorkerPool:
+
+    def __init__(self, nr_of_workers, factory, prefetch=2, start_method='fork', preload=()):
+        if nr_of_workers < 1:
+            raise ValueError("nr_of_workers must be at least 1")
+        if start_method not in ('fork', 'forkserver'):
+            raise ValueError(f"Unsupported start method {start_method}, use fork or forkserver")
+        self.nr_of_workers = nr_of_workers
+        self.factory = factory
+        self.prefetch = max(prefetch, 1)
+        self.start_method = start_method
+        self.preload = list(preload)
+        self.processes = []
+        self.connections = []
+        self.outstanding = {}
+        self.results = 0
+        # Latest CPU time reported by every worker
+        self.cpu = {}
+
+    def start(self):
+        # Never 'spawn', the workers rely on module state set up at import (the preloaded modules for the
+        # fork server, which keeps running and serves the pools of later invocations)
+        context = multiprocessing.get_context(self.start_method)
+        if self.start_method == 'forkserver' and self.preload:
+            context.set_forkserver_preload(self.preload)
+        for index in range(self.nr_of_workers):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_worker_main, args=(child_conn, self.factory, index, self.nr_of_workers),
+                                      name=f"generation-worker-{index}", daemon=True)
+            process.start()
+            child_conn.close()
+            self.processes.append(process)
+            self.connections.append(parent_conn)
+            self.outstanding[parent_conn] = 0
+            for _ in range(self.prefetch):
+                self._request(parent_conn, True)
+        logging.info(f"Started {self.nr_of_workers} generation worker processes")
+
+    def _request(self, conn, request):
+        conn.send(request)
+        self.outstanding[conn] += 1
+
+    def _receive(self, conn):
+        try:
+            status, value, cpu = conn.recv()
+        except EOFError:
+            raise WorkerError("Generation worker exited unexpectedly") from None
+        self.outstanding[conn] -= 1
+        self.cpu[conn] = cpu
+        if status == _ERROR:
+            raise WorkerError(f"Generation worker failed:\n{value}")
+        self.results += 1
+        return value
+
+    def next(self):
+        # The next result of whichever worker finishes first, that worker is asked for another one
+        ready = wait([conn for conn in self.connections if self.outstanding[conn]])
+        conn = ready[0]
+        value = self._receive(conn)
+        self._request(conn, True)
+        return value
+
+    def cpu_time(self):
+        # Seconds of CPU time all workers reported, up to their latest responses
+        return sum(self.cpu.values())
+
+    def close(self, timeout=10.0):
+        # Stop all workers and return the results that were still outstanding, including the final
+        # results of the producers. Collecting the results and the exits of the workers take at most
+        # `timeout` seconds together, workers that are not done by then are terminated and their missing
+        # results are dropped.
+        deadline = time.monotonic() + timeout
+        remaining = []
+        errors = []
+        try:
+            for conn in self.connections:
+                try:
+                    self._request(conn, None)
+                except OSError:
+                    # The worker is gone already, its failure was raised by next()
+                    self.outstanding[conn] = 0
+            for conn in self.connections:
+                try:
+                    while self.outstanding[conn]:
+                        if not conn.poll(max(deadline - time.monotonic(), 0.0)):
+                            logging.info(f"Dropping {self.outstanding[conn]} results of a generation worker "
+                                         f"that did not deliver them within {timeout}s")
+                            self.outstanding[conn] = 0
+                            break
+                        remaining.append(self._receive(conn))
+                except WorkerError as e:
+                    errors.append(e)
+                    self.outstanding[conn] = 0
+        finally:
+            for conn in self.connections:
+                conn.close()
+            for process in self.processes:
+                process.join(max(deadline - time.monotonic(), 0.0))
+                if process.is_alive():
+                    logging.info(f"{process.name} did not exit within {timeout}s, terminating it")
+                    process.terminate()
+                    process.join()
+            self.connections = []
+            self.processes = []
+        if errors:
+            raise errors[0]
+        return remaining
+
+    def terminate(self):
+        # Stop all workers immediately and discard their results, for error paths
+        for conn in self.connections:
+            conn.close()
+        for process in self.processes:
+            process.terminate()
+            process.join()
+        self.connections = []
+        self.processes = []
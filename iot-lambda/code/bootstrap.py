@@ -0,0 +1,142 @@
+# Cold start bootstrap of the IOT producer Lambda: IOT endpoint, device certificate, private key and root CA.
+#
+#   * The Amazon Root CA 1 is bundled with the function code instead of being downloaded on every cold start.
+#   * describe_endpoint, describe_certificate and get_secret_value run concurrently.
+#   * The results are cached in /tmp with a TTL and a SHA-256 digest, so a re-initialised sandbox
+#     reuses them without importing boto3 or calling AWS at all.
+#   * Every step is timed and the breakdown is logged.
+
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+AMAZON_ROOT_CA_1_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "AmazonRootCA1.pem")
+CACHE_PATH = "/tmp/agri_iot_bootstrap.json"
+CACHE_VERSION = 1
+
+
+class BootstrapTimer:
+
+    def __init__(self):
+        self.steps = []
+        self.started = time.perf_counter()
+
+    def step(self, name, started):
+        self.steps.append((name, (time.perf_counter() - started) * 1000))
+
+    def log(self, source):
+        breakdown = ", ".join(f"{name} {ms:.1f}ms" for name, ms in self.steps)
+        total = (time.perf_counter() - self.started) * 1000
+        logging.info(f"Cold start bootstrap from {source} took {total:.1f}ms: {breakdown}")
+
+
+def _digest(values):
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode()).hexdigest()
+
+
+def _read_cache(cache_path, certificate_id, secret_arn, ttl):
+    # Returns the cached values if the cache exists, belongs to this certificate/secret, is younger
+    # than ttl seconds and passes the integrity check, otherwise None
+    try:
+        with open(cache_path) as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    values = cache.get('values')
+    if (cache.get('version') != CACHE_VERSION
+            or not isinstance(values, dict)
+            or cache.get('digest') != _digest(values)):
+        logging.info("Bootstrap cache failed the integrity check, ignoring it")
+        return None
+    if values.get('certificate_id') != certificate_id or values.get('secret_arn') != secret_arn:
+        return None
+    if time.time() - cache.get('created', 0) > ttl:
+        return None
+    return values
+
+
+def _write_cache(cache_path, values):
+    # Write atomically and readable for the owner only, the cache holds the private key
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as cache_file:
+        json.dump({'version': CACHE_VERSION, 'created': time.time(), 'digest': _digest(values), 'values': values}, cache_file)
+    os.replace(temp_path, cache_path)
+
+
+def _fetch(certificate_id, secret_arn, timer):
+    started = time.perf_counter()
+    import boto3
+    timer.step("import boto3", started)
+
+    started = time.perf_counter()
+    session = boto3.Session()
+    # Clients are created up front, creating them is not thread safe but using them is
+    iot_c = session.client('iot')
+    secretsmanager = session.client("secretsmanager")
+    timer.step("create clients", started)
+
+    def timed(name, call):
+        call_started = time.perf_counter()
+        result = call()
+        timer.step(name, call_started)
+        return result
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        endpoint = executor.submit(timed, "describe_endpoint",
+                                   lambda: iot_c.describe_endpoint(endpointType='iot:Data-ATS')['endpointAddress'])
+        certificate = executor.submit(timed, "describe_certificate",
+                                      lambda: iot_c.describe_certificate(certificateId=certificate_id)['certificateDescription']['certificatePem'])
+        private_key = executor.submit(timed, "get_secret_value",
+                                      lambda: secretsmanager.get_secret_value(SecretId=secret_arn)["SecretString"])
+        values = {
+            'certificate_id': certificate_id,
+            'secret_arn': secret_arn,
+            'endpoint': endpoint.result(),
+            'certificate_pem': certificate.result(),
+            'private_key': private_key.result(),
+        }
+    timer.step("AWS calls (concurrent)", started)
+    return values
+
+
+def _write_if_changed(path, content):
+    try:
+        with open(path) as existing:
+            if existing.read() == content:
+                return
+    except OSError:
+        pass
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as target:
+        target.write(content)
+
+
+def load(certificate_id, secret_arn, certificate_path, private_key_path, ttl=3600, cache_path=CACHE_PATH):
+    # Returns the IOT data endpoint and makes sure certificate and private key are written to their paths
+    timer = BootstrapTimer()
+
+    started = time.perf_counter()
+    values = _read_cache(cache_path, certificate_id, secret_arn, ttl) if ttl > 0 else None
+    timer.step("read cache", started)
+
+    source = "cache"
+    if values is None:
+        source = "AWS"
+        values = _fetch(certificate_id, secret_arn, timer)
+        if ttl > 0:
+            started = time.perf_counter()
+            _write_cache(cache_path, values)
+            timer.step("write cache", started)
+
+    started = time.perf_counter()
+    _write_if_changed(certificate_path, values['certificate_pem'])
+    _write_if_changed(private_key_path, values['private_key'])
+    timer.step("write certificate and key", started)
+
+    timer.log(source)
+    return values['endpoint']
@@ -0,0 +1,117 @@
+# Keeps the MQTT connection of the IOT producer Lambda alive across warm invocations.
+#
+# Creating a connection costs an event loop group, a resolver, a client bootstrap and a mutual TLS
+# handshake with IOT Core. The manager lives at module level, hands the connection of the previous
+# invocation to the next one if it is still healthy, and only connects anew when there is none or it
+# cannot be used:
+#   * connected: reused as is, a TLS handshake was avoided,
+#   * interrupted: the CRT reconnects by itself (interrupted/resumed callbacks), the manager waits up to
+#     resume_timeout seconds for it to come back,
+#   * idle for longer than max_idle (IOT Core closes connections after 1.5 times the keep alive, which it
+#     raises to at least 30 seconds) or not resumed in time: replaced by a new connection.
+# New connections are retried with exponential backoff and jitter.
+
+import logging
+import random
+import time
+
+
+class ConnectionManager:
+
+    def __init__(self, factory, resume_timeout=5.0, max_idle=40.0, max_attempts=5, min_backoff=0.5,
+                 max_backoff=8.0, clock=time.monotonic, sleep=time.sleep):
+        # factory(client_id) returns a connected publisher (MqttConnectionPool, Mqtt5Publisher, LoopbackPublisher)
+        self.factory = factory
+        self.resume_timeout = resume_timeout
+        self.max_idle = max_idle
+        self.max_attempts = max_attempts
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self._sleep = sleep
+        self.connection = None
+        self.client_id = None
+        self.released = None
+        self.connects = 0
+        self.failed_connects = 0
+        self.reused = 0
+        self.resumed = 0
+        self.replaced = 0
+
+    def acquire(self, client_id):
+        # Connection for this invocation. The client ID of the first invocation is kept for the lifetime
+        # of the sandbox, so the persistent session (clean_session=False) belongs to one client.
+        if self.connection is not None:
+            idle = self.clock() - self.released if self.released is not None else 0.0
+            if idle > self.max_idle:
+                logging.info(f"MQTT connection idle for {idle:.1f}s, replacing it")
+            elif self.connection.is_connected():
+                self.reused += 1
+                logging.info(f"Reusing MQTT connection of client {self.client_id} (idle {idle:.1f}s)")
+                return self.connection
+            elif self.connection.wait_connected(self.resume_timeout):
+                self.resumed += 1
+                logging.info(f"MQTT connection of client {self.client_id} resumed, reusing it")
+                return self.connection
+            else:
+                logging.info(f"MQTT connection did not resume within {self.resume_timeout}s, replacing it")
+            self.replaced += 1
+            self.invalidate()
+
+        if self.client_id is None:
+            self.client_id = client_id
+        self.connection = self._connect()
+        self.released = None
+        return self.connection
+
+    def _connect(self):
+        backoff = self.min_backoff
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                connection = self.factory(self.client_id)
+                self.connects += 1
+                return connection
+            except Exception as e:
+                self.failed_connects += 1
+                if attempt == self.max_attempts:
+                    raise
+                # Full jitter keeps concurrently retrying producers from reconnecting in lockstep
+                delay = random.uniform(0, backoff)
+                logging.info(f"MQTT connect attempt {attempt} failed ({e}), retrying in {delay:.2f}s")
+                self._sleep(delay)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def release(self):
+        # End of the invocation, the connection stays open for the next one
+        self.released = self.clock()
+
+    def invalidate(self, timeout=1.0):
+        # Drop the connection, e.g. after an error it may have caused. The next acquire() connects anew.
+        connection, self.connection = self.connection, None
+        self.released = None
+        if connection is not None:
+            try:
+                connection.disconnect(timeout=timeout)
+            except Exception as e:
+                logging.info(f"Disconnecting the dropped MQTT connection failed: {e}")
+
+    def stats(self):
+        acquired = self.connects + self.reused + self.resumed
+        result = {
+            'client_id': self.client_id,
+            'connects': self.connects,
+            'failed_connects': self.failed_connects,
+            'reused': self.reused,
+            'resumed': self.resumed,
+            'replaced': self.replaced,
+            # Invocations that published without any TLS handshake. A resumed connection skipped the
+            # client setup, but the CRT did a handshake to reconnect it.
+            'handshakes_avoided': self.reused,
+            'reuse_ratio': round((self.reused + self.resumed) / acquired, 3) if acquired else 0.0,
+        }
+        if self.connection is not None:
+            result.update(self.connection.health())
+        return result
+
+    def log_stats(self):
+        logging.info(f"MQTT connection manager: {self.stats()}")
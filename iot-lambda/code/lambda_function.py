@@ -1,16 +1,33 @@
 #!/usr/bin/env python3
 
+import functools
 import logging
-from awscrt import io, mqtt
-from awsiot import mqtt_connection_builder
-import time 
-import json
+from awscrt import mqtt
 import os
 import random
 import datetime
-import boto3
-import requests
-import uuid
+import time
+import bootstrap
+from agri_common import framing
+from agri_common.bsonbatch import TelemetryBSONEncoder
+from agri_common.columnar import encode_columns
+from agri_common.corpus import Corpus, CorpusReplay
+from agri_common.encoder import TelemetryEncoder
+from agri_common.fleet import FleetSimulator
+from agri_common import ids
+from agri_common.metrics import BYTES, Metrics
+from agri_common.pacing import RateController
+from agri_common import runloop
+from agri_common.runloop import RunLoop
+from agri_common.telemetry import FIELDS, generate_batch
+from agri_common.timestamps import check_format
+from agri_common.workers import WorkerPool
+from connection_manager import ConnectionManager
+from loopback_publisher import LoopbackPublisher
+from mqtt5_publisher import Mqtt5Publisher
+from mqtt_pool import MqttConnectionPool
+from payload_packer import IOT_CORE_MAX_PAYLOAD_BYTES, ColumnarBatchSizer, PayloadPacker, payload_budget
+from publish_pipeline import PublishPipeline
 
 # Define ENDPOINT, CLIENT_ID, PATH_TO_CERTIFICATE, PATH_TO_PRIVATE_KEY, PATH_TO_AMAZON_ROOT_CA_1, MESSAGE, TOPIC, and RANGE
 
@@ -18,177 +35,443 @@ logging.basicConfig(level=logging.INFO)
 
 RANGE = 5900
 BATCH_SIZE = 200
-SLEEP_INTERVAL = 0.01
+
+# Maximum number of unfinished publishes and the QoS (0 or 1) used for publishing.
+# The producer waits for a free slot instead of sleeping between batches.
+PUBLISH_WINDOW = int(os.environ.get('PUBLISH_WINDOW', '16'))
+PUBLISH_QOS = mqtt.QoS(int(os.environ.get('PUBLISH_QOS', '0')))
+
+# Byte budget of one MQTT payload, records are packed until it is full. 0 sends every generated batch as one payload.
+PAYLOAD_MAX_BYTES = int(os.environ.get('PAYLOAD_MAX_BYTES', str(IOT_CORE_MAX_PAYLOAD_BYTES)))
+
+# Optional payload compression: none, zlib or zstd (zstd falls back to zlib if zstandard is not installed).
+# Compressed payloads carry a framing header, the Kinesis reader still accepts plain JSON payloads.
+COMPRESSION = os.environ.get('COMPRESSION', 'none')
+COMPRESSION_LEVEL = int(os.environ['COMPRESSION_LEVEL']) if os.environ.get('COMPRESSION_LEVEL') else None
+if COMPRESSION not in framing.CODECS:
+    raise ValueError(f"Unknown COMPRESSION {COMPRESSION}, use one of {list(framing.CODECS)}")
+if COMPRESSION == 'zstd' and not framing.zstd_available():
+    logging.info("zstandard is not installed, falling back to zlib compression")
+    COMPRESSION = 'zlib'
+CODEC = framing.CODECS[COMPRESSION]
+
+# Payload format: "rows" (JSON array of documents), "columns" (columnar batch, see agri_common.columnar) or
+# "bson" (concatenated BSON documents the Kinesis reader inserts as they are, see agri_common.bsonbatch)
+PAYLOAD_FORMAT_NAME = os.environ.get('PAYLOAD_FORMAT', 'rows')
+if PAYLOAD_FORMAT_NAME not in framing.FORMATS:
+    raise ValueError(f"Unknown PAYLOAD_FORMAT {PAYLOAD_FORMAT_NAME}, use one of {list(framing.FORMATS)}")
+PAYLOAD_FORMAT = framing.FORMATS[PAYLOAD_FORMAT_NAME]
+
+# Plain JSON rows are sent unframed, everything else carries the framing header within PAYLOAD_MAX_BYTES
+PACKING_MAX_BYTES = payload_budget(PAYLOAD_MAX_BYTES, CODEC != framing.CODEC_NONE or PAYLOAD_FORMAT != framing.FORMAT_JSON_ROWS)
+
+# MQTT protocol version of the producer: "3.1.1" or "5". MQTT5 uses payload properties and the broker's
+# receive maximum as upper bound of the QoS 1 publish window.
+MQTT_VERSION = os.environ.get('MQTT_VERSION', '3.1.1')
+if MQTT_VERSION not in ('3.1.1', '5'):
+    raise ValueError(f"Unknown MQTT_VERSION {MQTT_VERSION}, use 3.1.1 or 5")
+
+# Number of parallel MQTT connections (3.1.1 only), event loop threads and how batches are spread over the connections
+MQTT_CONNECTIONS = int(os.environ.get('MQTT_CONNECTIONS', '1'))
+EVENT_LOOP_THREADS = int(os.environ.get('EVENT_LOOP_THREADS', '1'))
+PUBLISH_STRATEGY = os.environ.get('PUBLISH_STRATEGY', 'round_robin')
+
+# Number of generation worker processes. 0 generates in the handler's process. Workers only pay off with
+# more than one vCPU (memory size of 3538 MB and more), the handler's process then only publishes.
+GENERATION_WORKERS = int(os.environ.get('GENERATION_WORKERS', '0'))
+
+# Keep the MQTT connection open for the next warm invocation instead of connecting in every invocation.
+# A kept connection idle for longer than MQTT_MAX_IDLE seconds is replaced, an interrupted one gets
+# MQTT_RESUME_TIMEOUT seconds to be reconnected by the CRT before it is replaced.
+MQTT_REUSE_CONNECTION = os.environ.get('MQTT_REUSE_CONNECTION', 'true').lower() == 'true'
+MQTT_MAX_IDLE = float(os.environ.get('MQTT_MAX_IDLE', '40'))
+MQTT_RESUME_TIMEOUT = float(os.environ.get('MQTT_RESUME_TIMEOUT', '5'))
+
+# Where the producer publishes to: "iot" (AWS IOT Core) or "loopback" (in-process stand-in that sends nothing,
+# used by benchmarks/bench_producer.py). Loopback skips all AWS calls, LOOPBACK_ACK_DELAY emulates PUBACK latency.
+IOT_PUBLISHER = os.environ.get('IOT_PUBLISHER', 'iot')
+if IOT_PUBLISHER not in ('iot', 'loopback'):
+    raise ValueError(f"Unknown IOT_PUBLISHER {IOT_PUBLISHER}, use iot or loopback")
+LOOPBACK_ACK_DELAY = float(os.environ.get('LOOPBACK_ACK_DELAY', '0'))
+
+# Seconds the handler keeps producing at most. It stops earlier when the function's timeout is closer than
+# RUN_SAFETY_MARGIN seconds, which are left to drain outstanding publishes and disconnect.
+RUN_SECONDS, RUN_SAFETY_MARGIN = runloop.settings(os.environ)
 
 TOPIC = os.environ.get('IOT_TOPIC')
 logging.info("Environment variable TOPIC is; {TOPIC}")
+
+# Basic Ingest publishes to the reserved topic $aws/rules/<IOT_RULE_NAME>/<IOT_TOPIC>, which IOT Core hands
+# straight to the rule without the message broker (no subscribers are served and no messaging is charged)
+IOT_BASIC_INGEST = os.environ.get('IOT_BASIC_INGEST', 'false').lower() == 'true'
+IOT_RULE_NAME = os.environ.get('IOT_RULE_NAME', 'AgriIoTRule')
+PUBLISH_PATH = 'basic_ingest' if IOT_BASIC_INGEST else 'broker'
+PUBLISH_TOPIC = f"$aws/rules/{IOT_RULE_NAME}/{TOPIC}" if IOT_BASIC_INGEST else TOPIC
 CERTIFICATE_ID = os.environ.get("CERTIFICATE_ID")
 logging.info( f"Environment variable CERTIFICATE_ID is; {CERTIFICATE_ID}")
 CERTIFICATE_PATH = "/tmp/certificate.pem.crt"
 
-PRIVATE_KEY_SECRET_ARN = os.environ['PRIVATE_KEY_SECRET_ARN']
+PRIVATE_KEY_SECRET_ARN = os.environ['PRIVATE_KEY_SECRET_ARN'] if IOT_PUBLISHER == 'iot' else os.environ.get('PRIVATE_KEY_SECRET_ARN')
 logging.info( f"Environment variable PRIVATE_KEY_SECRET_ARN is; {PRIVATE_KEY_SECRET_ARN}")
 PRIVATE_KEY_PATH = "/tmp/private_key.key"
 
-AMAZON_ROOT_CA_1_DOWNLOAD_URL = "https://www.amazontrust.com/repository/AmazonRootCA1.pem"
-AMAZON_ROOT_CA_1_PATH = "/tmp/AmazonRootCA1.pem"
-
-response = requests.get(AMAZON_ROOT_CA_1_DOWNLOAD_URL)
-if response.status_code == 200:
-    with open(AMAZON_ROOT_CA_1_PATH, 'w') as file:
-        file.write(response.content.decode())
-    logging.info("Amazon Root CA certificate downloaded successfully.")
-else:
-    logging.info("Failed to download Amazon Root CA certificate.")
-
-session = boto3.Session()
-iot_c = session.client('iot')
-endpoint = iot_c.describe_endpoint(endpointType = 'iot:Data-ATS')['endpointAddress']
-cert = iot_c.describe_certificate(certificateId = CERTIFICATE_ID)['certificateDescription']['certificatePem']
-
-secretsmanager = session.client("secretsmanager")
-response = secretsmanager.get_secret_value(SecretId=PRIVATE_KEY_SECRET_ARN)
-private_key = response["SecretString"]
-
-with open(PRIVATE_KEY_PATH, "w") as key_file:
-    key_file.write(private_key)
-
-with open(CERTIFICATE_PATH,"w") as pem_file:
-    pem_file.write(cert)
-
-def generate_synthetic_data(num_records,  request_id):
-    data = []
-
-    for _ in range(num_records):
-        current_time = datetime.datetime.now().isoformat()
-        record = {
-            "_id": str(uuid.uuid4()) + "-" + request_id,  # Assign a unique _id for each document
-            'ts': current_time,
-            'vehicleid': random.randint(1, 50000),
-            'temperature': round(random.uniform(5.0, 40.0), 2),
-            'operatingtime': random.randint(0, 1000),
-            'fuelusage': round(random.uniform(0.0, 10.0), 2),
-            'front_linkage_position': random.randint(0, 100),
-            'drivingspeed': random.randint(0, 40),
-            'enginestate': random.choice([0, 1]),
-            'autopilot_system_state': random.choice([0, 1]),
-            'engine_load': round(random.uniform(0.0, 100.0), 2),
-            'latitude': round(random.uniform(-90.0, 90.0), 6),
-            'longitude': round(random.uniform(-180.0, 180.0), 6),
-            'altitude': round(random.uniform(0.0, 1000.0), 2),
-            'engine_rotation': round(random.uniform(0.0, 3000.0), 2),
-            'front_pme_shaft': round(random.uniform(0.0, 100.0), 2),
-            'rear_linkage_position': random.randint(0, 100),
-            'four_wheel_driving_state': random.choice(['Engaged', 'Disengaged']),
-            'fuel_tank_level': random.randint(0, 100),
-            'last_error_msg': random.choice(['No Error', 'Warning: Low Fuel Level', 'Error: Engine Overheating']),
-            'engine_temperature': round(random.uniform(60.0, 110.0), 2),
-            'connection_state': random.choice(['Connected', 'Disconnected']),
-            'lte_connection_level': round(random.uniform(0.0, 100.0), 2),
-            'mode': random.choice(['Normal', 'Eco', 'Work'])
-        }
-
-
-        if random.random() < 0.5:
-            record.pop('operatingtime')
-        if random.random() < 0.5:
-            record.pop('autopilot_system_state')
-        if random.random() < 0.5:
-            record.pop('enginestate')
-        if random.random() < 0.5:
-            record.pop('temperature')
-
-
-        if random.random() < 0.3:
-            record.pop('front_linkage_position')
-            record.pop('rear_linkage_position')
-            record.pop('engine_rotation')
-            record.pop('four_wheel_driving_state')
-        if random.random() < 0.4:
-            record.pop('front_pme_shaft')
-
-        data.append(record)
-
-
-    return data
-
-
-def send_messages(mqtt_connection, messages):
-    if not messages:
+# The Amazon Root CA 1 is bundled with the function code
+AMAZON_ROOT_CA_1_PATH = bootstrap.AMAZON_ROOT_CA_1_PATH
+
+# Seconds the endpoint, certificate and private key are cached in /tmp across sandbox re-inits, 0 disables the cache
+BOOTSTRAP_CACHE_TTL = int(os.environ.get('BOOTSTRAP_CACHE_TTL', '3600'))
+
+# Fetch endpoint, certificate and private key concurrently (or from the /tmp cache) and write certificate and key
+endpoint = None
+if IOT_PUBLISHER == 'iot':
+    endpoint = bootstrap.load(CERTIFICATE_ID, PRIVATE_KEY_SECRET_ARN, CERTIFICATE_PATH, PRIVATE_KEY_PATH, ttl=BOOTSTRAP_CACHE_TTL)
+
+# Telemetry source: "random" (independent random readings), "fleet" (stateful fleet simulator) or "replay"
+# (pre-generated corpus, see tools/build_corpus.py). The simulator state lives at module level, so the
+# time series continue across warm invocations. Generation workers start from a copy of it and hand the
+# state of their partitions back with their final results. A replay starts at the beginning of the corpus in every
+# invocation (or at the event field "corpus_position"), so runs with the same corpus push the same workload.
+DATA_GENERATOR = os.environ.get('DATA_GENERATOR', 'random')
+if DATA_GENERATOR not in ('random', 'fleet', 'replay'):
+    raise ValueError(f"Unknown DATA_GENERATOR {DATA_GENERATOR}, use random, fleet or replay")
+fleet = FleetSimulator(int(os.environ.get('FLEET_SIZE', '50000'))) if DATA_GENERATOR == 'fleet' else None
+CORPUS_PATH = os.environ.get('CORPUS_PATH', '/opt/corpus/telemetry.bin')
+corpus = Corpus(CORPUS_PATH) if DATA_GENERATOR == 'replay' else None
+
+# Representation of ts: "iso" (isoformat strings) or "epoch_ms" (epoch milliseconds, stored as BSON datetime
+# by the Kinesis reader). The query functions need the same setting, see agri_common.timestamps.
+TS_FORMAT = check_format(os.environ.get('TS_FORMAT', 'iso'))
+
+# Document ids: "uuid" (uuid4 string with the request id) or "objectid" (time ordered 12 byte ObjectIds,
+# sent as hex strings and stored as ObjectId by the Kinesis reader), see agri_common.ids
+ID_FORMAT = ids.check_format(os.environ.get('ID_FORMAT', 'uuid'))
+
+# EMF metrics (generate/serialize time, publish latency, payload bytes, ...), flushed every METRICS_FLUSH_INTERVAL seconds
+metrics = Metrics()
+
+# Schema specialized JSON (or BSON) encoder, reuses its output buffer for every batch
+encoder = TelemetryBSONEncoder() if PAYLOAD_FORMAT == framing.FORMAT_BSON else TelemetryEncoder()
+
+def generate_synthetic_data(num_records,  request_id, replay=None):
+    # Fields are generated column-wise for the whole batch, the encoder consumes the columns directly
+    if replay:
+        return replay.next_batch(num_records, request_id, ts_format=TS_FORMAT, id_format=ID_FORMAT)
+    if fleet:
+        return fleet.tick(num_records, request_id, ts_format=TS_FORMAT, id_format=ID_FORMAT)
+    return generate_batch(num_records, request_id, ts_format=TS_FORMAT, id_format=ID_FORMAT)
+
+
+def frame_payload(payload, content_format=framing.FORMAT_JSON_ROWS):
+    # Plain JSON rows are sent unframed for compatibility, everything else carries the framing header.
+    # Returns (None, framed) for a framed payload over the IOT Core limit, the caller drops it instead of publishing.
+    framed = CODEC != framing.CODEC_NONE or content_format != framing.FORMAT_JSON_ROWS
+    if framed:
+        with metrics.timer('FrameTime'):
+            payload = framing.frame(payload, CODEC, content_format, level=COMPRESSION_LEVEL)
+        if len(payload) > IOT_CORE_MAX_PAYLOAD_BYTES:
+            # IOT Core would reject it, e.g. compression of an incompressible body added more than it saved
+            logging.info(f"Dropped framed payload of {len(payload)} bytes, it exceeds the IOT Core limit, lower PAYLOAD_MAX_BYTES")
+            return None, framed
+    return payload, framed
+
+
+def publish_payload(pipeline, rate_controller, payload, nr_of_records, framed):
+    # Wait for the time budget of this payload, time spent generating and publishing already counts
+    rate_controller.pace(nr_of_records)
+
+    # Publish the batched messages, blocks while the publish window is full
+    pipeline.submit(payload, nr_of_records=nr_of_records, framed=framed)
+    metrics.count('RecordsPublished', nr_of_records)
+    metrics.count('PayloadsPublished')
+    metrics.count('PayloadBytes', len(payload), BYTES)
+    metrics.observe('PayloadSize', len(payload), BYTES)
+
+
+def send_columnar(emit, sizer, messages):
+    # Encode the whole batch as one columnar payload, splitting it in halves until it fits the byte budget
+    with metrics.timer('SerializeTime'):
+        body = encode_columns(messages, FIELDS)
+    if PACKING_MAX_BYTES and len(body) > PACKING_MAX_BYTES and len(messages) > 1:
+        half = len(messages) // 2
+        send_columnar(emit, sizer, messages.slice(0, half))
+        send_columnar(emit, sizer, messages.slice(half, len(messages)))
         return
+    if sizer:
+        sizer.observe(len(messages), len(body))
+    emit(body, len(messages), framing.FORMAT_JSON_COLUMNS)
 
-    payload = json.dumps(messages)
 
-    # Publish the batched messages
-    try:
-        mqtt_connection.publish(topic=TOPIC, payload=payload, qos=mqtt.QoS.AT_MOST_ONCE)
-        logging.info("Message published successfully.")
-    except Exception as e:
-        logging.info("Error occurred while publishing the message:" + str(e))
+def send_messages(emit, packer, messages):
+    # Encode a batch into payloads and hand every finished payload to emit(payload, nr_of_records, content_format)
+    if not messages:
+        return
 
+    if PAYLOAD_FORMAT == framing.FORMAT_JSON_COLUMNS:
+        send_columnar(emit, packer, messages)
+        return
 
-def connect_mqtt(client_id):
+    if packer is None:
+        # One payload per generated batch.
+        # Same bytes as json.dumps(messages.records()), the buffer is reused by the next encode() call
+        with metrics.timer('SerializeTime'):
+            payload = encoder.encode(messages)
+        emit(payload, len(messages), PAYLOAD_FORMAT)
+        return
 
-    # Spin up resources
-    event_loop_group = io.EventLoopGroup(1)
-    host_resolver = io.DefaultHostResolver(event_loop_group)
-    client_bootstrap = io.ClientBootstrap(event_loop_group, host_resolver)
+    # Fill payloads up to the byte budget, a batch can complete no, one or several payloads
+    with metrics.timer('SerializeTime'):
+        records = encoder.encode_records(messages)
+    for record in records:
+        packed = packer.add(record)
+        if packed:
+            emit(*packed, PAYLOAD_FORMAT)
+
+
+def create_packer():
+    # Pack records into payloads up to PAYLOAD_MAX_BYTES (less the framing header of framed payloads), or send
+    # every generated batch as one payload.
+    # Columnar payloads are encoded per batch, there the batch size is chosen to fill the budget instead.
+    if PACKING_MAX_BYTES and PAYLOAD_FORMAT == framing.FORMAT_JSON_COLUMNS:
+        return ColumnarBatchSizer(PACKING_MAX_BYTES, initial_size=BATCH_SIZE)
+    if PACKING_MAX_BYTES and PAYLOAD_FORMAT == framing.FORMAT_BSON:
+        # BSON documents carry their own length and are simply concatenated
+        return PayloadPacker(PACKING_MAX_BYTES, opening=b'', separator=b'', closing=b'')
+    if PACKING_MAX_BYTES:
+        return PayloadPacker(PACKING_MAX_BYTES)
+    return None
+
+
+def next_batch_size(packer):
+    if isinstance(packer, ColumnarBatchSizer):
+        return packer.next_size()
+    return random.randint(BATCH_SIZE-20, BATCH_SIZE+20)
+
+
+def flush_packer(emit, packer):
+    # Send the partially filled last payload
+    if isinstance(packer, PayloadPacker):
+        packed = packer.flush()
+        if packed:
+            emit(*packed, PAYLOAD_FORMAT)
+    if packer:
+        logging.info(f"Payload packing summary: {packer.summary()}")
+
+
+def payload_worker(request_id, corpus_position, fleet_state, index, nr_of_workers):
+    # Producer factory for the generation workers, bound to the invocation with functools.partial so the
+    # fork server can pickle it: every result is (payloads, nr_of_records, generate_ms, serialize_ms,
+    # fleet_partition) with payloads as (framed payload bytes, nr_of_records, framed) ready to publish.
+    # fleet_partition is None except in the final result, where it is the state of the worker's vehicles.
+    global metrics
+    # Timings are returned to the parent, the worker's own metrics are never flushed
+    metrics = Metrics(emit=lambda document: None)
+    if fleet:
+        # The fork server's simulator never ticks, the worker continues from the parent's state. Its random
+        # generator is not reseeded by fork, every worker would draw the same _ids without a new seed.
+        fleet.load_state(fleet_state)
+        fleet.rng.seed()
+        fleet.restrict(index, nr_of_workers)
+    replay = CorpusReplay(corpus, corpus_position + index * len(corpus) // nr_of_workers) if corpus else None
+    packer = create_packer()
+
+    def produce(request):
+        payloads = []
+
+        def emit(payload, nr_of_records, content_format=framing.FORMAT_JSON_ROWS):
+            # Oversize payloads are passed as None, the parent counts them
+            payload, framed = frame_payload(payload, content_format)
+            payloads.append((None if payload is None else bytes(payload), nr_of_records, framed))
+
+        if request is None:
+            flush_packer(emit, packer)
+            return payloads, 0, 0.0, 0.0, fleet.partition_state(index, nr_of_workers) if fleet else None
+        started = time.perf_counter()
+        messages = generate_synthetic_data(next_batch_size(packer), request_id, replay)
+        generated = time.perf_counter()
+        send_messages(emit, packer, messages)
+        return payloads, len(messages), (generated - started) * 1000, (time.perf_counter() - generated) * 1000, None
+
+    return produce
+
+
+def publish_worker_result(pipeline, rate_controller, result):
+    # Publish the payloads of one worker result, returns the number of generated records
+    payloads, nr_of_records, generate_ms, serialize_ms, fleet_partition = result
+    if fleet_partition:
+        fleet.load_state(*fleet_partition)
+    if nr_of_records:
+        metrics.observe('GenerateTime', generate_ms)
+        metrics.observe('SerializeTime', serialize_ms)
+    for payload, payload_records, framed in payloads:
+        if payload is None:
+            metrics.count('OversizePayloads')
+            continue
+        publish_payload(pipeline, rate_controller, payload, payload_records, framed)
+    return nr_of_records
 
 
+def connect_mqtt(client_id):
 
-    mqtt_connection = mqtt_connection_builder.mtls_from_path(
+    if IOT_PUBLISHER == 'loopback':
+        mqtt_connection = LoopbackPublisher(client_id, ack_delay=LOOPBACK_ACK_DELAY)
+        mqtt_connection.connect()
+        return mqtt_connection
+
+    if MQTT_VERSION == '5':
+        mqtt_connection = Mqtt5Publisher(
+                    endpoint=endpoint,
+                    cert_filepath=CERTIFICATE_PATH,
+                    pri_key_filepath=PRIVATE_KEY_PATH,
+                    ca_filepath=AMAZON_ROOT_CA_1_PATH,
+                    client_id=client_id,
+                    event_loop_threads=EVENT_LOOP_THREADS,
+                    )
+        mqtt_connection.connect()
+        return mqtt_connection
+
+    # Spin up a pool of connections sharing one event loop group
+    mqtt_connection = MqttConnectionPool(
                 endpoint=endpoint,
                 cert_filepath=CERTIFICATE_PATH,
                 pri_key_filepath=PRIVATE_KEY_PATH,
-                client_bootstrap=client_bootstrap,
                 ca_filepath=AMAZON_ROOT_CA_1_PATH,
                 client_id=client_id,
-                clean_session=False,
-                keep_alive_secs=6
+                nr_of_connections=MQTT_CONNECTIONS,
+                event_loop_threads=EVENT_LOOP_THREADS,
+                strategy=PUBLISH_STRATEGY
                 )
-    logging.info("Connecting to {} with client ID '{}'...".format(
-            endpoint, client_id))
 
     # Connect to MQTT broker
-    logging.info(mqtt_connection.connect().result())
+    mqtt_connection.connect()
     return mqtt_connection
 
 
+# Lives as long as the sandbox, connect_mqtt is looked up on every connect so it can be wrapped
+connection_manager = ConnectionManager(lambda client_id: connect_mqtt(client_id),
+                                       resume_timeout=MQTT_RESUME_TIMEOUT, max_idle=MQTT_MAX_IDLE)
+
+
 
 def lambda_handler(event, context):
 
+    # The event loop threads of a connection kept from the previous invocation keep running, so the
+    # generation workers are not forked from this process but from a fork server. It starts without
+    # threads at the first invocation, imports this module once and serves the workers of every invocation.
+    workers = None
+    if GENERATION_WORKERS:
+        workers = WorkerPool(GENERATION_WORKERS,
+                             functools.partial(payload_worker, context.aws_request_id, event.get('corpus_position', 0),
+                                               fleet.state() if fleet else None),
+                             start_method='forkserver', preload=[__name__])
+        workers.start()
+
     client_id = context.aws_request_id
-    mqtt_connection = connect_mqtt(client_id)
+    try:
+        if MQTT_REUSE_CONNECTION:
+            connects = connection_manager.connects
+            mqtt_connection = connection_manager.acquire(client_id)
+            metrics.count('MqttConnects', connection_manager.connects - connects)
+            metrics.count('MqttConnectionsReused', int(connection_manager.connects == connects))
+        else:
+            mqtt_connection = connect_mqtt(client_id)
+    except Exception:
+        if workers:
+            workers.terminate()
+        raise
+    window = PUBLISH_WINDOW
+    if MQTT_VERSION == '5' and PUBLISH_QOS == mqtt.QoS.AT_LEAST_ONCE and mqtt_connection.max_in_flight():
+        # Never have more unacknowledged QoS 1 publishes than the broker's receive maximum allows
+        window = min(window, mqtt_connection.max_in_flight())
+    metrics.set_property('RequestId', context.aws_request_id)
+    metrics.set_property('PublishPath', PUBLISH_PATH)
+    logging.info(f"Publishing to {PUBLISH_TOPIC} via {'Basic Ingest' if IOT_BASIC_INGEST else 'the message broker'}")
+    pipeline = PublishPipeline(mqtt_connection, PUBLISH_TOPIC, qos=PUBLISH_QOS, window=window, metrics=metrics)
+    # Optional target rate from the event or the TARGET_RECORDS_PER_SEC / TARGET_PAYLOADS_PER_SEC variables
+    rate_controller = RateController.from_config(event, os.environ)
+
+    def emit(payload, nr_of_records, content_format=framing.FORMAT_JSON_ROWS):
+        payload, framed = frame_payload(payload, content_format)
+        if payload is None:
+            metrics.count('OversizePayloads')
+            return
+        publish_payload(pipeline, rate_controller, payload, nr_of_records, framed)
+
+    packer = None if workers else create_packer()
+    replay = CorpusReplay(corpus, event.get('corpus_position', 0)) if corpus and not workers else None
     inserted_docs = 0
     last_print_nr = 0
-    i = 0
-    current_time = datetime.datetime.now()
-    end_time = current_time + datetime.timedelta(seconds=900)
-    
-    while current_time < end_time:
-        i += 1
-        logging.info(f"Batch Run:{i}")
-        random_int = random.randint(BATCH_SIZE-20, BATCH_SIZE+20)
-        messages= generate_synthetic_data(random_int, context.aws_request_id)
-
-        send_messages(mqtt_connection, messages)
-        messages = []  # Clear the batch
-        inserted_docs += random_int
-        current_time = datetime.datetime.now().isoformat()
-        if (inserted_docs > last_print_nr + 5000):
-            print(f"{current_time}:{inserted_docs-last_print_nr} records inserted this round, {inserted_docs} rows inserted in total")
-            last_print_nr = inserted_docs
-            # Sleep for the specified interval
-        time.sleep(SLEEP_INTERVAL)
-        current_time = datetime.datetime.now()
-
-
-    mqtt_connection.disconnect().result()
+    # Stops issuing batches once the next one would run into the safety margin before the function's timeout
+    run_loop = RunLoop(context, safety_margin=RUN_SAFETY_MARGIN, max_seconds=RUN_SECONDS)
+
+    try:
+        while run_loop.next():
+            logging.info(f"Batch Run:{run_loop.iterations}")
+            if workers:
+                # Workers generate, serialize and frame, this process only publishes
+                with metrics.timer('WorkerWait'):
+                    result = workers.next()
+                nr_of_records = publish_worker_result(pipeline, rate_controller, result)
+            else:
+                with metrics.timer('GenerateTime'):
+                    messages= generate_synthetic_data(next_batch_size(packer), context.aws_request_id, replay)
+
+                send_messages(emit, packer, messages)
+                nr_of_records = len(messages)
+                messages = []  # Clear the batch
+            inserted_docs += nr_of_records
+            run_loop.add(nr_of_records)
+            current_time = datetime.datetime.now().isoformat()
+            if (inserted_docs > last_print_nr + 5000):
+                print(f"{current_time}:{inserted_docs-last_print_nr} records inserted this round, {inserted_docs} rows inserted in total")
+                mqtt_connection.log_stats()
+                last_print_nr = inserted_docs
+            metrics.maybe_flush()
+    except Exception:
+        # Never leave worker processes behind in the sandbox, and do not hand a connection in an
+        # unknown state to the next invocation
+        if workers:
+            workers.terminate()
+        if MQTT_REUSE_CONNECTION:
+            connection_manager.invalidate()
+        raise
+
+
+    # Send the partially filled last payload and wait for outstanding publishes before disconnecting,
+    # both bounded by the time left before the function's timeout
+    if workers:
+        # Stop the workers and publish what they had generated already, including their last payloads
+        drain_timeout = run_loop.drain_timeout()
+        for result in workers.close(timeout=10.0 if drain_timeout is None else min(10.0, drain_timeout)):
+            nr_of_records = publish_worker_result(pipeline, rate_controller, result)
+            inserted_docs += nr_of_records
+            run_loop.add(nr_of_records)
+    else:
+        flush_packer(emit, packer)
+    drained = pipeline.drain(timeout=run_loop.drain_timeout())
+    if not drained:
+        logging.info(f"Publishes still in flight at the deadline: {pipeline.in_flight}")
+        metrics.count('UndrainedPublishes', pipeline.in_flight)
+    pipeline.log_summary()
+    rate_controller.report(force=True)
+    logging.info(f"Rate summary: {rate_controller.summary()}")
+    if replay:
+        logging.info(f"Replayed corpus {CORPUS_PATH} (seed {corpus.seed}): stopped at record {replay.position} after {replay.laps} full laps")
+    mqtt_connection.log_stats()
+    if MQTT_REUSE_CONNECTION and drained:
+        # Keep the connection for the next warm invocation
+        connection_manager.release()
+        connection_manager.log_stats()
+    elif MQTT_REUSE_CONNECTION:
+        # Publishes that did not complete point at a connection that is not healthy
+        connection_manager.invalidate(timeout=run_loop.drain_timeout())
+    else:
+        mqtt_connection.disconnect(timeout=run_loop.drain_timeout())
     mqtt_connection = None
+    run_summary = run_loop.summary()
+    logging.info(f"Run summary: {run_summary}")
+    metrics.flush()
 
     return {
         'statusCode': 200,
         'body': 'Successfully sent messages'
     }
-
-
@@ -0,0 +1,107 @@
+# In-process stand-in for the MQTT connections of the IOT producer Lambda.
+#
+# LoopbackPublisher has the interface of MqttConnectionPool and Mqtt5Publisher but sends nothing: publish()
+# copies the payload (as awscrt does) and completes the future right away, or after ack_delay seconds to
+# emulate the PUBACK latency of QoS 1. It is selected with IOT_PUBLISHER=loopback, which also skips the
+# AWS calls of the bootstrap, so the producer can run and be measured without a deployed stack.
+
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+
+class LoopbackPublisher:
+
+    def __init__(self, client_id, ack_delay=0.0):
+        self.client_id = client_id
+        self.ack_delay = ack_delay
+        self.connected = False
+        self.published = 0
+        self.published_bytes = 0
+        self.published_records = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        # Futures waiting for their emulated acknowledgement, in publish (and therefore due time) order
+        self._pending = collections.deque()
+        self._wakeup = threading.Condition(self._lock)
+        self._acker = None
+
+    def connect(self):
+        self.connected = True
+        if self.ack_delay > 0:
+            self._acker = threading.Thread(target=self._acknowledge, name="loopback-acker", daemon=True)
+            self._acker.start()
+        logging.info(f"Loopback publisher {self.client_id} connected (ack delay {self.ack_delay}s)")
+
+    def max_in_flight(self):
+        return None
+
+    def is_connected(self):
+        return self.connected
+
+    def wait_connected(self, timeout):
+        return self.connected
+
+    def health(self):
+        return {'interruptions': 0, 'resumptions': 0}
+
+    def publish(self, topic, payload, qos, retain=False, nr_of_records=None, framed=False):
+        payload = bytes(payload)
+        future = Future()
+        with self._lock:
+            self.published += 1
+            self.published_bytes += len(payload)
+            self.published_records += nr_of_records or 0
+            if self._acker is None:
+                future.set_result(None)
+            else:
+                self._in_flight += 1
+                self._pending.append((time.monotonic() + self.ack_delay, future))
+                self._wakeup.notify()
+        return future, self.published
+
+    def _acknowledge(self):
+        while True:
+            with self._lock:
+                while self.connected and not self._pending:
+                    self._wakeup.wait()
+                if not self._pending:
+                    return
+                due, future = self._pending[0]
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            with self._lock:
+                self._pending.popleft()
+                self._in_flight -= 1
+            future.set_result(None)
+
+    def in_flight(self):
+        return self._in_flight
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            'published': self.published,
+            'published_records': self.published_records,
+            'published_bytes': self.published_bytes,
+            'in_flight': self._in_flight,
+            'records_per_sec': round(self.published_records / elapsed, 1),
+            'mib_per_sec': round(self.published_bytes / elapsed / 2**20, 2),
+        }
+
+    def log_stats(self):
+        logging.info(f"Loopback publisher: {self.stats()}")
+
+    def disconnect(self, timeout=None):
+        # Pending acknowledgements are still delivered before the acker thread exits
+        with self._lock:
+            self.connected = False
+            self._wakeup.notify()
+        if self._acker:
+            self._acker.join(timeout)
+            return not self._acker.is_alive()
+        return True
@@ -0,0 +1,181 @@
+# MQTT5 publisher for the IOT producer Lambda.
+#
+# Exposes the same connect/publish/stats/disconnect interface as MqttConnectionPool, so the publish
+# pipeline, packer and rate controller work unchanged on top of it and 3.1.1 and 5 can be compared
+# with the same generator. On top of 3.1.1 it
+#   * labels every payload with payload format indicator and content type, the framing header of framed
+#     payloads carries their format and compression,
+#   * exposes the receive maximum negotiated with the broker, which bounds the QoS 1 publish window.
+#
+# Topic aliases are not used: the awscrt version in the layer has no outbound topic alias support and
+# rejects aliased publishes without topic name.
+
+import concurrent.futures
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from awscrt import io, mqtt5
+from awsiot import mqtt5_client_builder
+
+
+class Mqtt5Publisher:
+
+    def __init__(self, endpoint, cert_filepath, pri_key_filepath, ca_filepath, client_id,
+                 event_loop_threads=1):
+        self.endpoint = endpoint
+        self.client_id = client_id
+        self.negotiated_settings = None
+        self._lock = threading.Lock()
+        self._connected = Future()
+        self._stopped = Future()
+        # Set while the client is connected, cleared while it reconnects
+        self._up = threading.Event()
+        self.interruptions = 0
+        self.resumptions = 0
+
+        self.in_flight_count = 0
+        self.published = 0
+        self.published_bytes = 0
+        self.published_records = 0
+        self.failed = 0
+        self.started = time.monotonic()
+
+        # Spin up resources
+        self.event_loop_group = io.EventLoopGroup(event_loop_threads)
+        host_resolver = io.DefaultHostResolver(self.event_loop_group)
+        self.client_bootstrap = io.ClientBootstrap(self.event_loop_group, host_resolver)
+
+        self.client = mqtt5_client_builder.mtls_from_path(
+            endpoint=endpoint,
+            cert_filepath=cert_filepath,
+            pri_key_filepath=pri_key_filepath,
+            client_bootstrap=self.client_bootstrap,
+            ca_filepath=ca_filepath,
+            client_id=client_id,
+            session_behavior=mqtt5.ClientSessionBehaviorType.REJOIN_POST_SUCCESS,
+            session_expiry_interval_sec=3600,
+            keep_alive_interval_sec=6,
+            # Let the client enforce the IOT Core limits (e.g. publish TPS per connection) itself
+            extended_validation_and_flow_control_options=mqtt5.ExtendedValidationAndFlowControlOptions.AWS_IOT_CORE_DEFAULTS,
+            on_lifecycle_connection_success=self._on_connection_success,
+            on_lifecycle_connection_failure=self._on_connection_failure,
+            on_lifecycle_disconnection=self._on_disconnection,
+            on_lifecycle_stopped=self._on_stopped,
+        )
+
+    def _on_connection_success(self, data):
+        self.negotiated_settings = data.negotiated_settings
+        if self._connected.done():
+            # The client reconnected by itself after a disconnection
+            logging.info("MQTT5 connection resumed")
+            with self._lock:
+                self.resumptions += 1
+        else:
+            self._connected.set_result(data.negotiated_settings)
+        self._up.set()
+
+    def _on_connection_failure(self, data):
+        logging.info(f"MQTT5 connection attempt failed: {data.exception}")
+        if not self._connected.done():
+            self._connected.set_exception(data.exception)
+
+    def _on_disconnection(self, data):
+        logging.info(f"MQTT5 connection interrupted: {data.exception}")
+        self._up.clear()
+        with self._lock:
+            self.interruptions += 1
+
+    def _on_stopped(self, data):
+        if not self._stopped.done():
+            self._stopped.set_result(None)
+
+    def connect(self):
+        logging.info("Connecting to {} with MQTT5 client ID '{}'...".format(self.endpoint, self.client_id))
+        self.client.start()
+        settings = self._connected.result()
+        logging.info(f"MQTT5 connected, receive maximum from server {settings.receive_maximum_from_server}, "
+                     f"maximum packet size {settings.maximum_packet_size_to_server}")
+        self.started = time.monotonic()
+
+    def is_connected(self):
+        return self._up.is_set()
+
+    def wait_connected(self, timeout):
+        # Wait until the client is connected again, returns False if it is still down after `timeout` seconds
+        return self._up.wait(timeout)
+
+    def health(self):
+        with self._lock:
+            return {'interruptions': self.interruptions, 'resumptions': self.resumptions}
+
+    def max_in_flight(self):
+        # Number of unacknowledged QoS 1 publishes the broker accepts on this connection
+        if self.negotiated_settings is None:
+            return None
+        return self.negotiated_settings.receive_maximum_from_server
+
+    def publish(self, topic, payload, qos, retain=False, nr_of_records=None, framed=False):
+        # Same return value as awscrt.mqtt.Connection.publish: (future, packet_id)
+        with self._lock:
+            self.in_flight_count += 1
+        size = len(payload)
+        try:
+            future = self.client.publish(mqtt5.PublishPacket(
+                payload=payload,
+                qos=mqtt5.QoS(int(qos)),
+                retain=retain,
+                topic=topic,
+                payload_format_indicator=mqtt5.PayloadFormatIndicator.AWS_MQTT5_PFI_BYTES if framed
+                else mqtt5.PayloadFormatIndicator.AWS_MQTT5_PFI_UTF8,
+                content_type="application/octet-stream" if framed else "application/json",
+            ))
+        except Exception:
+            with self._lock:
+                self.in_flight_count -= 1
+            raise
+
+        def on_done(f):
+            with self._lock:
+                self.in_flight_count -= 1
+                if f.exception() is None:
+                    self.published += 1
+                    self.published_bytes += size
+                    self.published_records += nr_of_records or 0
+                else:
+                    self.failed += 1
+
+        future.add_done_callback(on_done)
+        return future, None
+
+    def in_flight(self):
+        return self.in_flight_count
+
+    def stats(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        with self._lock:
+            return [{
+                'client_id': self.client_id,
+                'published': self.published,
+                'failed': self.failed,
+                'in_flight': self.in_flight_count,
+                'publishes_per_sec': round(self.published / elapsed, 1),
+                'records_per_sec': round(self.published_records / elapsed, 1),
+                'bytes_per_sec': round(self.published_bytes / elapsed, 1),
+            }]
+
+    def log_stats(self):
+        for entry in self.stats():
+            logging.info(f"MQTT5 client {entry['client_id']}: {entry['published']} published, {entry['failed']} failed, "
+                         f"{entry['in_flight']} in flight, {entry['publishes_per_sec']} publishes/s, "
+                         f"{entry['records_per_sec']} records/s, {entry['bytes_per_sec']} bytes/s")
+
+    def disconnect(self, timeout=None):
+        # Returns False if the client did not stop within `timeout` seconds
+        self.client.stop(mqtt5.DisconnectPacket())
+        try:
+            self._stopped.result(timeout)
+        except concurrent.futures.TimeoutError:
+            logging.info(f"Disconnect did not finish within {timeout}s")
+            return False
+        return True
@@ -0,0 +1,198 @@
+# Pool of MQTT connections for the IOT producer Lambda.
+#
+# All connections share one client bootstrap whose event loop group can run several threads, so a
+# single invocation is no longer limited to one TCP/TLS stream and one event loop thread.
+# Batches are spread over the connections round-robin or to the connection with the fewest
+# unacknowledged publishes.
+#
+# The pool tracks interruptions and resumptions of its connections (the CRT reconnects interrupted
+# connections by itself), so a ConnectionManager can tell whether it can be reused by the next invocation.
+
+import concurrent.futures
+import logging
+import threading
+import time
+from awscrt import io
+from awsiot import mqtt_connection_builder
+
+ROUND_ROBIN = "round_robin"
+LEAST_IN_FLIGHT = "least_in_flight"
+STRATEGIES = (ROUND_ROBIN, LEAST_IN_FLIGHT)
+
+
+class PooledConnection:
+    # One MQTT connection of the pool with its publish statistics
+
+    def __init__(self, client_id, mqtt_connection):
+        self.client_id = client_id
+        self.mqtt_connection = mqtt_connection
+        self.in_flight = 0
+        self.published = 0
+        self.published_bytes = 0
+        self.published_records = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.interruptions = 0
+        self.resumptions = 0
+        # Set while the connection is up, cleared while the CRT reconnects it
+        self.connected = threading.Event()
+
+
+class MqttConnectionPool:
+
+    def __init__(self, endpoint, cert_filepath, pri_key_filepath, ca_filepath, client_id,
+                 nr_of_connections=1, event_loop_threads=1, strategy=ROUND_ROBIN):
+        if nr_of_connections < 1:
+            raise ValueError("nr_of_connections must be at least 1")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown publish strategy {strategy}, use one of {STRATEGIES}")
+
+        self.endpoint = endpoint
+        self.strategy = strategy
+        self._lock = threading.Lock()
+        self._next = 0
+
+        # Spin up resources shared by all connections
+        self.event_loop_group = io.EventLoopGroup(event_loop_threads)
+        host_resolver = io.DefaultHostResolver(self.event_loop_group)
+        self.client_bootstrap = io.ClientBootstrap(self.event_loop_group, host_resolver)
+
+        self.connections = []
+        for i in range(nr_of_connections):
+            # Every connection needs its own client ID, otherwise IOT Core drops the older session
+            connection_client_id = client_id if nr_of_connections == 1 else f"{client_id}-{i}"
+            connection = PooledConnection(connection_client_id, None)
+            connection.mqtt_connection = mqtt_connection_builder.mtls_from_path(
+                endpoint=endpoint,
+                cert_filepath=cert_filepath,
+                pri_key_filepath=pri_key_filepath,
+                client_bootstrap=self.client_bootstrap,
+                ca_filepath=ca_filepath,
+                client_id=connection_client_id,
+                clean_session=False,
+                keep_alive_secs=6,
+                on_connection_interrupted=self._on_interrupted(connection),
+                on_connection_resumed=self._on_resumed(connection)
+            )
+            self.connections.append(connection)
+
+        logging.info(f"MQTT connection pool with {nr_of_connections} connection(s), "
+                     f"{event_loop_threads} event loop thread(s), strategy {strategy}")
+
+    def _on_interrupted(self, connection):
+        def callback(mqtt_connection, error, **kwargs):
+            logging.info(f"Connection {connection.client_id} interrupted: {error}")
+            connection.connected.clear()
+            with self._lock:
+                connection.interruptions += 1
+        return callback
+
+    def _on_resumed(self, connection):
+        def callback(mqtt_connection, return_code, session_present, **kwargs):
+            logging.info(f"Connection {connection.client_id} resumed: {return_code}, session present {session_present}")
+            with self._lock:
+                connection.resumptions += 1
+            connection.connected.set()
+        return callback
+
+    def connect(self):
+        # Connect all connections in parallel and wait until every one is established
+        logging.info("Connecting to {} with client IDs {}...".format(
+            self.endpoint, [connection.client_id for connection in self.connections]))
+        futures = [connection.mqtt_connection.connect() for connection in self.connections]
+        for future in futures:
+            logging.info(future.result())
+        now = time.monotonic()
+        for connection in self.connections:
+            connection.started = now
+            connection.connected.set()
+
+    def is_connected(self):
+        return all(connection.connected.is_set() for connection in self.connections)
+
+    def wait_connected(self, timeout):
+        # Wait until every connection is up again, returns False if one is still down after `timeout` seconds
+        deadline = time.monotonic() + timeout
+        for connection in self.connections:
+            if not connection.connected.wait(max(deadline - time.monotonic(), 0)):
+                return False
+        return True
+
+    def health(self):
+        # Interruptions and resumptions of all connections since connect()
+        with self._lock:
+            return {
+                'interruptions': sum(connection.interruptions for connection in self.connections),
+                'resumptions': sum(connection.resumptions for connection in self.connections),
+            }
+
+    def _select(self):
+        with self._lock:
+            if self.strategy == LEAST_IN_FLIGHT:
+                connection = min(self.connections, key=lambda c: c.in_flight)
+            else:
+                connection = self.connections[self._next]
+                self._next = (self._next + 1) % len(self.connections)
+            connection.in_flight += 1
+        return connection
+
+    def publish(self, topic, payload, qos, retain=False, nr_of_records=None, framed=False):
+        # Same return value as awscrt.mqtt.Connection.publish. nr_of_records only feeds the statistics,
+        # framed is accepted for interface compatibility with Mqtt5Publisher (MQTT 3.1.1 has no payload properties).
+        connection = self._select()
+        size = len(payload)
+
+        def on_done(future):
+            with self._lock:
+                connection.in_flight -= 1
+                if future.exception() is None:
+                    connection.published += 1
+                    connection.published_bytes += size
+                    connection.published_records += nr_of_records or 0
+                else:
+                    connection.failed += 1
+
+        future, packet_id = connection.mqtt_connection.publish(topic=topic, payload=payload, qos=qos, retain=retain)
+        future.add_done_callback(on_done)
+        return future, packet_id
+
+    def in_flight(self):
+        return sum(connection.in_flight for connection in self.connections)
+
+    def stats(self):
+        # Per connection publish counts and rates since connect()
+        now = time.monotonic()
+        with self._lock:
+            result = []
+            for connection in self.connections:
+                elapsed = max(now - connection.started, 1e-9)
+                result.append({
+                    'client_id': connection.client_id,
+                    'published': connection.published,
+                    'failed': connection.failed,
+                    'in_flight': connection.in_flight,
+                    'publishes_per_sec': round(connection.published / elapsed, 1),
+                    'records_per_sec': round(connection.published_records / elapsed, 1),
+                    'bytes_per_sec': round(connection.published_bytes / elapsed, 1),
+                })
+        return result
+
+    def log_stats(self):
+        for entry in self.stats():
+            logging.info(f"Connection {entry['client_id']}: {entry['published']} published, {entry['failed']} failed, "
+                         f"{entry['in_flight']} in flight, {entry['publishes_per_sec']} publishes/s, "
+                         f"{entry['records_per_sec']} records/s, {entry['bytes_per_sec']} bytes/s")
+
+    def disconnect(self, timeout=None):
+        # Disconnect all connections and wait for them to finish, at most `timeout` seconds in total.
+        # Returns False if a connection did not finish disconnecting in time.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        futures = [connection.mqtt_connection.disconnect() for connection in self.connections]
+        for future in futures:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                future.result(remaining)
+            except concurrent.futures.TimeoutError:
+                logging.info(f"Disconnect did not finish within {timeout}s")
+                return False
+        return True
@@ -0,0 +1,111 @@
+# Byte budget packing of encoded records into MQTT payloads.
+#
+# Records vary in size because optional fields are dropped at random, so a fixed record count either
+# wastes the IOT Core message size limit or exceeds it. The packer appends encoded records to a JSON
+# array (or concatenates BSON documents) until the next record would not fit into the byte budget and
+# then emits the payload.
+
+import logging
+
+from agri_common import framing
+
+# IOT Core rejects MQTT messages with a payload larger than 128 KB
+IOT_CORE_MAX_PAYLOAD_BYTES = 128 * 1024
+
+
+def payload_budget(max_bytes, framed):
+    # Byte budget of the packed body: a framed payload also carries the framing header. 0 stays 0 (no packing).
+    if max_bytes and framed:
+        return max_bytes - framing.HEADER.size
+    return max_bytes
+
+
+class PackingStats:
+    # How full the emitted payloads were compared to the byte budget
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.payloads = 0
+        self.packed_records = 0
+        self.packed_bytes = 0
+        self.min_fill = None
+
+    def record_payload(self, nr_of_records, payload_bytes):
+        fill = payload_bytes / self.max_bytes
+        self.payloads += 1
+        self.packed_records += nr_of_records
+        self.packed_bytes += payload_bytes
+        self.min_fill = fill if self.min_fill is None else min(self.min_fill, fill)
+        logging.info(f"Payload packed: {nr_of_records} records, {payload_bytes} bytes, {fill:.1%} of the {self.max_bytes} byte budget")
+
+    def summary(self):
+        if not self.payloads:
+            return {'payloads': 0}
+        return {
+            'payloads': self.payloads,
+            'records_per_payload': round(self.packed_records / self.payloads, 1),
+            'bytes_per_payload': round(self.packed_bytes / self.payloads),
+            'avg_fill': round(self.packed_bytes / self.payloads / self.max_bytes, 4),
+            'min_fill': round(self.min_fill, 4),
+        }
+
+
+class PayloadPacker(PackingStats):
+    # The defaults pack a JSON array with json.dumps' default separator, BSON documents are concatenated
+    # without opening, separator and closing bytes
+
+    def __init__(self, max_bytes=IOT_CORE_MAX_PAYLOAD_BYTES, opening=b'[', separator=b', ', closing=b']'):
+        if max_bytes < len(opening) + len(closing) + 1:
+            raise ValueError("max_bytes must leave room for at least one record")
+        super().__init__(max_bytes)
+        self.opening = opening
+        self.separator = separator
+        self.closing = closing
+        self.buffer = bytearray(opening)
+        self.records = 0
+
+    def add(self, record):
+        # Append one encoded record. Returns (payload, nr_of_records) if the record did not fit into the
+        # current payload anymore, in which case the full payload was emitted and the record starts a new one.
+        flushed = None
+        if self.records and len(self.buffer) + len(self.separator) + len(record) + len(self.closing) > self.max_bytes:
+            flushed = self.flush()
+        if self.records:
+            self.buffer += self.separator
+        self.buffer += record
+        self.records += 1
+        return flushed
+
+    def flush(self):
+        # Emit the current payload as (payload, nr_of_records), or None if it is empty
+        if not self.records:
+            return None
+        self.buffer += self.closing
+        payload = bytes(self.buffer)
+        records = self.records
+        del self.buffer[len(self.opening):]
+        self.records = 0
+        self.record_payload(records, len(payload))
+        return payload, records
+
+
+class ColumnarBatchSizer(PackingStats):
+    # Columnar payloads are encoded a whole batch at a time, so the byte budget is met by choosing the
+    # batch size: the next batch gets as many records as fit at the bytes/record seen so far.
+
+    def __init__(self, max_bytes=IOT_CORE_MAX_PAYLOAD_BYTES, initial_size=200, headroom=0.95):
+        super().__init__(max_bytes)
+        self.headroom = headroom
+        self.size = initial_size
+        self.bytes_per_record = None
+
+    def next_size(self):
+        return self.size
+
+    def observe(self, nr_of_records, payload_bytes):
+        # Record an encoded payload and adjust the next batch size
+        self.record_payload(nr_of_records, payload_bytes)
+        if nr_of_records:
+            observed = payload_bytes / nr_of_records
+            self.bytes_per_record = observed if self.bytes_per_record is None else 0.8 * self.bytes_per_record + 0.2 * observed
+            self.size = max(1, int(self.max_bytes * self.headroom / self.bytes_per_record))
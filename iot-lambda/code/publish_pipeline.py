@@ -0,0 +1,113 @@
+# Windowed asynchronous publishing for the IOT producer Lambda.
+#
+# mqtt_connection.publish() returns immediately with a future, so the next batch can be generated
+# while earlier ones are still being sent. The pipeline bounds the number of unfinished publishes:
+# submit() blocks while the window is full, which paces the producer by broker feedback.
+# With QoS 1 a future completes on PUBACK, so the recorded latency is the publish-to-ack time.
+# With a metrics object the latencies and failures are also recorded as EMF metrics.
+
+import logging
+import threading
+import time
+from awscrt import mqtt
+
+
+class PublishPipeline:
+
+    def __init__(self, mqtt_connection, topic, qos=mqtt.QoS.AT_MOST_ONCE, window=16, metrics=None):
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        self.mqtt_connection = mqtt_connection
+        self.topic = topic
+        self.qos = qos
+        self.window = window
+        self.metrics = metrics
+        self._slots = threading.BoundedSemaphore(window)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.latencies = []           # seconds from publish() until the future completed
+        self.backpressure_time = 0.0  # seconds submit() waited for a free slot
+
+    def submit(self, payload, **publish_options):
+        # Publish a payload, waiting for a free slot in the window first.
+        # publish_options (nr_of_records, framed) are passed on to the connection's publish().
+        if not self._slots.acquire(blocking=False):
+            waiting_since = time.perf_counter()
+            self._slots.acquire()
+            waited = time.perf_counter() - waiting_since
+            self.backpressure_time += waited
+            if self.metrics:
+                self.metrics.observe('PublishWindowWait', waited * 1000)
+
+        with self._lock:
+            self.in_flight += 1
+            self.submitted += 1
+        started = time.perf_counter()
+        try:
+            future, _ = self.mqtt_connection.publish(topic=self.topic, payload=payload, qos=self.qos, **publish_options)
+        except Exception as e:
+            logging.info("Error occurred while publishing the message:" + str(e))
+            self._finish(started, failed=True)
+            return
+        future.add_done_callback(lambda f: self._finish(started, failed=f.exception() is not None))
+
+    def _finish(self, started, failed):
+        latency = time.perf_counter() - started
+        with self._lock:
+            self.in_flight -= 1
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+                self.latencies.append(latency)
+        if self.metrics:
+            if failed:
+                self.metrics.count('PublishFailures')
+            else:
+                self.metrics.observe('PublishLatency', latency * 1000)
+        self._slots.release()
+
+    def drain(self, timeout=None):
+        # Wait until every submitted publish has completed, returns False if the timeout expired first
+        deadline = None if timeout is None else time.monotonic() + timeout
+        acquired = 0
+        try:
+            while acquired < self.window:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                if not self._slots.acquire(timeout=remaining):
+                    return False
+                acquired += 1
+            return True
+        finally:
+            for _ in range(acquired):
+                self._slots.release()
+
+    def latency_summary(self):
+        # Distribution of publish latencies in milliseconds
+        with self._lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return {'count': 0}
+
+        def percentile(p):
+            return round(latencies[min(int(p / 100 * len(latencies)), len(latencies) - 1)] * 1000, 2)
+
+        return {
+            'count': len(latencies),
+            'min_ms': round(latencies[0] * 1000, 2),
+            'p50_ms': percentile(50),
+            'p90_ms': percentile(90),
+            'p99_ms': percentile(99),
+            'max_ms': round(latencies[-1] * 1000, 2),
+            'avg_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        }
+
+    def log_summary(self):
+        ack = "PUBACK" if self.qos == mqtt.QoS.AT_LEAST_ONCE else "send"
+        logging.info(f"Publish pipeline (window {self.window}, QoS {self.qos.value}): {self.submitted} submitted, "
+                     f"{self.completed} completed, {self.failed} failed, {self.in_flight} in flight, "
+                     f"{round(self.backpressure_time, 3)}s waited for the window")
+        logging.info(f"Publish {ack} latency: {self.latency_summary()}")
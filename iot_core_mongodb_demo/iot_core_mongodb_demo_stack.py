@@ -1,5 +1,5 @@
 
-from aws_cdk import aws_lambda, aws_iam, Duration, Stack, aws_iot , aws_kinesis,  aws_lambda_event_sources, aws_secretsmanager, SecretValue
+from aws_cdk import aws_lambda, aws_iam, Duration, Stack, aws_iot , aws_kinesis,  aws_lambda_event_sources, aws_secretsmanager, aws_sqs, SecretValue
 from aws_cdk.aws_lambda import Runtime
 from aws_cdk.aws_events import Rule, Schedule
 from aws_cdk.aws_events_targets import LambdaFunction, SfnStateMachine
@@ -25,6 +25,11 @@ class IotCoreMongodbDemoStack(Stack):
         ########################################################################################  
         
         IOT_TOPIC = "topic"                           # The topic that the IOT Producer Lambda will publish to
+        IOT_RULE_NAME = "AgriIoTRule"                 # The IOT rule forwarding the telemetry to Kinesis
+        IOT_BASIC_INGEST = False                      # Publish with Basic Ingest to $aws/rules/<IOT_RULE_NAME>/<IOT_TOPIC>: the messages go straight
+                                                      # to the rule without the message broker (lower latency, no messaging charges). Nothing
+                                                      # subscribes to the telemetry, so the broker only adds a hop. The IOT policy only allows
+                                                      # publishing to the topic of the selected path.
         PRIVATE_KEY_PATH = "./certificates/private_key.key" # Path to the private key file (can be created using the 00-create-certificates.sh script)
         CERTIFICATE_SIGNING_REQUEST_PATH = "./certificates/signing_request.csr" # Path to the certificate signing request file (can be created using the 00-create-certificates.sh script)
         
@@ -39,11 +44,67 @@ class IotCoreMongodbDemoStack(Stack):
 
 
         
+        METRICS_NAMESPACE = "AgriIoTDemo"              # CloudWatch namespace of the EMF metrics written by all Lambda functions
+        METRICS_FLUSH_INTERVAL = 60                    # Seconds between EMF metric flushes of the long running Lambda functions
+        RUN_SAFETY_MARGIN = 10                         # Seconds before their timeout the IOT Producer, MongoDB Query and Noisy Neighbour Lambdas stop
+                                                       # issuing work, to drain in-flight publishes, disconnect and log a final summary
+
+        DATA_GENERATOR = "random"                      # Telemetry of the IOT Producer and Load Generator Lambdas: "random" (independent random readings),
+                                                       # "fleet" (stateful fleet simulator with per-vehicle time series) or "replay" (pre-generated
+                                                       # seeded corpus, build it with "python3 tools/build_corpus.py" before deploying)
+        FLEET_SIZE = 50000                             # Number of simulated vehicles, vehicle ids run from 1 to FLEET_SIZE
+
+        TS_FORMAT = "iso"                              # Representation of the ts field: "iso" (isoformat strings, compared as strings) or "epoch_ms"
+                                                       # (epoch milliseconds in the payloads, stored as BSON datetime and queried with datetime
+                                                       # ranges). Convert existing data with "python3 tools/migrate_ts.py" when switching.
+        ID_FORMAT = "uuid"                             # Document _id of the IOT Producer and Load Generator Lambdas: "uuid" (uuid4 string with the request id,
+                                                       # ~73 characters) or "objectid" (time ordered 12 byte ObjectIds, inserts append to the _id index)
+
+        GENERATION_WORKERS = 0                         # Number of worker processes generating and serializing data in the IOT Producer and
+                                                       # Load Generator Lambdas, 0 generates in the handler's process. Only pays off with
+                                                       # several vCPUs, raise the functions' memory_size accordingly (1769 MB per vCPU).
+
+        IOT_PRODUCER_BOOTSTRAP_CACHE_TTL = 3600        # Seconds the IOT Producer Lambda caches endpoint, certificate and private key in /tmp across sandbox re-inits (0 disables)
+        IOT_PRODUCER_MQTT_VERSION = "3.1.1"            # MQTT version of the IOT Producer Lambda: "3.1.1" or "5" (payload properties, receive maximum flow control)
+        IOT_PRODUCER_MQTT_REUSE_CONNECTION = True      # Keep the MQTT connection of the IOT Producer Lambda open across warm invocations
+        IOT_PRODUCER_MQTT_MAX_IDLE = 40                # Seconds a kept connection may sit idle before it is replaced (IOT Core drops it after 1.5 x 30s keep alive)
+        IOT_PRODUCER_MQTT_CONNECTIONS = 1              # Number of parallel MQTT 3.1.1 connections of the IOT Producer Lambda
+        IOT_PRODUCER_EVENT_LOOP_THREADS = 1            # Number of event loop threads shared by these connections. Raise together with the memory size (vCPUs).
+        IOT_PRODUCER_PUBLISH_STRATEGY = "round_robin"  # How batches are spread over the connections: "round_robin" or "least_in_flight"
+        IOT_PRODUCER_PUBLISH_WINDOW = 16               # Maximum number of unfinished publishes before the IOT Producer Lambda waits
+        IOT_PRODUCER_PUBLISH_QOS = 0                   # MQTT QoS of the IOT Producer Lambda. Use 1 to measure the PUBACK latency of every publish.
+        IOT_PRODUCER_TARGET_RECORDS_PER_SEC = 0        # Target rate of the IOT Producer Lambda in records/sec, 0 means as fast as possible.
+        IOT_PRODUCER_TARGET_PAYLOADS_PER_SEC = 0       # Target rate in MQTT payloads/sec, 0 means unlimited. Both can be overridden per invocation with
+                                                       # the event fields "target_records_per_sec" and "target_payloads_per_sec".
+        IOT_PRODUCER_PAYLOAD_MAX_BYTES = 128 * 1024    # Byte budget of one MQTT payload (IOT Core limit is 128 KB). 0 sends every generated batch as one payload.
+                                                       # With compression the budget applies to the uncompressed payload and can be raised accordingly.
+        IOT_PRODUCER_PAYLOAD_FORMAT = "rows"           # Payload format of the IOT Producer Lambda: "rows" (JSON array of documents), "columns" (columnar batch)
+                                                       # or "bson" (concatenated BSON documents, inserted by the Kinesis Reader without decoding)
+        IOT_PRODUCER_COMPRESSION = "none"              # Payload compression of the IOT Producer Lambda: "none", "zlib" or "zstd" (falls back to zlib if zstandard is not in the layer)
+
         KINESIS_READER_BATCH_SIZE = 50                 # Adjust the batch size of the Kinsesis Reader Lambda Function. 
                                                        # This value is used to determine how many records are read from the Kinesis Stream at once.
+        KINESIS_READER_INSERT_MAX_DOCUMENTS = 5000     # The Kinesis Reader accumulates the documents of all records of a batch and flushes
+        KINESIS_READER_INSERT_MAX_BYTES = 8192 * 1024  # an insert_many round-trip at this document count or BSON size in bytes
+                                                       # (capped at the server's maxWriteBatchSize and maxMessageSizeBytes)
+        KINESIS_READER_INSERT_CONCURRENCY = 4          # Number of insert_many round-trips the Kinesis Reader keeps in flight at the same time
+        KINESIS_READER_RETRY_ATTEMPTS = 10             # Retries of a batch with records the Kinesis Reader could not write (transient errors, the
+        KINESIS_READER_MAX_RECORD_AGE_HOURS = 6        # reader skips poison records) and the maximum record age. Records that exhaust either are
+                                                       # not retried anymore, their shard positions go to the AgriKinesisReaderFailures queue
         
         MONGODB_DB = "agridb"                          # # The name of the MongoDB database
         MONGODB_COL = "agricol"                        # # The name of the MongoDB collection
+        MONGODB_TIMESERIES = False                     # Write the telemetry into the time series collection MONGODB_TIMESERIES_COL (timeField ts,
+                                                       # metaField vehicleid) instead of MONGODB_COL, and query it there. The Kinesis Reader and
+                                                       # the Load Generator create it at cold start.
+        MONGODB_TIMESERIES_COL = "agricol_ts"          # # The name of the MongoDB time series collection
+        MONGODB_TIMESERIES_GRANULARITY = "seconds"     # Bucket granularity: "seconds", "minutes" or "hours" (an existing collection's can only be raised)
+
+        # Collection the telemetry is written to and queried from
+        TELEMETRY_COL = MONGODB_TIMESERIES_COL if MONGODB_TIMESERIES else MONGODB_COL
+        if MONGODB_TIMESERIES and IOT_PRODUCER_PAYLOAD_FORMAT == "bson" and TS_FORMAT != "epoch_ms":
+            # BSON payloads are inserted as they are, iso string timestamps cannot be the timeField
+            raise ValueError('MONGODB_TIMESERIES with IOT_PRODUCER_PAYLOAD_FORMAT = "bson" needs TS_FORMAT = "epoch_ms"')
 
         # Retrieve MongoDB host from environment variable
         MONGODB_HOST = os.getenv("MONGODB_HOST")
@@ -112,7 +173,8 @@ class IotCoreMongodbDemoStack(Stack):
         ########################################################################################  
         ########################################################################################  
 
-        # Define the AWS IoT topic rule
+        # Define the AWS IoT topic rule. With Basic Ingest the producer publishes to $aws/rules/AgriIoTRule/topic,
+        # the rule sees the topic without the $aws/rules/AgriIoTRule prefix, so the same SQL serves both paths.
         iot_topic_rule = aws_iot.CfnTopicRule(self, "AgriIoTTopicRule",
             topic_rule_payload=aws_iot.CfnTopicRule.TopicRulePayloadProperty(
                 sql=f"SELECT * FROM '{IOT_TOPIC}'",  # adjust according to your needs
@@ -124,10 +186,14 @@ class IotCoreMongodbDemoStack(Stack):
                     )
                 )]
             ),
-            rule_name="AgriIoTRule",
+            rule_name=IOT_RULE_NAME,
         )
 
-        # Define an access management policy for the IOT topic
+        # Define an access management policy for the IOT topic: connect, and publish on the path the producer uses
+        if IOT_BASIC_INGEST:
+            iot_publish_resource = f"arn:aws:iot:{self.region}:{self.account}:topic/$aws/rules/{IOT_RULE_NAME}/*"
+        else:
+            iot_publish_resource = f"arn:aws:iot:{self.region}:{self.account}:topic/{IOT_TOPIC}"
         aws_iot_policy = aws_iot.CfnPolicy(
             self, 
             "AgriIoTPolicy",
@@ -136,8 +202,12 @@ class IotCoreMongodbDemoStack(Stack):
                 "Version": "2012-10-17",
                 "Statement": [{
                     "Effect": "Allow",
-                    "Action": "iot:*",
-                    "Resource": "*"
+                    "Action": "iot:Connect",
+                    "Resource": f"arn:aws:iot:{self.region}:{self.account}:client/*"
+                }, {
+                    "Effect": "Allow",
+                    "Action": "iot:Publish",
+                    "Resource": iot_publish_resource
                 }]
             }
         )
@@ -162,6 +232,20 @@ class IotCoreMongodbDemoStack(Stack):
             principal=aws_iot_cert.attr_arn
         )
 
+        ########################################################################################  
+        ########################################################################################  
+        # Common Lambda Layer
+        ########################################################################################  
+        ########################################################################################  
+
+        # Create a Lambda Layer holding the shared agri_common package (telemetry generation etc.)
+        lambda_layer_common = aws_lambda.LayerVersion(self, "AgriCommonLambdaLayer",
+            code=aws_lambda.Code.from_asset("common-layer"),
+            compatible_runtimes=[aws_lambda.Runtime.PYTHON_3_9],  # or any python version you want
+            license="Apache-2.0",
+            description="A layer to hold the agri_common package shared by the Agri Lambda functions",
+        )
+
         ########################################################################################  
         ########################################################################################  
         # IOT Core Producer Lambda
@@ -186,11 +270,35 @@ class IotCoreMongodbDemoStack(Stack):
             timeout=Duration.seconds(120),
             memory_size=128,
             description='Lambda function for agricultural IOT data insertion',
-            layers = [lambda_layer_iot],
+            layers = [lambda_layer_iot, lambda_layer_common],
             environment={
                 'IOT_TOPIC' : IOT_TOPIC,
+                'IOT_RULE_NAME' : IOT_RULE_NAME,
+                'IOT_BASIC_INGEST' : str(IOT_BASIC_INGEST).lower(),
                 'PRIVATE_KEY_SECRET_ARN' : private_key_secret.secret_arn,
                 'CERTIFICATE_ID' : aws_iot_cert.attr_id,
+                'BOOTSTRAP_CACHE_TTL' : str(IOT_PRODUCER_BOOTSTRAP_CACHE_TTL),
+                'MQTT_VERSION' : IOT_PRODUCER_MQTT_VERSION,
+                'MQTT_REUSE_CONNECTION' : str(IOT_PRODUCER_MQTT_REUSE_CONNECTION).lower(),
+                'MQTT_MAX_IDLE' : str(IOT_PRODUCER_MQTT_MAX_IDLE),
+                'MQTT_CONNECTIONS' : str(IOT_PRODUCER_MQTT_CONNECTIONS),
+                'EVENT_LOOP_THREADS' : str(IOT_PRODUCER_EVENT_LOOP_THREADS),
+                'PUBLISH_STRATEGY' : IOT_PRODUCER_PUBLISH_STRATEGY,
+                'PUBLISH_WINDOW' : str(IOT_PRODUCER_PUBLISH_WINDOW),
+                'PUBLISH_QOS' : str(IOT_PRODUCER_PUBLISH_QOS),
+                'TARGET_RECORDS_PER_SEC' : str(IOT_PRODUCER_TARGET_RECORDS_PER_SEC),
+                'TARGET_PAYLOADS_PER_SEC' : str(IOT_PRODUCER_TARGET_PAYLOADS_PER_SEC),
+                'PAYLOAD_MAX_BYTES' : str(IOT_PRODUCER_PAYLOAD_MAX_BYTES),
+                'PAYLOAD_FORMAT' : IOT_PRODUCER_PAYLOAD_FORMAT,
+                'COMPRESSION' : IOT_PRODUCER_COMPRESSION,
+                'DATA_GENERATOR' : DATA_GENERATOR,
+                'TS_FORMAT' : TS_FORMAT,
+                'ID_FORMAT' : ID_FORMAT,
+                'FLEET_SIZE' : str(FLEET_SIZE),
+                'GENERATION_WORKERS' : str(GENERATION_WORKERS),
+                'METRICS_NAMESPACE' : METRICS_NAMESPACE,
+                'METRICS_FLUSH_INTERVAL' : str(METRICS_FLUSH_INTERVAL),
+                'RUN_SAFETY_MARGIN' : str(RUN_SAFETY_MARGIN),
             }
         )
 
@@ -247,13 +355,19 @@ class IotCoreMongodbDemoStack(Stack):
             timeout=Duration.seconds(900),
             memory_size=256,
             description='Lambda function for reading from Kinesis and inserting into MongoDB.',
-            layers = [lambda_layer_kinesis_reader],
+            layers = [lambda_layer_kinesis_reader, lambda_layer_common],
             environment={
                 'MONGODB_HOST': MONGODB_HOST,
                 'MONGODB_USER': MONGODB_USER,
                 'MONGODB_SECRET_ARN': mongodb_secret.secret_arn,
                 'MONGODB_DB': MONGODB_DB,
-                'MONGODB_COLLECTION': MONGODB_COL,
+                'MONGODB_COLLECTION': TELEMETRY_COL,
+                'MONGODB_TIMESERIES': str(MONGODB_TIMESERIES).lower(),
+                'MONGODB_TIMESERIES_GRANULARITY': MONGODB_TIMESERIES_GRANULARITY,
+                'METRICS_NAMESPACE': METRICS_NAMESPACE,
+                'INSERT_BATCH_MAX_DOCUMENTS': str(KINESIS_READER_INSERT_MAX_DOCUMENTS),
+                'INSERT_BATCH_MAX_BYTES': str(KINESIS_READER_INSERT_MAX_BYTES),
+                'INSERT_CONCURRENCY': str(KINESIS_READER_INSERT_CONCURRENCY),
             }
         )
         # Define the IAM role for the Lambda function
@@ -265,9 +379,24 @@ class IotCoreMongodbDemoStack(Stack):
 
         # Add the event source 
         if KINESIS_READER_ACTIVE:
+            # Shard, sequence number range and error of the batches that were given up, to re-read them from the stream
+            kinesis_reader_failures = aws_sqs.Queue(self, "AgriKinesisReaderFailures",
+                retention_period=Duration.days(14),
+            )
             lambda_function_kinesis_reader.add_event_source(aws_lambda_event_sources.KinesisEventSource(kinesis_stream, 
                 starting_position=aws_lambda.StartingPosition.TRIM_HORIZON,
-                batch_size=KINESIS_READER_BATCH_SIZE # Adjust batch size according to your needs
+                batch_size=KINESIS_READER_BATCH_SIZE, # Adjust batch size according to your needs
+                # The reader returns the records it could not write, Lambda retries from the first of them
+                # instead of the whole batch. Replayed documents count as written in a regular collection, their
+                # _ids exist already. A time series collection (MONGODB_TIMESERIES) has no unique _id index, there
+                # the documents of a replayed record are stored a second time.
+                report_batch_item_failures=True,
+                # Split a batch whose invocation fails, to isolate a record that keeps failing
+                bisect_batch_on_error=True,
+                # Bound the retries, so a failure that does not go away cannot block the shard for the stream's retention
+                retry_attempts=KINESIS_READER_RETRY_ATTEMPTS,
+                max_record_age=Duration.hours(KINESIS_READER_MAX_RECORD_AGE_HOURS),
+                on_failure=aws_lambda_event_sources.SqsDlq(kinesis_reader_failures),
             ))
 
 
@@ -295,14 +424,19 @@ class IotCoreMongodbDemoStack(Stack):
             timeout=Duration.seconds(300),
             memory_size=128,
             description='Lambda function for querieng agricultural IOT data from MongoDB',
-            layers = [lambda_layer_mongodb_query],
+            layers = [lambda_layer_mongodb_query, lambda_layer_common],
             environment={
                 'MONGODB_HOST': MONGODB_HOST,
                 'MONGODB_USER': MONGODB_USER,
                 'MONGODB_SECRET_ARN': mongodb_secret.secret_arn,
                 'MONGODB_DB': MONGODB_DB,
-                'MONGODB_COLLECTION': MONGODB_COL,
-                'VEHICLE_ID' : "1"
+                'MONGODB_COLLECTION': TELEMETRY_COL,
+                'MONGODB_TIMESERIES': str(MONGODB_TIMESERIES).lower(),
+                'TS_FORMAT': TS_FORMAT,
+                'VEHICLE_ID' : "1",
+                'METRICS_NAMESPACE': METRICS_NAMESPACE,
+                'METRICS_FLUSH_INTERVAL': str(METRICS_FLUSH_INTERVAL),
+                'RUN_SAFETY_MARGIN': str(RUN_SAFETY_MARGIN)
             }
         )
         # Define the IAM role for the Lambda function
@@ -344,14 +478,19 @@ class IotCoreMongodbDemoStack(Stack):
             timeout=Duration.seconds(300),
             memory_size=256,
             description='Lambda function for querieng agricultural IOT data from MongoDB',
-            layers = [lambda_layer_mongodb_noisy_neighbour],
+            layers = [lambda_layer_mongodb_noisy_neighbour, lambda_layer_common],
             environment={
                 'MONGODB_HOST': MONGODB_HOST,
                 'MONGODB_USER': MONGODB_USER,
                 'MONGODB_SECRET_ARN': mongodb_secret.secret_arn,
                 'MONGODB_DB': MONGODB_DB,
-                'MONGODB_COLLECTION': MONGODB_COL,
-                'VEHICLE_ID' : "1"
+                'MONGODB_COLLECTION': TELEMETRY_COL,
+                'MONGODB_TIMESERIES': str(MONGODB_TIMESERIES).lower(),
+                'TS_FORMAT': TS_FORMAT,
+                'VEHICLE_ID' : "1",
+                'METRICS_NAMESPACE': METRICS_NAMESPACE,
+                'METRICS_FLUSH_INTERVAL': str(METRICS_FLUSH_INTERVAL),
+                'RUN_SAFETY_MARGIN': str(RUN_SAFETY_MARGIN)
             }
         )
         # Define the IAM role for the Lambda function
@@ -395,13 +534,22 @@ class IotCoreMongodbDemoStack(Stack):
             timeout=Duration.seconds(120),
             memory_size=128,
             description='Lambda function for agricultural IOT data insertion',
-            layers = [lambda_layer_load],
+            layers = [lambda_layer_load, lambda_layer_common],
             environment={
                 'MONGODB_HOST': MONGODB_HOST,
                 'MONGODB_USER': MONGODB_USER,
                 'MONGODB_SECRET_ARN': mongodb_secret.secret_arn,
                 'MONGODB_DB': MONGODB_DB,
-                'MONGODB_COLLECTION': MONGODB_COL
+                'MONGODB_COLLECTION': TELEMETRY_COL,
+                'MONGODB_TIMESERIES': str(MONGODB_TIMESERIES).lower(),
+                'MONGODB_TIMESERIES_GRANULARITY': MONGODB_TIMESERIES_GRANULARITY,
+                'DATA_GENERATOR': DATA_GENERATOR,
+                'TS_FORMAT': TS_FORMAT,
+                'ID_FORMAT': ID_FORMAT,
+                'FLEET_SIZE': str(FLEET_SIZE),
+                'GENERATION_WORKERS': str(GENERATION_WORKERS),
+                'METRICS_NAMESPACE': METRICS_NAMESPACE,
+                'METRICS_FLUSH_INTERVAL': str(METRICS_FLUSH_INTERVAL)
             }
         )
 
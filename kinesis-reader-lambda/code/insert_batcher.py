@@ -0,0 +1,197 @@
+# Accumulates the documents of all Kinesis records of an invocation into as few insert_many calls as possible.
+#
+# Every document is BSON encoded once when it is added and kept as RawBSONDocument, which insert_many
+# sends as it is. That gives the exact size of every batch, so the batcher can flush before a batch
+# would exceed the document count or byte threshold. The thresholds are capped at the maxWriteBatchSize
+# and maxMessageSizeBytes the server reports (server_limits()), so one flush is one round-trip and
+# pymongo never splits it.
+#
+# Every document remembers the Kinesis record it came from. The inserts are unordered, so one failing
+# document does not stop the rest of the batch, and duplicate key errors (documents of a replayed record
+# that are already stored) count as written. Write errors known to fail the same way on every retry (a
+# document the time series or schema validation rejects, or one that is too large) are rejected: counted
+# and logged by the insert function and skipped, retrying them would only stall the shard. The records of
+# the documents that hit any other error are collected in failed_records, for the batchItemFailures
+# response. After an error that
+# is not a write error (e.g. the cluster is unreachable) nothing more is inserted and all remaining records
+# fail.
+#
+# Flushed batches are inserted by a thread pool, up to `concurrency` round-trips are in flight at the
+# same time on connections of the MongoClient's pool, while the handler decodes and encodes the next
+# records. When that many are in flight, the next flush waits for one of them. finish() waits for all of
+# them before the handler returns, so every record is written or reported as failed (at least once).
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import bson
+from bson.raw_bson import RawBSONDocument
+from pymongo.common import MAX_MESSAGE_SIZE, MAX_WRITE_BATCH_SIZE
+from pymongo.errors import PyMongoError
+
+# Room for the OP_MSG header and the insert command around the documents
+MESSAGE_OVERHEAD_BYTES = 16 * 1024
+DUPLICATE_KEY = 11000
+# Write errors of a single document that fail the same way on every retry: the document does not pass the
+# collection's validation (including the time series checks of the timeField), or it is too large. Only
+# these are skipped, every other write error is reported, an unknown code may be transient.
+DOCUMENT_VALIDATION_FAILURE = 121
+BAD_VALUE = 2
+BSON_OBJECT_TOO_LARGE = 10334
+DETERMINISTIC_WRITE_ERRORS = frozenset((DOCUMENT_VALIDATION_FAILURE, BAD_VALUE, BSON_OBJECT_TOO_LARGE))
+
+
+def server_limits(client):
+    # (maxWriteBatchSize, maxMessageSizeBytes) from the server's hello response. pymongo's own constants
+    # are only the defaults it assumes before the handshake (1000 documents).
+    hello = client.admin.command('hello')
+    return (hello.get('maxWriteBatchSize', MAX_WRITE_BATCH_SIZE),
+            hello.get('maxMessageSizeBytes', MAX_MESSAGE_SIZE))
+
+
+def classify_write_errors(details, nr_of_documents):
+    # Split the errors of an unordered BulkWriteError into the number of duplicate key errors, the write
+    # errors of rejected documents (DETERMINISTIC_WRITE_ERRORS, skipped) and the indexes of documents that
+    # were not written but may be on a retry. With a write concern error the writes may or may not be durable, all
+    # documents are retried then (their duplicates count as written on the next attempt).
+    if details.get('writeConcernErrors'):
+        return 0, [], set(range(nr_of_documents))
+    duplicates = 0
+    rejected = []
+    failed = set()
+    for error in details.get('writeErrors', ()):
+        code = error.get('code')
+        if code == DUPLICATE_KEY:
+            duplicates += 1
+        elif code in DETERMINISTIC_WRITE_ERRORS:
+            rejected.append(error)
+        else:
+            failed.add(error['index'])
+    return duplicates, rejected, failed
+
+
+class InsertBatcher:
+
+    def __init__(self, insert, max_documents=5000, max_bytes=8 * 1024 * 1024, concurrency=4,
+                 limits=(MAX_WRITE_BATCH_SIZE, MAX_MESSAGE_SIZE)):
+        # insert(documents) performs one unordered insert_many round-trip and returns the indexes of the
+        # documents that were not written, as (failed, rejected): failed ones fail their records,
+        # rejected ones are skipped. It is called from the pool's threads. limits are the server_limits()
+        # of the cluster.
+        self.insert = insert
+        max_write_batch_size, max_message_size = limits
+        self.max_documents = max(1, min(max_documents, max_write_batch_size))
+        self.max_bytes = max(1, min(max_bytes, max_message_size - MESSAGE_OVERHEAD_BYTES))
+        self.concurrency = max(1, concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='insert')
+        # In-flight inserts: future -> (records, size)
+        self.pending = {}
+        self.max_in_flight = 0
+        self.documents = []
+        # Record id of every accumulated document
+        self.records = []
+        self.size = 0
+        # Record ids in the order they failed, a dict keeps every record once
+        self.failed_records = {}
+        self.error = None
+        self.round_trips = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # Also on an exception of the handler, no insert may outlive the invocation
+        self.executor.shutdown(wait=True)
+
+    def add(self, record, documents):
+        # Add the documents of one Kinesis record, flushing whenever a threshold is reached. All documents
+        # are encoded first, a document bson cannot encode raises before any of the record is added.
+        if self.error is not None:
+            self.fail(record)
+            return
+        encode = bson.encode
+        for raw in [RawBSONDocument(encode(document)) for document in documents]:
+            self._append(record, raw)
+
+    def add_raw(self, record, documents):
+        # Add the RawBSONDocuments of one Kinesis record with a BSON payload, they are inserted as they are
+        if self.error is not None:
+            self.fail(record)
+            return
+        for document in documents:
+            self._append(record, document)
+
+    def _append(self, record, raw):
+        length = len(raw.raw)
+        if self.documents and self.size + length > self.max_bytes:
+            self.flush()
+        self.documents.append(raw)
+        self.records.append(record)
+        self.size += length
+        if len(self.documents) >= self.max_documents:
+            self.flush()
+
+    def fail(self, record):
+        self.failed_records[record] = None
+
+    def flush(self):
+        # Hand everything accumulated so far to the pool as one round-trip
+        if not self.documents:
+            return
+        documents, records, size = self.documents, self.records, self.size
+        self.documents = []
+        self.records = []
+        self.size = 0
+        if self.error is None:
+            # Only `concurrency` inserts in flight, this also bounds the memory of the batches
+            while len(self.pending) >= self.concurrency:
+                self._collect(FIRST_COMPLETED)
+        if self.error is not None:
+            for record in records:
+                self.fail(record)
+            return
+        self.pending[self.executor.submit(self.insert, documents)] = (records, size)
+        self.max_in_flight = max(self.max_in_flight, len(self.pending))
+
+    def finish(self):
+        # Insert what is left and wait for all inserts in flight
+        self.flush()
+        while self.pending:
+            self._collect(FIRST_COMPLETED)
+
+    def _collect(self, return_when):
+        # Combine the results of the finished inserts, in the handler's thread
+        done, _ = wait(self.pending, return_when=return_when)
+        for future in done:
+            records, size = self.pending.pop(future)
+            try:
+                failed, rejected = future.result()
+            except PyMongoError as error:
+                print(f"Insert of {len(records)} documents failed: {error!r}")
+                self.error = error
+                failed, rejected = range(len(records)), ()
+            self.round_trips += 1
+            self.inserted += len(records) - len(failed) - len(rejected)
+            self.rejected += len(rejected)
+            self.bytes += size
+            for index in sorted(failed):
+                self.fail(records[index])
+
+    def batch_item_failures(self):
+        return [{'itemIdentifier': record} for record in self.failed_records]
+
+    def summary(self):
+        return {
+            'round_trips': self.round_trips,
+            'documents': self.inserted,
+            'rejected_documents': self.rejected,
+            'failed_records': len(self.failed_records),
+            'documents_per_round_trip': round(self.inserted / self.round_trips, 1) if self.round_trips else 0.0,
+            'bytes_per_round_trip': round(self.bytes / self.round_trips) if self.round_trips else 0,
+            'concurrency': self.concurrency,
+            'max_in_flight': self.max_in_flight,
+            'max_documents': self.max_documents,
+            'max_bytes': self.max_bytes,
+        }
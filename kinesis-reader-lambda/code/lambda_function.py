@@ -1,11 +1,22 @@
 #!/usr/bin/env python3
 
 from pymongo import MongoClient, WriteConcern
+from bson.errors import InvalidDocument
+from pymongo.errors import BulkWriteError
 import boto3
 import random
 import json
 import os
 import base64
+import time
+from agri_common.bsonbatch import raw_documents
+from agri_common.columnar import decode_columns
+from agri_common.framing import FORMAT_BSON, FORMAT_JSON_COLUMNS, FORMAT_JSON_ROWS, unframe
+from agri_common.metrics import BYTES, COUNT, Metrics
+from agri_common.ids import to_object_ids
+from agri_common import timeseries
+from agri_common.timestamps import to_datetimes
+from insert_batcher import InsertBatcher, classify_write_errors, server_limits
 
 
 mongodb_secrets_arn = os.environ.get('MONGODB_SECRET_ARN')
@@ -13,7 +24,18 @@ mongodb_host = os.environ.get('MONGODB_HOST')
 mongodb_user = os.environ.get('MONGODB_USER')
 mongodb_db = os.environ.get('MONGODB_DB')
 mongodb_collection = os.environ.get('MONGODB_COLLECTION')
-BATCH_SIZE = 100
+# Thresholds of one insert_many round-trip, the documents of all records of an event are accumulated up to them
+INSERT_BATCH_MAX_DOCUMENTS = int(os.environ.get('INSERT_BATCH_MAX_DOCUMENTS', '5000'))
+INSERT_BATCH_MAX_BYTES = int(os.environ.get('INSERT_BATCH_MAX_BYTES', str(8 * 1024 * 1024)))
+if INSERT_BATCH_MAX_DOCUMENTS < 1 or INSERT_BATCH_MAX_BYTES < 1:
+    raise ValueError("INSERT_BATCH_MAX_DOCUMENTS and INSERT_BATCH_MAX_BYTES must be positive")
+# Number of insert_many round-trips in flight at the same time, each on its own pooled connection
+INSERT_CONCURRENCY = int(os.environ.get('INSERT_CONCURRENCY', '4'))
+if INSERT_CONCURRENCY < 1:
+    raise ValueError("INSERT_CONCURRENCY must be at least 1")
+# MONGODB_COLLECTION is a time series collection (timeField ts, metaField vehicleid), created at cold start
+MONGODB_TIMESERIES = timeseries.enabled(os.environ)
+MONGODB_TIMESERIES_GRANULARITY = timeseries.check_granularity(os.environ.get('MONGODB_TIMESERIES_GRANULARITY', 'seconds'))
 
 secretsmanager = boto3.client('secretsmanager')
 response = secretsmanager.get_secret_value(
@@ -28,42 +50,131 @@ mongodb_password = secrets['password']
 # Create MongoDB connection string
 mongo_uri  = f"mongodb+srv://{mongodb_user}:{mongodb_password}@{mongodb_host}/{mongodb_db}"
 cluster = MongoClient(mongo_uri)  # replace with your connection string
+# maxWriteBatchSize and maxMessageSizeBytes of the cluster, read once per sandbox by the first invocation
+limits = None
+
+if MONGODB_TIMESERIES:
+    # Before the first insert, which would create a regular collection
+    action = timeseries.ensure_collection(cluster[mongodb_db], mongodb_collection, MONGODB_TIMESERIES_GRANULARITY)
+    print(f"Time series collection {mongodb_db}.{mongodb_collection}: {action}")
+
+# EMF metrics (decode time, insert_many latency, documents inserted, ...), flushed at the end of every invocation
+metrics = Metrics()
+
+
+def insert_documents(collection, documents):
+    # Unordered, so a failing document does not stop the others. Returns the indexes of the documents
+    # that were not written as (failed, rejected), duplicate key errors of replayed records count as
+    # written. Rejected documents fail deterministically (e.g. validation), they are logged and skipped.
+    failed = rejected = ()
+    with metrics.timer('InsertManyLatency'):
+        try:
+            collection.insert_many(documents, ordered=False)
+            inserted = len(documents)
+        except BulkWriteError as error:
+            inserted = error.details.get('nInserted', 0)
+            duplicates, errors, failed = classify_write_errors(error.details, len(documents))
+            rejected = [write_error['index'] for write_error in errors]
+            if errors:
+                print(f"Skipping {len(errors)} rejected documents, first error: {json.dumps(errors[0], default=str)}")
+            metrics.count('DuplicateDocuments', duplicates)
+            metrics.count('RejectedDocuments', len(rejected))
+            metrics.count('FailedDocuments', len(failed))
+    # inserted_ids stays empty for RawBSONDocuments, count the documents instead
+    metrics.count('DocumentsInserted', inserted)
+    metrics.count('InsertManyCalls')
+    return failed, rejected
+
+
+def check_documents(items):
+    # A JSON payload is valid JSON but still a poison record if it is not an array of objects
+    if type(items) is not list:
+        raise ValueError(f"Payload is a JSON {type(items).__name__}, not an array of documents")
+    for item in items:
+        if type(item) is not dict:
+            raise ValueError(f"Payload holds a JSON {type(item).__name__}, not a document")
+
+
+def skip_record(record, error):
+    # A poison record fails the same way on every retry, reporting it in batchItemFailures would stall the
+    # shard until it expires. It is logged with enough to find it in the stream and skipped.
+    print(f"Skipping record {record['kinesis']['sequenceNumber']} (partition key "
+          f"{record['kinesis'].get('partitionKey')}): {error!r}")
+    metrics.count('PoisonRecords')
 
 def lambda_handler(event, context):
+    global limits
+    if limits is None:
+        limits = server_limits(cluster)
     db = cluster[mongodb_db]
     wc = WriteConcern(w=1) 
     collection =  db.get_collection(mongodb_collection, write_concern=wc)
+    metrics.set_property('RequestId', context.aws_request_id)
+    metrics.set_property('InsertConcurrency', INSERT_CONCURRENCY)
     #wait_time = random.uniform(0.01, 30)
 
-    # Prepare the list of documents for bulk insertion
-    documents = []
-
-    # For each record in the Kinesis data
-    for record in event['Records']:
-        # Kinesis data is base64 encoded so decode here
-        payload = base64.b64decode(record["kinesis"]["data"])
-        data_items = json.loads(payload)
-
-        # Iterate over the data items in the batch
-        for data_item in data_items:
-            # Append the data item to the list of documents
-            documents.append(data_item)
-            
-            if len(documents) == BATCH_SIZE:
-                # Insert the documents into MongoDB Atlas using insert_many
-                result = collection.insert_many(documents )
-                print('Status Code:', 'Acknowledged' if result.acknowledged else 'Not Acknowledged')
-                print('Number of Documents Inserted:', len(result.inserted_ids))
-                documents = []
-                
-        if len(documents) > 0:
-            result = collection.insert_many(documents )
-            print('Status Code:', 'Acknowledged' if result.acknowledged else 'Not Acknowledged')
-            print('Final Batch of number of Documents Inserted:', len(result.inserted_ids))
-            documents = []
-
-    return {
-        'statusCode': 200,
-        'body': json.dumps('Done')
-    }
+    # Accumulates the documents of all records and inserts them in as few round-trips as the thresholds
+    # and the concurrency allow, while the next records are decoded
+    with InsertBatcher(lambda documents: insert_documents(collection, documents),
+                       INSERT_BATCH_MAX_DOCUMENTS, INSERT_BATCH_MAX_BYTES, INSERT_CONCURRENCY, limits) as batcher:
+        # For each record in the Kinesis data
+        for record in event['Records']:
+            # Records that are not written are reported by their sequence number, Lambda retries from the first of them
+            sequence_number = record["kinesis"]["sequenceNumber"]
+            # Kinesis data is base64 encoded so decode here
+            payload = base64.b64decode(record["kinesis"]["data"])
+            metrics.count('KinesisRecords')
+            metrics.count('PayloadBytes', len(payload), BYTES)
+            # Time from arriving in the stream until this function picked the record up
+            metrics.observe('KinesisRecordAge', (time.time() - record["kinesis"]["approximateArrivalTimestamp"]) * 1000)
+            # Compressed and columnar payloads carry a framing header, plain JSON payloads are passed through as they are
+            with metrics.timer('DecodeTime'):
+                try:
+                    content_format, body = unframe(payload)
+                    if content_format == FORMAT_BSON:
+                        # Already BSON encoded by the producer, sliced into RawBSONDocuments without decoding
+                        raw_items = raw_documents(body)
+                    elif content_format == FORMAT_JSON_ROWS:
+                        data_items = json.loads(body)
+                    elif content_format == FORMAT_JSON_COLUMNS:
+                        data_items = decode_columns(body)
+                    else:
+                        raise ValueError(f"Unsupported payload format {content_format}")
+                    if content_format != FORMAT_BSON:
+                        check_documents(data_items)
+                except Exception as error:
+                    skip_record(record, error)
+                    continue
+                if content_format != FORMAT_BSON:
+                    # Epoch millisecond timestamps (TS_FORMAT=epoch_ms producers) are stored as BSON datetimes,
+                    # the timeField of a time series collection also needs iso strings as datetimes
+                    metrics.count('TimestampsConverted', to_datetimes(data_items, parse_iso=MONGODB_TIMESERIES))
+                    # ObjectId hex strings (ID_FORMAT=objectid producers) are stored as 12 byte ObjectIds
+                    metrics.count('ObjectIdsConverted', to_object_ids(data_items))
+
+            if content_format == FORMAT_BSON:
+                metrics.count('RawDocuments', len(raw_items))
+                batcher.add_raw(sequence_number, raw_items)
+            else:
+                try:
+                    batcher.add(sequence_number, data_items)
+                except (InvalidDocument, OverflowError) as error:
+                    # A document bson cannot encode, none of the record's documents was added
+                    skip_record(record, error)
+
+        # Insert what is left once all records are read and wait for all inserts in flight
+        batcher.finish()
+    summary = batcher.summary()
+    metrics.count('InsertRoundTrips', summary['round_trips'])
+    metrics.observe('DocumentsPerRoundTrip', summary['documents_per_round_trip'], COUNT)
+    metrics.observe('InsertsInFlight', summary['max_in_flight'], COUNT)
+    print('Insert summary:', json.dumps(summary))
 
+    # Only records with documents that hit errors which may be transient, Lambda retries them until they are
+    # written or KINESIS_READER_MAX_RECORD_AGE / KINESIS_READER_RETRY_ATTEMPTS in the stack send them to the
+    # failure queue
+    failures = batcher.batch_item_failures()
+    metrics.count('FailedRecords', len(failures))
+    metrics.flush()
+    # Partial batch response (ReportBatchItemFailures), an empty list marks the whole batch as processed
+    return {'batchItemFailures': failures}
@@ -0,0 +1,80 @@
+# Telemetry generation of the load function, in a module of its own so the generation workers' fork server
+# can preload it: importing lambda_function would connect to MongoDB and sleep in the fork server as well.
+
+from bson import encode
+import random
+import time
+import os
+from agri_common.corpus import Corpus, CorpusReplay
+from agri_common.fleet import FleetSimulator
+from agri_common import ids
+from agri_common.telemetry import generate_batch
+from agri_common import timeseries
+from agri_common.timestamps import TS_EPOCH_MS, check_format, to_datetimes
+
+# Telemetry source: "random" (independent random readings), "fleet" (stateful fleet simulator kept across
+# warm invocations, generation workers hand the state of their partitions back) or "replay" (pre-generated
+# corpus replayed from the start in every invocation)
+DATA_GENERATOR = os.environ.get('DATA_GENERATOR', 'random')
+if DATA_GENERATOR not in ('random', 'fleet', 'replay'):
+    raise ValueError(f"Unknown DATA_GENERATOR {DATA_GENERATOR}, use random, fleet or replay")
+fleet = FleetSimulator(int(os.environ.get('FLEET_SIZE', '50000'))) if DATA_GENERATOR == 'fleet' else None
+CORPUS_PATH = os.environ.get('CORPUS_PATH', '/opt/corpus/telemetry.bin')
+corpus = Corpus(CORPUS_PATH) if DATA_GENERATOR == 'replay' else None
+
+# Representation of ts: "iso" (isoformat strings) or "epoch_ms" (stored as BSON datetime)
+TS_FORMAT = check_format(os.environ.get('TS_FORMAT', 'iso'))
+
+# Document ids: "uuid" (uuid4 string with the request id) or "objectid" (time ordered ObjectIds)
+ID_FORMAT = ids.check_format(os.environ.get('ID_FORMAT', 'uuid'))
+
+# MONGODB_COLLECTION is a time series collection (timeField ts, metaField vehicleid), created at cold start
+MONGODB_TIMESERIES = timeseries.enabled(os.environ)
+
+
+def generate_synthetic_data(num_records, request_id, replay=None):
+    # Fields are generated column-wise for the whole batch, dicts are only built here at the end
+    if replay:
+        batch = replay.next_batch(num_records, request_id, ts_format=TS_FORMAT, id_format=ID_FORMAT)
+    elif fleet:
+        batch = fleet.tick(num_records, request_id, ts_format=TS_FORMAT, id_format=ID_FORMAT)
+    else:
+        batch = generate_batch(num_records, request_id, ts_format=TS_FORMAT, id_format=ID_FORMAT)
+    docs = batch.records()
+    if TS_FORMAT == TS_EPOCH_MS or MONGODB_TIMESERIES:
+        # The timeField of a time series collection needs datetimes, also for iso strings
+        to_datetimes(docs, parse_iso=MONGODB_TIMESERIES)
+    if ID_FORMAT == ids.ID_OBJECTID:
+        ids.to_object_ids(docs)
+    return docs
+
+
+def bson_worker(request_id, corpus_position, fleet_state, index, nr_of_workers):
+    # Producer factory for the generation workers, bound to the invocation with functools.partial so the
+    # fork server can pickle it: every result is (concatenated BSON documents, nr_of_documents, generate_ms,
+    # serialize_ms, fleet_partition). fleet_partition is None except in the final result, where it is the
+    # state of the worker's vehicles for load_fleet_partition().
+    if fleet:
+        # The fork server's simulator never ticks, the worker continues from the parent's state. Its random
+        # generator is not reseeded by fork, every worker would draw the same _ids without a new seed.
+        fleet.load_state(fleet_state)
+        fleet.rng.seed()
+        fleet.restrict(index, nr_of_workers)
+    replay = CorpusReplay(corpus, corpus_position + index * len(corpus) // nr_of_workers) if corpus else None
+
+    def produce(request):
+        if request is None:
+            return b'', 0, 0.0, 0.0, fleet.partition_state(index, nr_of_workers) if fleet else None
+        started = time.perf_counter()
+        docs = generate_synthetic_data(random.randint(80, 200), request_id, replay)
+        generated = time.perf_counter()
+        blob = b''.join(map(encode, docs))
+        return blob, len(docs), (generated - started) * 1000, (time.perf_counter() - generated) * 1000, None
+
+    return produce
+
+
+def load_fleet_partition(fleet_partition):
+    # Take over the state of a worker's vehicles from its final result, so the next invocation continues it
+    if fleet_partition:
+        fleet.load_state(*fleet_partition)
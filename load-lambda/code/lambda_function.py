@@ -1,13 +1,21 @@
 #!/usr/bin/env python3
 
 from pymongo import MongoClient, WriteConcern
+from bson import decode_all
+from bson.raw_bson import DEFAULT_RAW_BSON_OPTIONS
 import datetime
+import functools
 import random
 import time
 import os
-import uuid
 import boto3
 import json
+from agri_common.corpus import CorpusReplay
+from agri_common.metrics import Metrics
+from agri_common import timeseries
+from agri_common.workers import WorkerPool
+import generator
+from generator import MONGODB_TIMESERIES, corpus, generate_synthetic_data
 
 mongodb_secrets_arn = os.environ.get('MONGODB_SECRET_ARN')
 mongodb_host = os.environ.get('MONGODB_HOST')
@@ -15,6 +23,14 @@ mongodb_user = os.environ.get('MONGODB_USER')
 mongodb_db = os.environ.get('MONGODB_DB')
 mongodb_collection = os.environ.get('MONGODB_COLLECTION')
 
+# DATA_GENERATOR, FLEET_SIZE, CORPUS_PATH, TS_FORMAT, ID_FORMAT and MONGODB_TIMESERIES are read by the
+# generator module, see generator.py
+MONGODB_TIMESERIES_GRANULARITY = timeseries.check_granularity(os.environ.get('MONGODB_TIMESERIES_GRANULARITY', 'seconds'))
+
+# Number of generation worker processes. 0 generates in the handler's process. With workers the documents
+# are generated and BSON encoded in the workers, the handler's process only calls insert_many.
+GENERATION_WORKERS = int(os.environ.get('GENERATION_WORKERS', '0'))
+
 
 secretsmanager = boto3.client('secretsmanager')
 response = secretsmanager.get_secret_value(
@@ -31,68 +47,19 @@ mongo_uri  = f"mongodb+srv://{mongodb_user}:{mongodb_password}@{mongodb_host}/{m
 
 cluster = MongoClient(mongo_uri)  # replace with your connection string
 
+if MONGODB_TIMESERIES:
+    # Before the first insert, which would create a regular collection
+    action = timeseries.ensure_collection(cluster[mongodb_db], mongodb_collection, MONGODB_TIMESERIES_GRANULARITY)
+    print(f"Time series collection {mongodb_db}.{mongodb_collection}: {action}")
+
 # Create random duration to avoid hammering fleet effect
 wait_time = random.uniform(0.01, 15)
 current_time = datetime.datetime.now().isoformat()
 print(f"{current_time}: Function initialized. Waiting {wait_time} seconds to avoid hammering fleet effect")
 time.sleep(wait_time)
 
-def generate_synthetic_data(num_records, request_id):
-    data = []
-
-    for _ in range(num_records):
-        current_time = datetime.datetime.now().isoformat()
-        record = {
-            "_id": str(uuid.uuid4()) + "-" + request_id,  # Assign a unique _id for each document
-            'ts': current_time,
-            'vehicleid': random.randint(1, 50000),
-            'temperature': round(random.uniform(5.0, 40.0), 2),
-            'operatingtime': random.randint(0, 1000),
-            'fuelusage': round(random.uniform(0.0, 10.0), 2),
-            'front_linkage_position': random.randint(0, 100),
-            'drivingspeed': random.randint(0, 40),
-            'enginestate': random.choice([0, 1]),
-            'autopilot_system_state': random.choice([0, 1]),
-            'engine_load': round(random.uniform(0.0, 100.0), 2),
-            'latitude': round(random.uniform(-90.0, 90.0), 6),
-            'longitude': round(random.uniform(-180.0, 180.0), 6),
-            'altitude': round(random.uniform(0.0, 1000.0), 2),
-            'engine_rotation': round(random.uniform(0.0, 3000.0), 2),
-            'front_pme_shaft': round(random.uniform(0.0, 100.0), 2),
-            'rear_linkage_position': random.randint(0, 100),
-            'four_wheel_driving_state': random.choice(['Engaged', 'Disengaged']),
-            'fuel_tank_level': random.randint(0, 100),
-            'last_error_msg': random.choice(['No Error', 'Warning: Low Fuel Level', 'Error: Engine Overheating']),
-            'engine_temperature': round(random.uniform(60.0, 110.0), 2),
-            'connection_state': random.choice(['Connected', 'Disconnected']),
-            'lte_connection_level': round(random.uniform(0.0, 100.0), 2),
-            'mode': random.choice(['Normal', 'Eco', 'Work'])
-        }
-
-
-        if random.random() < 0.5:
-            record.pop('operatingtime')
-        if random.random() < 0.5:
-            record.pop('autopilot_system_state')
-        if random.random() < 0.5:
-            record.pop('enginestate')
-        if random.random() < 0.5:
-            record.pop('temperature')
-
-
-        if random.random() < 0.3:
-            record.pop('front_linkage_position')
-            record.pop('rear_linkage_position')
-            record.pop('engine_rotation')
-            record.pop('four_wheel_driving_state')
-        if random.random() < 0.4:
-            record.pop('front_pme_shaft')
-
-        data.append(record)
-          # Simulating time decreasing by 1 minute for each record
-
-    return data
-
+# EMF metrics (generate time, insert_many latency, documents inserted), flushed every METRICS_FLUSH_INTERVAL seconds
+metrics = Metrics()
 
 
 def lambda_handler(event, context):
@@ -101,18 +68,54 @@ def lambda_handler(event, context):
     wc = WriteConcern(w=1) 
     collection =  db.get_collection(mongodb_collection, write_concern=wc)
     # Add artificial wait time to avoid hammering effect
+    metrics.set_property('RequestId', context.aws_request_id)
+    workers = None
+    if GENERATION_WORKERS:
+        # The MongoClient runs monitor threads, so the workers are forked from the fork server, which only
+        # imports the generator module
+        workers = WorkerPool(GENERATION_WORKERS,
+                             functools.partial(generator.bson_worker, context.aws_request_id, event.get('corpus_position', 0),
+                                               generator.fleet.state() if generator.fleet else None),
+                             start_method='forkserver', preload=['generator'])
+        workers.start()
+    replay = CorpusReplay(corpus, event.get('corpus_position', 0)) if corpus and not workers else None
     inserted_docs = 0
-    for _ in range(500):
-
-        random_int = random.randint(80, 200)
-        docs_to_insert = generate_synthetic_data(random_int, context.aws_request_id)
-        collection.insert_many(docs_to_insert, ordered=False)
-        inserted_docs += random_int
-        current_time = datetime.datetime.now().isoformat()
-        print(f"{current_time}:{random_int} records inserted this round, {inserted_docs} rows inserted in total")
-        wait_time = random.uniform(0.05, 0.1)
-        time.sleep(wait_time)
-
+    try:
+        for _ in range(500):
+
+            if workers:
+                with metrics.timer('WorkerWait'):
+                    blob, _, generate_ms, serialize_ms, _ = workers.next()
+                metrics.observe('GenerateTime', generate_ms)
+                metrics.observe('SerializeTime', serialize_ms)
+                # RawBSONDocuments are sent as they are, without encoding them again
+                docs_to_insert = decode_all(blob, DEFAULT_RAW_BSON_OPTIONS)
+            else:
+                random_int = random.randint(80, 200)
+                with metrics.timer('GenerateTime'):
+                    docs_to_insert = generate_synthetic_data(random_int, context.aws_request_id, replay)
+            with metrics.timer('InsertManyLatency'):
+                collection.insert_many(docs_to_insert, ordered=False)
+            metrics.count('DocumentsInserted', len(docs_to_insert))
+            metrics.count('InsertManyCalls')
+            inserted_docs += len(docs_to_insert)
+            current_time = datetime.datetime.now().isoformat()
+            print(f"{current_time}:{len(docs_to_insert)} records inserted this round, {inserted_docs} rows inserted in total")
+            metrics.maybe_flush()
+            wait_time = random.uniform(0.05, 0.1)
+            time.sleep(wait_time)
+    except Exception:
+        # Never leave worker processes behind in the sandbox
+        if workers:
+            workers.terminate()
+        raise
+    if workers:
+        # The number of inserts is fixed, batches the workers generated ahead are dropped. The final
+        # results carry the state of the fleet partitions for the next invocation.
+        for *_, fleet_partition in workers.close():
+            generator.load_fleet_partition(fleet_partition)
+
+    metrics.flush()
     return {
         'statusCode': 200,
         'body': 'Successfully inserted documents!'
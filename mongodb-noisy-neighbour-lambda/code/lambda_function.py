@@ -1,11 +1,14 @@
 import os
-import time
 import boto3
 import pymongo
 import json
 import datetime
 import random
 import pprint
+from agri_common.metrics import Metrics
+from agri_common import runloop, timeseries
+from agri_common.runloop import RunLoop
+from agri_common.timestamps import since
 
 
 mongodb_secrets_arn = os.environ.get('MONGODB_SECRET_ARN')
@@ -15,6 +18,12 @@ mongodb_db = os.environ.get('MONGODB_DB')
 mongodb_collection = os.environ.get('MONGODB_COLLECTION')
 NR_OF_EXECUTIONS = 1000
 
+# Seconds the handler keeps querying at most. It stops earlier when the function's timeout is closer than
+# RUN_SAFETY_MARGIN seconds, so the last query finishes and the metrics are flushed.
+RUN_SECONDS, RUN_SAFETY_MARGIN = runloop.settings(os.environ)
+
+# Representation of ts in MONGODB_COLLECTION, the time windows of the queries are built in it
+TS_FORMAT = timeseries.stored_ts_format(os.environ)
 
 # Add vehicleid here, it can be passed from the event or as an environment variable
 vehicle_id = os.environ.get('VEHICLE_ID')
@@ -42,6 +51,9 @@ print(mongodb_connection_string)
 client = pymongo.MongoClient(mongodb_connection_string)
     
 
+# EMF metrics (aggregate latency, number of queries), flushed every METRICS_FLUSH_INTERVAL seconds
+metrics = Metrics()
+
 def lambda_handler(event, context):
 
     # Select the database
@@ -49,12 +61,13 @@ def lambda_handler(event, context):
     
     # Select the collection
     collection = db[mongodb_collection]
+    metrics.set_property('RequestId', context.aws_request_id)
 
-    current_time = datetime.datetime.now()
-    end_time = current_time + datetime.timedelta(seconds=900)
+    # Stops issuing queries once the next one would run into the safety margin before the function's timeout
+    run_loop = RunLoop(context, safety_margin=RUN_SAFETY_MARGIN, max_seconds=RUN_SECONDS)
     # Query the collection
     
-    while current_time < end_time:
+    while run_loop.next():
         # Get current time
 
         vehicle_id = random.randint(1,50000)
@@ -62,20 +75,14 @@ def lambda_handler(event, context):
         # Get the current time
         current_time = datetime.datetime.now()
 
-        # Calculate the time five minutes ago
-        one_minute_ago = current_time - datetime.timedelta(minutes=15)
-
-        # Convert the time to ISO format
-        one_minute_ago_iso = one_minute_ago.isoformat()
-
-        # Run the query
+        # Run the query, ts of the last 15 minutes as datetime range (or iso string comparison)
         results = collection.aggregate([
                 {"$match": {
-                    "ts": {"$gte": one_minute_ago_iso},
+                    "ts": since(TS_FORMAT, 15 * 60),
                     "vehicleid": vehicle_id
                 }},
                 {"$lookup": {
-                    "from": "agricol",
+                    "from": mongodb_collection,
                     "localField": "vehicleid",
                     "foreignField": "vehicleid",
                     "as": "vehicle_info"
@@ -91,6 +98,9 @@ def lambda_handler(event, context):
 
         results_list = list(results)  # Convert the Cursor to a list
         query_time = datetime.datetime.now() - current_time
+        metrics.observe('AggregateLatency', query_time.total_seconds() * 1000)
+        metrics.count('Queries')
+        run_loop.add()
 
         # Initialize variables
         avg_speed = 0
@@ -103,6 +113,11 @@ def lambda_handler(event, context):
     
         print(f"{datetime.datetime.now()}: VehicleID: {vehicle_id}, Avg. speed (last minute): {round(avg_speed,2)}, Avg. speed (total): {round(avg_vehicle_speed,2)}, Query time: {query_time}" )
 
+        metrics.maybe_flush()
         # Sleep for 5 seconds
-        time.sleep(5)
-        current_time = datetime.datetime.now()
+        run_loop.sleep(5)
+
+    # The client is kept open for the next warm invocation
+    run_summary = run_loop.summary()
+    print(f"Run summary: {run_summary}")
+    metrics.flush()
@@ -1,10 +1,13 @@
 import os
-import time
 import boto3
 import pymongo
 import json
 import datetime
 import random
+from agri_common.metrics import Metrics
+from agri_common import runloop, timeseries
+from agri_common.runloop import RunLoop
+from agri_common.timestamps import since
 
 mongodb_secrets_arn = os.environ.get('MONGODB_SECRET_ARN')
 mongodb_host = os.environ.get('MONGODB_HOST')
@@ -13,6 +16,13 @@ mongodb_db = os.environ.get('MONGODB_DB')
 mongodb_collection = os.environ.get('MONGODB_COLLECTION')
 NR_OF_EXECUTIONS = 1000
 
+# Seconds the handler keeps querying at most. It stops earlier when the function's timeout is closer than
+# RUN_SAFETY_MARGIN seconds, so the last query finishes and the metrics are flushed.
+RUN_SECONDS, RUN_SAFETY_MARGIN = runloop.settings(os.environ)
+
+# Representation of ts in MONGODB_COLLECTION, the time windows of the queries are built in it
+TS_FORMAT = timeseries.stored_ts_format(os.environ)
+
 # Add vehicleid here, it can be passed from the event or as an environment variable
 vehicle_id = os.environ.get('VEHICLE_ID')
 
@@ -33,33 +43,31 @@ mongodb_connection_string = f"mongodb+srv://{mongodb_user}:{mongodb_password}@{m
 # Create MongoClient
 client = pymongo.MongoClient(mongodb_connection_string)
 
+# EMF metrics (aggregate latency, number of queries), flushed every METRICS_FLUSH_INTERVAL seconds
+metrics = Metrics()
+
 def lambda_handler(event, context):
     # Select the database
     db = client[mongodb_db]
 
     # Select the collection
     collection = db[mongodb_collection]
+    metrics.set_property('RequestId', context.aws_request_id)
     
-    current_time = datetime.datetime.now()
-    end_time = current_time + datetime.timedelta(seconds=900)
+    # Stops issuing queries once the next one would run into the safety margin before the function's timeout
+    run_loop = RunLoop(context, safety_margin=RUN_SAFETY_MARGIN, max_seconds=RUN_SECONDS)
     # Query the collection
     
-    while current_time < end_time:
+    while run_loop.next():
         # Get the current time
         # Get the current time
         current_time = datetime.datetime.now()
 
-        # Calculate the time five minutes ago
-        five_minutes_ago = current_time - datetime.timedelta(minutes=5)
-
-        # Convert the time to ISO format
-        five_minutes_ago_iso = five_minutes_ago.isoformat()
-
         vehicle_id = random.randint(1,50000)
 
-        # Define the query
+        # Define the query, ts of the last five minutes as datetime range (or iso string comparison)
         query = { 
-            "ts": { "$gte": five_minutes_ago_iso },
+            "ts": since(TS_FORMAT, 5 * 60),
             "vehicleid": int(vehicle_id)
         }
 
@@ -81,10 +89,17 @@ def lambda_handler(event, context):
 
         #query_time = (datetime.datetime.now() - current_time).total_seconds() * 1000
         total_execution_time = datetime.datetime.now() - current_time
+        metrics.observe('AggregateLatency', total_execution_time.total_seconds() * 1000)
+        metrics.count('Queries')
+        run_loop.add()
         
         print(f"{datetime.datetime.now()}: VehicleID: {vehicle_id}, Average speed in the last 5 minutes: {avg_speed}, Query time: {total_execution_time} ")
 
+        metrics.maybe_flush()
         # Wait for 1 second
-        time.sleep(1)
+        run_loop.sleep(1)
 
-        current_time = datetime.datetime.now()
+    # The client is kept open for the next warm invocation
+    run_summary = run_loop.summary()
+    print(f"Run summary: {run_summary}")
+    metrics.flush()
@@ -0,0 +1,101 @@
+# The schema specialized encoder must produce exactly the bytes of records() + json.dumps, which the
+# Kinesis reader parses back with json.loads, for every generator, timestamp and _id format.
+#
+# Run: python3 -m pytest
+
+import json
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common-layer', 'python'))
+
+from agri_common.corpus import Corpus, CorpusReplay, write_corpus  # noqa: E402
+from agri_common.encoder import MAX_FRAGMENT_TABLE_SIZE, TelemetryEncoder  # noqa: E402
+from agri_common.fleet import FleetSimulator  # noqa: E402
+from agri_common.ids import ID_OBJECTID, ID_UUID  # noqa: E402
+from agri_common.telemetry import DROPOUT_RULES, OPTIONAL_FIELDS, TelemetryBatch, generate_batch  # noqa: E402
+from agri_common.timestamps import TS_EPOCH_MS, TS_ISO  # noqa: E402
+
+REQUEST_ID = 'c0ffee00-0000-4000-8000-000000000000'
+BATCH_SIZES = (1, 2, 17, 200)
+SEED = 7
+
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('corpus') / 'telemetry.bin')
+    write_corpus(path, 2000, SEED)
+    return Corpus(path)
+
+
+@pytest.fixture(params=['random', 'fleet', 'replay'])
+def batches(request, corpus):
+    # Factory of batches(n, ts_format, id_format) of one of the producers' data generators
+    rng = random.Random(SEED)
+    if request.param == 'random':
+        return lambda n, ts_format, id_format: generate_batch(n, REQUEST_ID, rng=rng, ts_format=ts_format,
+                                                              id_format=id_format)
+    if request.param == 'fleet':
+        fleet = FleetSimulator(fleet_size=500, rng=rng)
+        return lambda n, ts_format, id_format: fleet.tick(n, REQUEST_ID, ts_format=ts_format, id_format=id_format)
+    replay = CorpusReplay(corpus)
+    return lambda n, ts_format, id_format: replay.next_batch(n, REQUEST_ID, ts_format=ts_format, id_format=id_format)
+
+
+def assert_compatible(encoder, batch):
+    records = batch.records()
+    payload = bytes(encoder.encode(batch))
+    assert payload == json.dumps(records).encode()
+    assert json.loads(payload) == records
+    assert encoder.encode_records(batch) == [json.dumps(record).encode() for record in records]
+
+
+def with_dropped(batch, dropped):
+    # The same records with every optional field dropped (True) or present (False)
+    masks = {}
+    for _, fields in DROPOUT_RULES:
+        mask = [dropped] * batch.size
+        for field in fields:
+            masks[field] = mask
+    return TelemetryBatch(batch.size, batch.columns, masks)
+
+
+@pytest.mark.parametrize('ts_format', [TS_ISO, TS_EPOCH_MS])
+@pytest.mark.parametrize('id_format', [ID_UUID, ID_OBJECTID])
+def test_encode_matches_json_dumps(batches, ts_format, id_format):
+    encoder = TelemetryEncoder()
+    for _ in range(5):
+        for size in BATCH_SIZES:
+            assert_compatible(encoder, batches(size, ts_format, id_format))
+
+
+@pytest.mark.parametrize('dropped', [True, False])
+def test_dropped_fields(batches, dropped):
+    encoder = TelemetryEncoder()
+    batch = with_dropped(batches(50, TS_ISO, ID_UUID), dropped)
+    assert_compatible(encoder, batch)
+    for record in json.loads(bytes(encoder.encode(batch))):
+        assert all((field in record) != dropped for field in OPTIONAL_FIELDS)
+
+
+def test_full_fragment_tables():
+    # Beyond MAX_FRAGMENT_TABLE_SIZE distinct values the numeric fields are encoded without the table
+    encoder = TelemetryEncoder()
+    rng = random.Random(SEED)
+    batches = [generate_batch(500, REQUEST_ID, rng=rng) for _ in range(2 * MAX_FRAGMENT_TABLE_SIZE // 500 + 1)]
+    for batch in batches:
+        assert_compatible(encoder, batch)
+    assert any(len(table) >= MAX_FRAGMENT_TABLE_SIZE for table in encoder.numeric_fragments.values())
+    assert_compatible(encoder, batches[0])
+
+
+def test_buffer_is_reused():
+    encoder = TelemetryEncoder()
+    rng = random.Random(SEED)
+    first = encoder.encode(generate_batch(20, REQUEST_ID, rng=rng))
+    batch = generate_batch(3, REQUEST_ID, rng=rng)
+    assert encoder.encode(batch) is first
+    assert bytes(first) == json.dumps(batch.records()).encode()
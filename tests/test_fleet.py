@@ -0,0 +1,56 @@
+# Handing the fleet simulator's state to generation workers and back: every worker continues its partition
+# of the parent's fleet, and the parent takes over the partitions' state from the workers' final results.
+#
+# Run: python3 -m pytest
+
+import datetime
+import os
+import pickle
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common-layer', 'python'))
+
+from agri_common.fleet import FleetSimulator  # noqa: E402
+
+REQUEST_ID = 'c0ffee00-0000-4000-8000-000000000000'
+FLEET_SIZE = 300
+SEED = 7
+START = datetime.datetime(2024, 5, 1, 12, 0, 0)
+
+
+def run_workers(parent, nr_of_workers, now):
+    # What the generation workers do in an invocation, with the state pickled like the fork server does
+    fleet_state = pickle.loads(pickle.dumps(parent.state()))
+    partitions = []
+    for index in range(nr_of_workers):
+        worker = FleetSimulator(FLEET_SIZE, rng=random.Random(SEED + index))
+        worker.load_state(fleet_state)
+        worker.restrict(index, nr_of_workers)
+        batch = worker.tick(FLEET_SIZE, REQUEST_ID, now=now)
+        assert all((vehicle - 1) % nr_of_workers == index for vehicle in batch.columns['vehicleid'])
+        partitions.append(pickle.loads(pickle.dumps(worker.partition_state(index, nr_of_workers))))
+    for partition in partitions:
+        parent.load_state(*partition)
+
+
+def test_workers_continue_the_parents_fleet():
+    parent = FleetSimulator(FLEET_SIZE, rng=random.Random(SEED))
+    run_workers(parent, 3, START)
+    assert list(parent.last_update) == [START.timestamp()] * FLEET_SIZE
+    latitude = list(parent.latitude)
+
+    # The next invocation moves every vehicle from where the previous one left it
+    later = START + datetime.timedelta(seconds=10)
+    run_workers(parent, 3, later)
+    assert list(parent.last_update) == [later.timestamp()] * FLEET_SIZE
+    assert max(abs(a - b) for a, b in zip(parent.latitude, latitude)) < 0.01
+
+
+def test_partition_state_round_trip():
+    fleet = FleetSimulator(FLEET_SIZE, rng=random.Random(SEED))
+    fleet.tick(FLEET_SIZE, REQUEST_ID, now=START)
+    copy = FleetSimulator(FLEET_SIZE)
+    for index in range(4):
+        copy.load_state(*fleet.partition_state(index, 4))
+    assert copy.state() == fleet.state()
@@ -0,0 +1,163 @@
+# The Kinesis reader's InsertBatcher: batching thresholds, the classification of write errors and the
+# mapping of documents that were not written to the records reported in batchItemFailures.
+#
+# Run: python3 -m pytest
+
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'common-layer', 'python'))
+sys.path.insert(0, os.path.join(ROOT, 'kinesis-reader-lambda', 'code'))
+
+from bson.errors import InvalidDocument  # noqa: E402
+from pymongo.errors import AutoReconnect  # noqa: E402
+
+from insert_batcher import (  # noqa: E402
+    DUPLICATE_KEY, InsertBatcher, classify_write_errors, server_limits,
+)
+
+LIMITS = (100000, 48000000)
+
+
+def write_error(index, code):
+    return {'index': index, 'code': code, 'errmsg': f"error {code}"}
+
+
+class FakeInsert:
+    # insert(documents) for the batcher: records every round-trip and fails the documents `fail` picks
+
+    def __init__(self, fail=None, error=None):
+        self.fail = fail or (lambda document: None)
+        self.error = error
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def __call__(self, documents):
+        with self.lock:
+            self.batches.append(documents)
+        if self.error is not None:
+            raise self.error
+        failed = set()
+        rejected = []
+        for index, document in enumerate(documents):
+            outcome = self.fail(document)
+            if outcome == 'failed':
+                failed.add(index)
+            elif outcome == 'rejected':
+                rejected.append(index)
+        return failed, rejected
+
+
+def documents(record, n):
+    return [{'_id': f"{record}-{i}", 'record': record, 'i': i} for i in range(n)]
+
+
+def failed_records(batcher):
+    return [item['itemIdentifier'] for item in batcher.batch_item_failures()]
+
+
+def test_duplicates_count_as_written():
+    details = {'writeErrors': [write_error(0, DUPLICATE_KEY), write_error(3, DUPLICATE_KEY)]}
+    assert classify_write_errors(details, 5) == (2, [], set())
+
+
+@pytest.mark.parametrize('code', [121, 2, 10334])
+def test_deterministic_errors_are_rejected(code):
+    details = {'writeErrors': [write_error(1, code), write_error(2, DUPLICATE_KEY)]}
+    duplicates, rejected, failed = classify_write_errors(details, 3)
+    assert (duplicates, failed) == (1, set())
+    assert [error['index'] for error in rejected] == [1]
+
+
+@pytest.mark.parametrize('code', [24, 46, 11601, 112, 91, 13388, 99999, None])
+def test_other_errors_fail(code):
+    details = {'writeErrors': [write_error(4, code), write_error(0, 121)]}
+    duplicates, rejected, failed = classify_write_errors(details, 5)
+    assert failed == {4}
+    assert [error['index'] for error in rejected] == [0]
+
+
+def test_write_concern_error_fails_everything():
+    details = {'writeErrors': [write_error(0, DUPLICATE_KEY)], 'writeConcernErrors': [{'code': 64}]}
+    assert classify_write_errors(details, 3) == (0, [], {0, 1, 2})
+
+
+def test_server_limits():
+    client = SimpleNamespace(admin=SimpleNamespace(
+        command=lambda name: {'maxWriteBatchSize': 100000, 'maxMessageSizeBytes': 48000000}))
+    assert server_limits(client) == (100000, 48000000)
+
+
+def test_batches_are_capped_at_the_thresholds():
+    insert = FakeInsert()
+    with InsertBatcher(insert, max_documents=250, concurrency=2, limits=LIMITS) as batcher:
+        for record in range(10):
+            batcher.add(str(record), documents(record, 100))
+        batcher.finish()
+    assert sorted(len(batch) for batch in insert.batches) == [250, 250, 250, 250]
+    assert batcher.summary()['documents'] == 1000
+    assert batcher.batch_item_failures() == []
+
+
+def test_batches_are_capped_at_the_server_limits():
+    insert = FakeInsert()
+    with InsertBatcher(insert, max_documents=5000, concurrency=1, limits=(100, 48000000)) as batcher:
+        batcher.add('1', documents(1, 250))
+        batcher.finish()
+    assert [len(batch) for batch in insert.batches] == [100, 100, 50]
+
+
+def test_byte_threshold():
+    insert = FakeInsert()
+    with InsertBatcher(insert, max_bytes=1000, concurrency=1, limits=LIMITS) as batcher:
+        batcher.add('1', documents(1, 100))
+        batcher.finish()
+    assert all(sum(len(document.raw) for document in batch) <= 1000 for batch in insert.batches)
+    assert sum(len(batch) for batch in insert.batches) == 100
+
+
+def test_failed_documents_fail_their_records():
+    insert = FakeInsert(fail=lambda document: 'failed' if document['record'] in (2, 5) and document['i'] == 7 else None)
+    with InsertBatcher(insert, max_documents=30, concurrency=3, limits=LIMITS) as batcher:
+        for record in range(8):
+            batcher.add(str(record), documents(record, 10))
+        batcher.finish()
+    assert sorted(failed_records(batcher)) == ['2', '5']
+    assert batcher.summary()['documents'] == 78
+
+
+def test_rejected_documents_are_skipped():
+    insert = FakeInsert(fail=lambda document: 'rejected' if document['i'] == 0 else None)
+    with InsertBatcher(insert, concurrency=1, limits=LIMITS) as batcher:
+        for record in range(3):
+            batcher.add(str(record), documents(record, 10))
+        batcher.finish()
+    assert batcher.batch_item_failures() == []
+    assert batcher.summary()['documents'] == 27
+    assert batcher.summary()['rejected_documents'] == 3
+
+
+def test_an_error_fails_all_remaining_records():
+    insert = FakeInsert(error=AutoReconnect('cluster unreachable'))
+    with InsertBatcher(insert, max_documents=10, concurrency=1, limits=LIMITS) as batcher:
+        for record in range(5):
+            batcher.add(str(record), documents(record, 10))
+        batcher.finish()
+    assert sorted(failed_records(batcher)) == ['0', '1', '2', '3', '4']
+    assert batcher.summary()['documents'] == 0
+    assert isinstance(batcher.error, AutoReconnect)
+
+
+def test_unencodable_record_adds_nothing():
+    insert = FakeInsert()
+    with InsertBatcher(insert, concurrency=1, limits=LIMITS) as batcher:
+        with pytest.raises(InvalidDocument):
+            batcher.add('1', documents(1, 3) + [{'_id': 'x', 'value': object()}])
+        batcher.add('2', documents(2, 3))
+        batcher.finish()
+    assert [document['record'] for batch in insert.batches for document in batch] == [2, 2, 2]
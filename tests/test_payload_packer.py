@@ -0,0 +1,62 @@
+# The producer's payload packing: payloads packed to the full byte budget stay within the IOT Core limit
+# once the framing header is prepended, for every framed content format.
+#
+# Run: python3 -m pytest
+
+import os
+import random
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'common-layer', 'python'))
+sys.path.insert(0, os.path.join(ROOT, 'iot-lambda', 'code'))
+
+from agri_common import framing  # noqa: E402
+from agri_common.bsonbatch import TelemetryBSONEncoder  # noqa: E402
+from agri_common.encoder import TelemetryEncoder  # noqa: E402
+from agri_common.telemetry import generate_batch  # noqa: E402
+
+from payload_packer import IOT_CORE_MAX_PAYLOAD_BYTES, PayloadPacker, payload_budget  # noqa: E402
+
+REQUEST_ID = 'c0ffee00-0000-4000-8000-000000000000'
+SEED = 7
+
+
+def packed_payloads(packer, encoder, nr_of_batches=20):
+    rng = random.Random(SEED)
+    payloads = []
+    for _ in range(nr_of_batches):
+        for record in encoder.encode_records(generate_batch(200, REQUEST_ID, rng=rng)):
+            packed = packer.add(record)
+            if packed:
+                payloads.append(packed[0])
+    return payloads
+
+
+def test_payload_budget():
+    assert payload_budget(IOT_CORE_MAX_PAYLOAD_BYTES, False) == IOT_CORE_MAX_PAYLOAD_BYTES
+    assert payload_budget(IOT_CORE_MAX_PAYLOAD_BYTES, True) == IOT_CORE_MAX_PAYLOAD_BYTES - framing.HEADER.size
+    assert payload_budget(0, True) == 0
+
+
+@pytest.mark.parametrize('content_format, encoder, delimiters', [
+    (framing.FORMAT_BSON, TelemetryBSONEncoder, (b'', b'', b'')),
+    (framing.FORMAT_JSON_ROWS, TelemetryEncoder, (b'[', b', ', b']')),
+])
+def test_framed_payloads_fit_the_iot_core_limit(content_format, encoder, delimiters):
+    packer = PayloadPacker(payload_budget(IOT_CORE_MAX_PAYLOAD_BYTES, True), *delimiters)
+    payloads = packed_payloads(packer, encoder())
+    assert payloads
+    framed = [framing.frame(payload, framing.CODEC_NONE, content_format) for payload in payloads]
+    assert all(len(payload) <= IOT_CORE_MAX_PAYLOAD_BYTES for payload in framed)
+    # Packed to the full budget, the largest payload is within one record of the limit
+    assert max(len(payload) for payload in framed) > IOT_CORE_MAX_PAYLOAD_BYTES - 1000
+
+
+def test_unframed_rows_use_the_whole_limit():
+    packer = PayloadPacker(payload_budget(IOT_CORE_MAX_PAYLOAD_BYTES, False))
+    payloads = packed_payloads(packer, TelemetryEncoder())
+    assert all(len(payload) <= IOT_CORE_MAX_PAYLOAD_BYTES for payload in payloads)
+    assert max(len(payload) for payload in payloads) > IOT_CORE_MAX_PAYLOAD_BYTES - 1000
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# Pre-generate a seeded telemetry corpus for the replay mode (DATA_GENERATOR = "replay") of the
+# IOT Producer and Load Generator Lambdas. The default output path is packaged with the common layer
+# and ends up at /opt/corpus/telemetry.bin in the functions.
+#
+# Usage: python3 tools/build_corpus.py [--records 200000] [--seed 42] [--output common-layer/corpus/telemetry.bin]
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'common-layer', 'python'))
+
+from agri_common.corpus import write_corpus  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a telemetry corpus for replay')
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=os.path.join(ROOT, 'common-layer', 'corpus', 'telemetry.bin'))
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    start = time.perf_counter()
+    write_corpus(args.output, args.records, args.seed)
+    size = os.path.getsize(args.output)
+    print(f"{args.records:,} records (seed {args.seed}) written to {args.output}: "
+          f"{size / 2**20:.1f} MiB, {size / args.records:.0f} bytes/record, {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Convert the iso string ts values of existing telemetry documents to BSON datetimes, for switching a
+# deployed stack to TS_FORMAT = "epoch_ms". The documents are converted on the server in batches with an
+# update pipeline ($dateFromString, MongoDB 4.2 or later), the strings are read as UTC (the time zone of
+# the Lambda functions that wrote them) with millisecond precision. Documents whose ts is no string are
+# left alone, so the migration can be interrupted and rerun, also while the producers are writing.
+#
+# Usage: python3 tools/migrate_ts.py --uri mongodb+srv://... [--db agridb] [--collection agricol]
+#                                    [--batch-size 5000] [--dry-run] [--create-index]
+
+import argparse
+import os
+import time
+
+from pymongo import ASCENDING, MongoClient
+
+CONVERT_TS = [{'$set': {'ts': {'$dateFromString': {
+    # isoformat() writes microseconds, BSON datetimes hold milliseconds
+    'dateString': {'$substrCP': ['$ts', 0, 23]},
+    'timezone': 'UTC',
+    # Leave values that are no iso timestamps as they are
+    'onError': '$ts',
+}}}}]
+
+STRING_TS = {'ts': {'$type': 'string'}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert iso string ts values to BSON datetimes')
+    parser.add_argument('--uri', default=os.environ.get('MONGODB_URI'), help='connection string (default $MONGODB_URI)')
+    parser.add_argument('--db', default='agridb')
+    parser.add_argument('--collection', default='agricol')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--dry-run', action='store_true', help='only count the documents to convert')
+    parser.add_argument('--create-index', action='store_true',
+                        help='create the {vehicleid: 1, ts: 1} index the query functions use')
+    args = parser.parse_args()
+    if not args.uri:
+        parser.error('--uri or MONGODB_URI is required')
+
+    collection = MongoClient(args.uri)[args.db][args.collection]
+    remaining = collection.count_documents(STRING_TS)
+    print(f"{remaining:,} documents with an iso string ts in {args.db}.{args.collection}")
+    if args.dry_run:
+        return
+
+    converted = 0
+    start = time.perf_counter()
+    selection = dict(STRING_TS)
+    while True:
+        # Page through the documents in _id order and convert one batch at a time. The filter is repeated
+        # in the update, so documents written with a datetime in the meantime are not touched.
+        ids = [document['_id'] for document in
+               collection.find(selection, {'_id': 1}).sort('_id', ASCENDING).limit(args.batch_size)]
+        if not ids:
+            break
+        result = collection.update_many({'_id': {'$in': ids}, **STRING_TS}, CONVERT_TS)
+        converted += result.modified_count
+        selection['_id'] = {'$gt': ids[-1]}
+        elapsed = time.perf_counter() - start
+        print(f"{converted:,} converted, {converted / elapsed:,.0f} documents/s")
+
+    left = collection.count_documents(STRING_TS)
+    print(f"done: {converted:,} documents converted in {time.perf_counter() - start:.1f} s, "
+          f"{left:,} documents still have a string ts (not parsable, or written by iso producers meanwhile)")
+
+    if args.create_index:
+        # Equality on vehicleid first, then the ts range (equality, sort, range order)
+        name = collection.create_index([('vehicleid', ASCENDING), ('ts', ASCENDING)])
+        print(f"index {name} is in place")
+
+
+if __name__ == '__main__':
+    main()